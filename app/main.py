@@ -1,36 +1,45 @@
 # main.py
 
 import streamlit as st
-from neo4j import GraphDatabase, basic_auth
-import os
 from modules.logger import get_logger
 from ui_import import run_import   # calls ui_import.main()
 from ui_chat import run_chat             # calls your chat entrypoint
 from ui_map import show_map_view
+from modules.neo4j.import_state import current_import_version
+from modules.neo4j.connection import is_populated, pool_metrics
 
 log = get_logger(__name__)
 
-# Pull credentials from env (same vars used by ui_import.py)
-NEO4J_URI  = os.getenv("NEO4J_URI",  "bolt://localhost:7687")
-NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
-NEO4J_PASS = os.getenv("NEO4J_PASS") or os.getenv("NEO4J_PASSWORD", "")
-
 # ---------------------------------------------------------------------------
-def _neo4j_empty() -> bool:
+def _import_version() -> int | None:
     """
-    Return True if Neo4j has zero nodes. If any exception occurs
-    (e.g. bad creds, network issues), treat it as “empty” so the
-    import UI can surface for the user to fix credentials.
+    Last completed DuckDB import. While an import holds the DuckDB file the
+    version cannot be read → fall back to the last one this session saw (or None).
     """
     try:
-        driver = GraphDatabase.driver(NEO4J_URI, auth=basic_auth(NEO4J_USER, NEO4J_PASS))
-        with driver.session() as session:
-            total = session.run("MATCH (n) RETURN count(n) AS total").single()["total"]
-        driver.close()
-        return (total or 0) == 0
-    except Exception as e:
-        log.warning("Could not check Neo4j emptiness: %s", e)
-        return True
+        st.session_state["import_version"] = current_import_version()
+    except Exception as exc:                                   # noqa: BLE001 - e.g. DuckDB locked by a running import
+        log.warning("Import version unavailable (%s) → using last known", exc)
+    return st.session_state.get("import_version")
+
+def _neo4j_empty() -> bool:
+    """
+    Return True if Neo4j holds no import. Uses the shared driver and the
+    cached ImportMeta check (see modules/neo4j/connection.py); unreachable
+    databases count as “empty” so the import UI can surface for the user
+    to fix credentials.
+    """
+    return not is_populated(_import_version())
+
+def _show_pool_metrics() -> None:
+    """Neo4j session/query counters of this server process in the sidebar."""
+    m = pool_metrics()
+    with st.sidebar.expander("🔌 Neo4j-Verbindungen"):
+        st.caption(
+            f"Abfragen: {m['queries']:.0f} · Fehler: {m['query_errors']:.0f} · "
+            f"Ø {m['avg_query_ms']} ms · aktive Sessions: {m['sessions_active']:.0f}"
+        )
+        st.caption(f"Driver offen: {m['drivers_open']} · Pool je Driver max. {m['max_pool_size']} Verbindungen")
 
 # ---------------------------------------------------------------------------
 def main() -> None:
@@ -45,11 +54,19 @@ def main() -> None:
         if st.button("🚀 Start Import"):
             run_import()
     else:
-        page = st.sidebar.radio("📚 Navigation", ["🧠 Chat", "🗺️ Karte"])
+        page = st.sidebar.radio("📚 Navigation", ["🧠 Chat", "🗺️ Karte", "📦 Import"])
+        _show_pool_metrics()
         if page == "🧠 Chat":
             run_chat()
         elif page == "🗺️ Karte":
             show_map_view()
+        elif page == "📦 Import":
+            st.title("Wadi Abu Dom – GeoImporter")
+            st.caption(f"Selected: `data/WADI_12_2016.gpkg` · Import-Version: {_import_version()}")
+            delta = st.toggle("Nur Änderungen importieren (Delta)", value=True)
+            export_csv = st.toggle("CSV-Artefakte schreiben", value=False)
+            if st.button("🚀 Start Import"):
+                run_import(delta=delta, export_csv=export_csv)
 
 if __name__ == "__main__":
     main()
@@ -2,109 +2,261 @@ from __future__ import annotations
 
 import streamlit as st
 import json
-from modules.helper import run_cypher, run_python_code
-from modules.llm import (
-    extract_semantic_structure, 
-    generate_analysis_code, 
-    generate_cypher, 
-    explain_cypher_result, 
-    explain_de,
-    extract_relevant_data, 
-    decide_query_or_python
-)
-from pathlib import Path
+import uuid
+import pandas as pd
+from modules.orchestrator import AnalysisResult, AnalysisUpdate, iter_updates, plan
 from modules.logger import get_logger
+from modules import jobs, worker_pool
+from modules.workspace import open_workspace
 
 logger = get_logger("debug")
 
-def run_chat() -> None:
-    """Run the conversational archaeology chatbot interface."""
-    st.title("📜 Archaeology Chatbot")
+STAGE_ERRORS = {
+    "cypher":     "❌ Fehler bei Cypher-Ausführung",
+    "vector":     "❌ Fehler bei der Vektorsuche",
+    "params":     "❌ Parameterbestimmung fehlgeschlagen",
+    "extraction": "❌ Datenextraktion fehlgeschlagen",
+    "code":       "❌ Codegenerierung fehlgeschlagen",
+    "run":        "❌ Ausführung fehlgeschlagen",
+    "explain":    "❌ Erklärung fehlgeschlagen",
+}
+STAGE_LABELS = {
+    "params":          "Parameter werden bestimmt",
+    "plan_extraction": "Extraktion wird geplant",
+    "extraction":      "Daten werden extrahiert",
+    "code":            "Code wird generiert",
+    "run":             "Analyse läuft",
+    "generate_cypher": "Cypher wird generiert",
+    "run_cypher":      "Cypher läuft",
+    "vector_search":   "Vektorsuche läuft",
+    "explain":         "Erklärung wird geschrieben",
+}
+PRIORITIES = {-1: "niedrig", 0: "normal", 1: "hoch"}
+JOB_HISTORY = 10                        # jobs of the session shown above the input
+LIVE_REFRESH = 1.0                      # seconds between polls of a running job
 
-    if "history" not in st.session_state:
-        st.session_state.history = []
 
-    user_input = st.chat_input("Frage stellen …")
-    if not user_input:
+def _render_map(path: str) -> None:
+    """Small inline point preview of a result GeoJSON (full map in the map view)."""
+    import geopandas as gpd
+
+    try:
+        gdf = gpd.read_file(path)
+        gdf = gdf.set_crs("EPSG:4326") if gdf.crs is None else gdf.to_crs("EPSG:4326")
+        points = gdf.geometry[~gdf.geometry.is_empty].centroid
+        st.subheader("🗺️ Karte")
+        st.map(pd.DataFrame({"lat": points.y, "lon": points.x}), size=20)
+        st.caption(f"`{path}` – vollständig in der Kartenansicht")
+    except Exception as e:
+        st.warning(f"⚠️ Kartenvorschau nicht möglich: {e}")
+
+
+def _render_body(result: AnalysisResult) -> None:
+    """Rows / stdout / map of one analysis (re-rendered whenever a stage finishes)."""
+    if result.decision == "cypher" and result.rows is not None:
+        preview = result.rows[:10] if isinstance(result.rows, list) else result.rows
+        st.subheader("📈 Ergebnis (Cypher-Vorschau)")
+        st.json(preview, expanded=False)
+
+    elif result.decision == "vector" and result.rows is not None:
+        st.subheader("🧭 Ähnlichste Einträge (Vektorsuche)")
+        st.dataframe(result.rows, use_container_width=True)
+
+    elif result.decision == "python":
+        if result.cached:
+            st.caption("♻️ Ergebnis aus dem Analyse-Cache (gleiche Daten und Parameter)")
+        if result.stdout:
+            st.subheader("💻 Python stdout")
+            st.code(result.stdout.strip(), language="text")
+
+        if result.stderr:
+            st.subheader("⚠️ Python stderr")
+            st.code(result.stderr.strip(), language="text")
+
+        if result.geojson:
+            _render_map(result.geojson)
+
+
+def _render_internals(result: AnalysisResult) -> None:
+    if result.query or result.code:
+        with st.expander("🧰️ Internals", expanded=False):
+            if result.query:
+                st.markdown("**Cypher:**")
+                st.code(result.query, language="cypher")
+            if result.code:
+                st.markdown("**Python-Code:**")
+                st.code(result.code, language="python")
+            if result.workspace:
+                st.caption(f"Arbeitsbereich: `{result.workspace}` (Ausgaben, Logs, manifest.json)")
+
+
+def _render_status(target, result: AnalysisResult, running: bool) -> None:
+    """Error, permutation progress or current stage of one analysis into *target*."""
+    if result.error:
+        stage, _, message = result.error.partition(": ")
+        if stage == "decision":
+            target.warning(f"❌ Unbekannter Entscheidungstyp: {result.decision}")
+        else:
+            target.error(f"{STAGE_ERRORS.get(stage, '❌ Fehler')}: {message}")
+    elif running and result.progress and result.stage == "run":
+        done, total = result.progress["done"], result.progress["total"]
+        target.progress(min(1.0, done / max(total, 1)),
+                        text=f"⏳ {STAGE_LABELS['run']} – {result.progress['label']} {done}/{total}")
+    elif running and result.stage:
+        target.info(f"⏳ {STAGE_LABELS.get(result.stage, result.stage)} …")
+    elif running:
+        target.info("⏳ läuft …")
+    else:
+        target.empty()
+
+
+class _Slot:
+    """Placeholders of one analysis in the answer, filled while its pipeline runs."""
+
+    def __init__(self, index: int, decision_type: str, analysis_type: str):
+        st.markdown(f"---\n\n### 🔍 Analyse {index}: `{analysis_type}`")
+        st.markdown(f"**Entscheidung:** `{decision_type}`")
+        self.status = st.empty()
+        self.body = st.empty()
+        self.explanation = st.empty()
+        self.internals = st.empty()
+        self.status.info("⏳ läuft …")
+
+    def update(self, update: AnalysisUpdate) -> None:
+        result = update.result
+        if update.kind == "stage":
+            with self.body.container():
+                _render_body(result)
+            if update.text == "output":
+                self.status.info("✍️ Erklärung wird geschrieben …")
+            else:
+                _render_status(self.status, result, running=True)
+        elif update.kind == "token":
+            self.explanation.markdown(result.explanation + "▌")
+        elif update.kind == "done":
+            self.finish(result)
+
+    def finish(self, result: AnalysisResult) -> None:
+        with self.body.container():
+            _render_body(result)
+        _render_status(self.status, result, running=False)
+        if result.explanation:
+            self.explanation.markdown(result.explanation)
+        with self.internals.container():
+            _render_internals(result)
+        if result.geojson:
+            st.session_state["last_geojson"] = result.geojson
+
+
+def _render_job(job_id: str) -> None:
+    """Question, status and analyses of one background job as stored in ``modules.jobs``."""
+    job = jobs.get_job(job_id)
+    if job is None:
         return
+    with st.chat_message("user"):
+        st.markdown(job.question)
+    with st.chat_message("assistant"):
+        if job.status == "queued":
+            st.info(f"🕒 Wartet auf einen freien Platz (Position {jobs.queue_position(job.id)}, "
+                    f"Priorität {PRIORITIES.get(job.priority, job.priority)})")
+        elif job.active and job.stage in ("", "planning"):
+            st.info("⏳ Analyse wird geplant …")
+        elif job.status == "cancelled":
+            st.warning("⏹️ Abgebrochen")
+        elif job.status == "failed":
+            st.error(f"❌ {job.error}")
+        if job.active and st.button("⏹️ Abbrechen", key=f"cancel_{job.id}"):
+            jobs.cancel(job.id)
+            st.rerun()
+
+        for state in job.results:
+            result = AnalysisResult(**state)
+            running = job.active and not result.timings.get("explain") and not result.error
+            st.markdown(f"---\n\n### 🔍 Analyse {result.index}: `{result.analysis_type}`")
+            st.markdown(f"**Entscheidung:** `{result.decision}`")
+            _render_status(st, result, running)
+            _render_body(result)
+            if result.explanation:
+                st.markdown(result.explanation + ("▌" if running else ""))
+            _render_internals(result)
+            if result.geojson and not job.active:
+                st.session_state["last_geojson"] = result.geojson
+
+
+@st.experimental_fragment(run_every=LIVE_REFRESH)
+def _live_job(job_id: str) -> None:
+    """Polls a running job; once it has finished the whole page is rendered again (statically)."""
+    _render_job(job_id)
+    job = jobs.get_job(job_id)
+    if job is not None and not job.active:
+        st.rerun()
 
+
+def _run_inline(user_input: str, force: bool) -> None:
+    """Whole pipeline inside this script run (``ANALYSIS_JOBS=0``): results stream in, a rerun stops it."""
     st.session_state.history.append(("user", user_input))
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    with st.chat_message("assistant"):
-        with st.spinner("Analyse läuft …"):
-            decisions = decide_query_or_python(user_input)
+    # own workspace per question: parallel sessions don't overwrite each other's results
+    workspace = open_workspace(user_input, session=st.session_state.session_id)
+    status = "cancelled"                    # a rerun stops the script mid-way
+    try:
+        with workspace.active(), st.chat_message("assistant"):
+            with st.spinner("Analyse wird geplant …"):
+                decisions, prepared = plan(user_input)
 
             if not decisions:
+                status = "empty"
                 st.error("❌ Keine gültige Analyse erkannt.")
                 return
 
-            for i, (decision_type, structure, analysis_type) in enumerate(decisions, start=1):
-                st.markdown(f"---\n\n### 🔍 Analyse {i}: `{analysis_type}`")
-                st.markdown(f"**Entscheidung:** `{decision_type}`")
-
-                if decision_type == "cypher":
-                    try:
-                        query = generate_cypher(user_input)
-                        rows = run_cypher(query)
-                        preview = rows[:10] if isinstance(rows, list) else rows
-
-                        st.subheader("📈 Ergebnis (Cypher-Vorschau)")
-                        st.json(preview, expanded=False)
-
-                        explanation = explain_cypher_result(user_input, rows)
-                        st.markdown(explanation)
-
-                        with st.expander("🧰️ Internals", expanded=False):
-                            st.markdown("**Cypher:**")
-                            st.code(query, language="cypher")
-                    except Exception as e:
-                        st.error(f"❌ Fehler bei Cypher-Ausführung: {e}")
-
-                elif decision_type == "python":
-                    try:
-                        extract_relevant_data(user_input, structure=structure)
-                    except Exception as e:
-                        st.error(f"❌ Datenextraktion fehlgeschlagen: {e}")
-                        continue
-
-                    try:
-                        analysis_outputs = generate_analysis_code(user_input, structure=structure, analysis_type=analysis_type)
-                    except Exception as e:
-                        st.error(f"❌ Codegenerierung fehlgeschlagen: {e}")
-                        continue
-
-                    current = next(
-                        (o for o in analysis_outputs if isinstance(o, dict) and o.get("analysis_type") == analysis_type),
-                        None
-                    )
-                    if not current:
-                        st.warning(f"⚠️ Kein Code-Output für Typ `{analysis_type}` gefunden.")
-                        continue
-
-                    code = current["code"]
-                    stdout, stderr = run_python_code(code)
-
-                    if stdout:
-                        st.subheader("💻 Python stdout")
-                        st.code(stdout.strip(), language="text")
-
-                    if stderr:
-                        st.subheader("⚠️ Python stderr")
-                        st.code(stderr.strip(), language="text")
-
-                    geojson_files = list(Path("results").rglob(f"visualisierung/{analysis_type}/*.geojson"))
-                    if geojson_files:
-                        latest_geojson = max(geojson_files, key=lambda f: f.stat().st_mtime)
-                        st.session_state["last_geojson"] = str(latest_geojson)
-
-                    explanation = explain_de(user_input, stdout, stderr)
-                    st.markdown(explanation)
-
-                    with st.expander("🧰️ Internals", expanded=False):
-                        st.markdown("**Python-Code:**")
-                        st.code(code, language="python")
-
-                else:
-                    st.warning(f"❌ Unbekannter Entscheidungstyp: {decision_type}")
\ No newline at end of file
+            # one slot per analysis in question order, filled as the pipelines report progress
+            slots = {
+                i: _Slot(i, decision_type, analysis_type)
+                for i, (decision_type, _, analysis_type) in enumerate(decisions, start=1)
+            }
+            for update in iter_updates(user_input, decisions, prepared=prepared, force=force, workspace=workspace):
+                slots[update.result.index].update(update)
+        status = "done"
+    finally:
+        workspace.close(status)
+
+
+def run_chat() -> None:
+    """Run the conversational archaeology chatbot interface."""
+    st.title("📜 Archaeology Chatbot")
+
+    if "history" not in st.session_state:
+        st.session_state.history = []
+    if "session_id" not in st.session_state:
+        # kept in the URL: after a browser refresh the session's jobs are found again
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex[:8]
+    st.query_params["session"] = st.session_state.session_id
+    if worker_pool.POOL_ENABLED and not jobs.JOBS_ENABLED:
+        worker_pool.get_pool()              # workers import their libraries while the user types
+
+    left, right = st.columns(2)
+    force = left.toggle("🔄 Neu berechnen (Analyse-Cache ignorieren)", value=False,
+                        help="Daten neu extrahieren und Analysen neu rechnen statt gespeicherte Ergebnisse zu nutzen")
+    priority = right.select_slider("Priorität", options=list(PRIORITIES), value=0, format_func=PRIORITIES.get,
+                                   disabled=not jobs.JOBS_ENABLED)
+
+    if jobs.JOBS_ENABLED:
+        jobs.get_runner()
+        for job in reversed(jobs.list_jobs(session=st.session_state.session_id, limit=JOB_HISTORY)):
+            if job.active:
+                _live_job(job.id)
+            else:
+                _render_job(job.id)
+
+    user_input = st.chat_input("Frage stellen …")
+    if not user_input:
+        return
+
+    if jobs.JOBS_ENABLED:
+        st.session_state.history.append(("user", user_input))
+        jobs.submit(user_input, session=st.session_state.session_id, priority=priority, force=force)
+        st.rerun()
+    else:
+        _run_inline(user_input, force)
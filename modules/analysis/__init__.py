@@ -0,0 +1,61 @@
+"""
+Analysebibliothek
+-----------------
+Die sechs Standardanalysen als Funktionen ``(daten, params) → AnalysisOutput``
+statt per Jinja gerendertem Skript im Subprozess:
+
+* Eingabe: GeoDataFrame, Arrow-Tabelle oder Pfad der Übergabedatei
+* Ausgabe: ``summary`` (Kennzahlen), ``layers`` (GeoDataFrames für die Karte),
+  ``tables``, ``messages``; ``save_output`` schreibt sie an die bisherigen Orte
+* Datenprobleme (leere Gruppe, fehlende Spalte, Varianz 0) → ``AnalysisError``
+* ``input_columns`` – Spalten, die eine Analyse mit gegebenen Parametern liest
+* ``cached_run`` – wie ``run_analysis``, mit inhaltsadressiertem Ergebnis-Cache
+  (``modules.analysis.cache``)
+
+Freie, generierte Skripte laufen weiterhin über ``helper.run_python_code``.
+
+Einfache Nutzung:  ▸  from modules.analysis import run_analysis, save_output
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+from modules.analysis.autocorrelation import autocorrelation, input_columns as autocorrelation_columns
+from modules.analysis.base import AnalysisData, AnalysisError, AnalysisOutput, as_geodataframe, save_output
+from modules.analysis.cache import cached_run
+from modules.analysis.colocation import colocation, input_columns as colocation_columns
+from modules.analysis.correlation import correlation, input_columns as correlation_columns
+from modules.analysis.hotspot import hotspot, input_columns as hotspot_columns
+from modules.analysis.ripley_k import ripley_k, input_columns as ripley_k_columns
+from modules.analysis.spatial_distance import spatial_distance, input_columns as spatial_distance_columns
+
+ANALYSES: dict[str, Callable[[AnalysisData, dict], AnalysisOutput]] = {
+    "autocorrelation":  autocorrelation,
+    "colocation":       colocation,
+    "correlation":      correlation,
+    "hotspot":          hotspot,
+    "ripley_k":         ripley_k,
+    "spatial_distance": spatial_distance,
+}
+
+# Columns of analysis_input each analysis reads for given params (projection pushdown in modules.llm)
+INPUT_COLUMNS: dict[str, Callable[[dict], set[str]]] = {
+    "autocorrelation":  autocorrelation_columns,
+    "colocation":       colocation_columns,
+    "correlation":      correlation_columns,
+    "hotspot":          hotspot_columns,
+    "ripley_k":         ripley_k_columns,
+    "spatial_distance": spatial_distance_columns,
+}
+
+
+def run_analysis(analysis_type: str, data: AnalysisData, params: dict) -> AnalysisOutput:
+    """Dispatch to the library function of *analysis_type* (``KeyError`` if there is none)."""
+    return ANALYSES[analysis_type](data, params or {})
+
+
+def input_columns(analysis_type: Optional[str], params: Optional[dict]) -> Optional[set[str]]:
+    """Columns *analysis_type* reads with *params*; None for analyses without a library function."""
+    columns = INPUT_COLUMNS.get(analysis_type or "")
+    return columns(params or {}) if columns else None
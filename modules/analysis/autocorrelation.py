@@ -0,0 +1,112 @@
+"""
+Räumliche Autokorrelation (Moran's I global + LISA)
+---------------------------------------------------
+* Werte: ``value_column`` oder – bei zwei Kategoriegruppen – Indikator 1/0 aus
+  ``group_column`` (``group_a`` = 1, ``group_b`` = 0, Rest entfällt)
+* Ohne beides: Anzahl Features je ``SiteID``
+* Gewichte: binäres Distanzband (``distance_threshold``, Standard 5000 m)
+
+Einfache Nutzung:  ▸  from modules.analysis import autocorrelation
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from modules.analysis.base import (
+    DEFAULT_DISTANCE,
+    AnalysisData,
+    AnalysisError,
+    AnalysisOutput,
+    as_geodataframe,
+    coordinates,
+    labels,
+    numeric,
+    param,
+    point_columns,
+    points,
+    report_progress,
+    require_columns,
+    scalar,
+)
+
+PERMUTATIONS = 999
+
+
+def input_columns(params: dict) -> set[str]:
+    """Columns of the analysis input :func:`autocorrelation` reads with *params*."""
+    columns = point_columns(params)
+    value_column = param(params, "value_column")
+    if value_column is None and labels(param(params, "group_a")) and labels(param(params, "group_b")):
+        columns.add(param(params, "group_column", "feature_Category"))
+    elif value_column is None or value_column == "feature_count":
+        columns.add("SiteID")
+    else:
+        columns.add(value_column)
+    return columns
+
+
+def autocorrelation(data: AnalysisData, params: dict) -> AnalysisOutput:
+    """Global Moran's I and local clusters (1 HH, 2 LH, 3 LL, 4 HL) per point."""
+    from esda.moran import Moran, Moran_Local
+    from libpysal.weights import DistanceBand
+
+    gdf = points(as_geodataframe(data, params))
+    if gdf.empty:
+        raise AnalysisError("input is empty")
+    messages = [f"Input records: {len(gdf):,}"]
+
+    value_column = param(params, "value_column")
+    group_a, group_b = labels(param(params, "group_a")), labels(param(params, "group_b"))
+    if value_column is None and group_a and group_b:
+        group_column = param(params, "group_column", "feature_Category")
+        require_columns(gdf, group_column)
+        gdf["_binary"] = np.where(gdf[group_column].isin(group_a), 1.0,
+                                  np.where(gdf[group_column].isin(group_b), 0.0, np.nan))
+        gdf = gdf.dropna(subset=["_binary"])
+        value_column = "_binary"
+        messages.append(f"Binary indicator from {group_column}: {len(gdf):,} records in group A or B")
+    elif value_column is None or (value_column == "feature_count" and value_column not in gdf.columns):
+        require_columns(gdf, "SiteID")
+        value_column = "feature_count"
+        gdf[value_column] = gdf.groupby("SiteID")["SiteID"].transform("count")
+    else:
+        require_columns(gdf, value_column)
+        gdf[value_column] = numeric(gdf, value_column)
+        gdf = gdf.dropna(subset=[value_column])
+
+    values = gdf[value_column].to_numpy(dtype=float)
+    if len(values) < 3:
+        raise AnalysisError("too few records for Moran's I")
+    if values.var() == 0:
+        raise AnalysisError("selected values have zero variance – cannot compute Moran's I")
+
+    threshold = float(param(params, "distance_threshold", DEFAULT_DISTANCE))
+    w = DistanceBand(coordinates(gdf), threshold=threshold, binary=True, silence_warnings=True)
+    report_progress("permutations", 0, 2 * PERMUTATIONS)        # esda permutes internally → per block
+    mi = Moran(values, w, two_tailed=True, permutations=PERMUTATIONS)
+    report_progress("permutations", PERMUTATIONS, 2 * PERMUTATIONS)
+    messages.append(f"Moran's I = {scalar(mi.I):.4f}, z = {scalar(mi.z_norm):+.3f}, p = {scalar(mi.p_sim):.4f} (simulated)")
+
+    lisa = Moran_Local(values, w, permutations=PERMUTATIONS, seed=42)
+    report_progress("permutations", 2 * PERMUTATIONS, 2 * PERMUTATIONS)
+    gdf["I_local"] = lisa.Is
+    gdf["I_z"] = lisa.z_sim
+    gdf["I_p"] = lisa.p_sim
+    gdf["cluster"] = np.where(lisa.p_sim <= 0.05, lisa.q, 0)
+    gdf["sig05"] = gdf["I_p"] <= 0.05
+
+    summary = {
+        "I": scalar(mi.I),
+        "z": scalar(mi.z_norm),
+        "p_sim": scalar(mi.p_sim),
+        "n": int(mi.n),
+        "value_column": value_column,
+        "distance_threshold": threshold,
+        "var": float(values.var()),
+        "n_significant_local": int(gdf["sig05"].sum()),
+        "islands": list(w.islands),
+        "n_islands": len(w.islands),
+        "pct_islands": round(len(w.islands) / len(gdf) * 100, 2),
+    }
+    return AnalysisOutput("autocorrelation", summary, layers={"autocorrelation_result": gdf}, messages=messages)
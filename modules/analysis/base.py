@@ -0,0 +1,226 @@
+"""
+Gemeinsame Bausteine der Analysefunktionen
+------------------------------------------
+* ``AnalysisOutput`` – Kennzahlen (``summary``), Kartenebenen (``layers``),
+  Tabellen und Protokollzeilen einer Analyse
+* ``as_geodataframe`` – GeoDataFrame aus GeoDataFrame, Arrow-Tabelle oder
+  Pfad der Übergabedatei (geladene Eingaben bleiben im Speicher)
+* ``save_output`` – schreibt Ergebnis-JSON und GeoJSON-Ebenen an die bisherigen
+  Orte (``results/<typ>/``, ``results/visualisierung/<typ>/``)
+* ``input_columns`` je Analyse – welche Spalten der Übergabedatei sie mit
+  gegebenen Parametern liest (Grundlage der RETURN-Reduktion in ``modules.llm``)
+* ``report_progress`` – Fortschritt langer Schritte (Permutationen erledigt/gesamt)
+  an den Aufrufer, der ihn mit ``progress_callback`` abonniert
+
+Einfache Nutzung:  ▸  from modules.analysis.base import AnalysisOutput, as_geodataframe
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from modules.analysis_io import DEFAULT_CRS, XY_CANDIDATES, input_path, read_analysis_table, table_to_geodataframe
+from modules.logger import get_logger
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DEFAULT_DISTANCE = 5000            # metres (EPSG:32636)
+RESULTS_DIR = Path("results")
+FRAME_CACHE_SIZE = 4               # loaded inputs shared by the analyses of one question
+
+AnalysisData = Union[gpd.GeoDataFrame, pd.DataFrame, pa.Table, str, Path]
+Progress = Callable[[str, int, int], None]          # (label, done, total)
+
+_progress: contextvars.ContextVar[Optional[Progress]] = contextvars.ContextVar("analysis_progress", default=None)
+
+
+class AnalysisError(ValueError):
+    """The data does not allow the analysis (empty group, missing column, zero variance …)."""
+
+
+@dataclass
+class AnalysisOutput:
+    """Structured result of one analysis."""
+    analysis_type: str
+    summary: dict[str, Any]
+    layers: dict[str, gpd.GeoDataFrame] = field(default_factory=dict)
+    tables: dict[str, pd.DataFrame] = field(default_factory=dict)
+    messages: list[str] = field(default_factory=list)
+
+    def to_text(self) -> str:
+        """Log lines plus the summary as JSON – what the generated scripts printed to stdout."""
+        return "\n".join([*self.messages, json.dumps(jsonable(self.summary), ensure_ascii=False)])
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def jsonable(value: Any) -> Any:
+    """Plain JSON types (numpy scalars/arrays converted, NaN/inf → null)."""
+    if isinstance(value, dict):
+        return {str(k): jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return jsonable(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def scalar(x: Any) -> float:
+    """Python float even if *x* is a 0-d ndarray."""
+    return float(np.asarray(x).ravel()[0])
+
+def param(params: dict, key: str, default: Any = None) -> Any:
+    """``params[key]`` unless missing or null (the LLM fills absent keys with null)."""
+    value = (params or {}).get(key)
+    return default if value is None or value == "" else value
+
+def labels(value: Any) -> list:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+def require_columns(df: pd.DataFrame, *columns: Optional[str]) -> None:
+    missing = [c for c in columns if c and c not in df.columns]
+    if missing:
+        raise AnalysisError(f"missing columns: {', '.join(missing)}")
+
+def category_column(params: dict, side: str) -> str:
+    """``<group_x_type>_Category`` (``feature`` | ``site``) the labels of ``group_<side>`` refer to."""
+    kind = str(param(params, f"group_{side}_type", "feature")).lower()
+    return f"{'site' if kind.startswith('site') else 'feature'}_Category"
+
+def point_columns(params: dict) -> set[str]:
+    """Coordinate columns behind ``as_geodataframe``: the X/Y params, else the default geometry pair."""
+    x_col, y_col = param(params, "x_column"), param(params, "y_column")
+    return {x_col, y_col} if x_col and y_col else set(XY_CANDIDATES[0])
+
+def points(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Rows with a usable point geometry."""
+    if not isinstance(gdf, gpd.GeoDataFrame):
+        raise AnalysisError("input has no coordinates")
+    valid = gdf.geometry.notna() & ~gdf.geometry.is_empty
+    return gdf[valid]
+
+def coordinates(gdf: gpd.GeoDataFrame) -> np.ndarray:
+    return np.column_stack([gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy()])
+
+def numeric(df: pd.DataFrame, column: str) -> pd.Series:
+    return pd.to_numeric(df[column], errors="coerce")
+
+# ---------------------------------------------------------------------------
+# Progress
+# ---------------------------------------------------------------------------
+def report_progress(label: str, done: int, total: int) -> None:
+    """Tell the caller how far a long step is (no-op unless someone listens)."""
+    callback = _progress.get()
+    if callback is not None:
+        callback(label, done, total)
+
+@contextmanager
+def progress_callback(callback: Optional[Progress]) -> Iterator[None]:
+    """Receive ``report_progress`` calls of the analyses run in this context."""
+    token = _progress.set(callback)
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+# ---------------------------------------------------------------------------
+# Input
+# ---------------------------------------------------------------------------
+_FRAMES: OrderedDict[tuple, gpd.GeoDataFrame] = OrderedDict()
+_FRAMES_LOCK = threading.Lock()
+
+def as_geodataframe(data: AnalysisData, params: Optional[dict] = None) -> gpd.GeoDataFrame:
+    """
+    GeoDataFrame for *data* using ``x_column`` / ``y_column`` from *params*. Files are
+    loaded once per (path, mtime, x, y); every caller gets its own copy.
+    """
+    x_col, y_col = param(params, "x_column"), param(params, "y_column")
+    if isinstance(data, gpd.GeoDataFrame) and not (x_col and y_col and {x_col, y_col} <= set(data.columns)):
+        return data.copy()
+    if isinstance(data, pd.DataFrame):
+        if not (x_col and y_col):
+            return data.copy()
+        require_columns(data, x_col, y_col)
+        geometry = gpd.points_from_xy(numeric(data, x_col), numeric(data, y_col))
+        return gpd.GeoDataFrame(pd.DataFrame(data).drop(columns="geometry", errors="ignore"),
+                                geometry=geometry, crs=getattr(data, "crs", None) or DEFAULT_CRS)
+    if isinstance(data, pa.Table):
+        return table_to_geodataframe(data, x_col=x_col, y_col=y_col)
+
+    path = input_path(data)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, x_col, y_col)
+    with _FRAMES_LOCK:
+        frame = _FRAMES.get(key)
+        if frame is not None:
+            _FRAMES.move_to_end(key)
+    if frame is None:
+        frame = table_to_geodataframe(read_analysis_table(path), x_col=x_col, y_col=y_col)
+        with _FRAMES_LOCK:
+            _FRAMES[key] = frame
+            while len(_FRAMES) > FRAME_CACHE_SIZE:
+                _FRAMES.popitem(last=False)
+    return frame.copy()
+
+def as_dataframe(data: AnalysisData, columns: Iterable[str]) -> pd.DataFrame:
+    """Only *columns* as plain DataFrame (no geometry decoding)."""
+    columns = list(columns)
+    if isinstance(data, pd.DataFrame):
+        require_columns(data, *columns)
+        return pd.DataFrame(data[columns])
+    table = data if isinstance(data, pa.Table) else read_analysis_table(data)
+    missing = [c for c in columns if c not in table.column_names]
+    if missing:
+        raise AnalysisError(f"missing columns: {', '.join(missing)}")
+    return table.select(columns).to_pandas()
+
+# ---------------------------------------------------------------------------
+# Output
+# ---------------------------------------------------------------------------
+def save_output(output: AnalysisOutput, results_dir: Union[str, Path] = RESULTS_DIR) -> Optional[Path]:
+    """
+    Write ``<type>/<type>_result.json``, the layers as GeoJSON (EPSG:4326) and the tables
+    as CSV under ``visualisierung/<type>/``. Returns the first layer written (map preview).
+    """
+    results_dir = Path(results_dir)
+    summary_dir = results_dir / output.analysis_type
+    layer_dir = results_dir / "visualisierung" / output.analysis_type
+    summary_dir.mkdir(parents=True, exist_ok=True)
+    (summary_dir / f"{output.analysis_type}_result.json").write_text(
+        json.dumps(jsonable(output.summary), indent=2, ensure_ascii=False), encoding="utf-8"
+    )
+
+    first: Optional[Path] = None
+    if output.layers or output.tables:
+        layer_dir.mkdir(parents=True, exist_ok=True)
+    for name, layer in output.layers.items():
+        if layer.empty:
+            continue
+        path = layer_dir / f"{name}.geojson"
+        path.unlink(missing_ok=True)
+        layer = layer.set_crs(DEFAULT_CRS) if layer.crs is None else layer
+        layer.to_crs("EPSG:4326").to_file(path, driver="GeoJSON")
+        first = first or path
+    for name, table in output.tables.items():
+        table.to_csv(layer_dir / f"{name}.csv", index=False)
+    return first
@@ -0,0 +1,310 @@
+"""
+Inhaltsadressierter Cache für Analyseergebnisse
+-----------------------------------------------
+Sitzt vor ``run_analysis``: gleiche Eingabedaten + gleiche Parameter → gleiches
+Ergebnis, ohne erneut 999 Permutationen zu rechnen.
+
+* Schlüssel = sha256(Hash der Eingabedatei, Analyse-Typ, normalisierte Parameter,
+  Bibliotheksversionen, Quelltext der Analysefunktion)
+* Ablage unter ``cache/analysis_results/<key>/`` (Summary-JSON, Ebenen als
+  GeoParquet, Tabellen als Parquet), Index in SQLite
+* Neue Import-Version → alle älteren Einträge werden verworfen
+* Größenlimit ``ANALYSIS_CACHE_MAX_MB`` (LRU); ``force=True`` rechnet neu
+
+Einfache Nutzung:  ▸  from modules.analysis.cache import cached_run
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Optional
+
+import geopandas as gpd
+import pandas as pd
+
+from modules.analysis.base import AnalysisData, AnalysisOutput, jsonable
+from modules.logger import get_logger
+from modules.neo4j.import_state import current_import_version
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+ANALYSIS_CACHE_DIR = Path(os.getenv("ANALYSIS_CACHE_PATH", "cache/analysis_results"))
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE", "1").lower() in {"1", "true", "yes"}
+ANALYSIS_CACHE_MAX_MB = float(os.getenv("ANALYSIS_CACHE_MAX_MB", "500"))
+LIBRARIES = ["numpy", "pandas", "scipy", "shapely", "geopandas", "libpysal", "esda", "pointpats"]
+EVICT_EVERY = 20                    # size check every n writes
+
+_stats: Counter = Counter()
+_lock = threading.Lock()
+_writes = 0
+_digests: dict[tuple, str] = {}
+_purged_version: Optional[int] = None
+
+# ---------------------------------------------------------------------------
+# Key
+# ---------------------------------------------------------------------------
+def input_digest(path: Path) -> str:
+    """sha256 of the extracted input file (memoised per path, mtime and size)."""
+    stat = path.stat()
+    memo = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if memo in _digests:
+            return _digests[memo]
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _digests[memo] = digest
+    return digest
+
+@lru_cache(maxsize=1)
+def library_versions() -> dict[str, str]:
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = "-"
+    return versions
+
+@lru_cache(maxsize=None)
+def _code_digest(analysis_type: str) -> str:
+    """Source of base.py and the analysis module – editing either invalidates its entries."""
+    folder = Path(__file__).parent
+    sources = [folder / "base.py", folder / f"{analysis_type}.py"]
+    return hashlib.sha256(b"".join(p.read_bytes() for p in sources if p.exists())).hexdigest()
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items()) if v is not None and v != ""}
+    if isinstance(value, (list, tuple, set)):
+        items = [_normalize(v) for v in value]
+        return sorted(set(items), key=str) if all(isinstance(v, str) for v in items) else items
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        stripped = value.strip()
+        try:
+            return float(stripped)
+        except ValueError:
+            return stripped
+    return value
+
+def normalize_params(params: dict) -> dict:
+    """Null keys dropped, label lists sorted, numbers as float (``"5000"`` == ``5000``)."""
+    return _normalize(params or {})
+
+def result_key(analysis_type: str, input_path: Path, params: dict) -> str:
+    payload = {
+        "input": input_digest(input_path),
+        "analysis_type": analysis_type,
+        "params": normalize_params(params),
+        "libraries": library_versions(),
+        "code": _code_digest(analysis_type),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+def _connect() -> sqlite3.Connection:
+    ANALYSIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(ANALYSIS_CACHE_DIR / "index.sqlite"), timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS results (
+            key            TEXT PRIMARY KEY,
+            analysis_type  TEXT NOT NULL,
+            import_version INTEGER NOT NULL,
+            created_at     REAL NOT NULL,
+            last_used      REAL NOT NULL,
+            hits           INTEGER NOT NULL DEFAULT 0,
+            size           INTEGER NOT NULL
+        )
+    """)
+    return con
+
+def _drop(con: sqlite3.Connection, keys: list[str]) -> None:
+    con.executemany("DELETE FROM results WHERE key = ?", [(k,) for k in keys])
+    for key in keys:
+        shutil.rmtree(ANALYSIS_CACHE_DIR / key, ignore_errors=True)
+
+def _purge_stale(con: sqlite3.Connection, version: int) -> None:
+    """Entries of another import version describe other data → remove them once per version."""
+    global _purged_version
+    if _purged_version == version:
+        return
+    stale = [r[0] for r in con.execute("SELECT key FROM results WHERE import_version != ?", [version])]
+    if stale:
+        with con:
+            _drop(con, stale)
+        log.info("Analysis cache: dropped %d entries of older imports", len(stale))
+    _purged_version = version
+
+def _evict(con: sqlite3.Connection) -> int:
+    """Least recently used entries until the cache fits ``ANALYSIS_CACHE_MAX_MB``."""
+    budget = int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024)
+    total = con.execute("SELECT coalesce(sum(size), 0) FROM results").fetchone()[0]
+    drop = []
+    if total > budget:
+        for key, size in con.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+            if total <= budget:
+                break
+            drop.append(key)
+            total -= size
+        _drop(con, drop)
+        log.info("Analysis cache: evicted %d entries", len(drop))
+    return len(drop)
+
+def _write(folder: Path, output: AnalysisOutput) -> int:
+    folder.mkdir(parents=True)
+    (folder / "summary.json").write_text(json.dumps({
+        "summary": jsonable(output.summary),
+        "messages": output.messages,
+        "layers": list(output.layers),
+        "tables": list(output.tables),
+    }, ensure_ascii=False), encoding="utf-8")
+    for name, layer in output.layers.items():
+        layer.to_parquet(folder / f"layer_{name}.parquet")
+    for name, table in output.tables.items():
+        table.to_parquet(folder / f"table_{name}.parquet")
+    return sum(f.stat().st_size for f in folder.iterdir())
+
+def _read(folder: Path, analysis_type: str) -> AnalysisOutput:
+    meta = json.loads((folder / "summary.json").read_text(encoding="utf-8"))
+    return AnalysisOutput(
+        analysis_type,
+        meta["summary"],
+        layers={n: gpd.read_parquet(folder / f"layer_{n}.parquet") for n in meta["layers"]},
+        tables={n: pd.read_parquet(folder / f"table_{n}.parquet") for n in meta["tables"]},
+        messages=meta["messages"],
+    )
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def lookup(key: str, analysis_type: str, version: int) -> Optional[AnalysisOutput]:
+    """Cached output for *key* under import *version*, or ``None``."""
+    con = _connect()
+    try:
+        _purge_stale(con, version)
+        row = con.execute("SELECT 1 FROM results WHERE key = ? AND import_version = ?", [key, version]).fetchone()
+        if row:
+            try:
+                output = _read(ANALYSIS_CACHE_DIR / key, analysis_type)
+            except (OSError, ValueError, KeyError) as exc:
+                log.warning("Analysis cache: entry %s unreadable (%s) → dropped", key[:12], exc)
+                with con:
+                    _drop(con, [key])
+                output = None
+            if output is not None:
+                with con:
+                    con.execute("UPDATE results SET last_used = ?, hits = hits + 1 WHERE key = ?", [time.time(), key])
+                with _lock:
+                    _stats["hit"] += 1
+                log.info("Analysis cache hit for %s (%s)", analysis_type, key[:12])
+                return output
+    finally:
+        con.close()
+    with _lock:
+        _stats["miss"] += 1
+    return None
+
+
+def store(key: str, analysis_type: str, output: AnalysisOutput, version: int) -> None:
+    """Write *output* under import *version*; failures only cost the cache entry."""
+    global _writes
+    folder = ANALYSIS_CACHE_DIR / key
+    tmp = ANALYSIS_CACHE_DIR / f".{key}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        size = _write(tmp, output)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp, folder)
+    except Exception as exc:                                # noqa: BLE001 - cache is best effort
+        log.warning("Analysis cache: %s not stored (%s)", analysis_type, exc)
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+
+    now = time.time()
+    try:
+        con = _connect()
+        try:
+            with con:
+                con.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, 0, ?)",
+                            [key, analysis_type, version, now, now, size])
+                with _lock:
+                    _writes += 1
+                    due = _writes % EVICT_EVERY == 1
+                if due:
+                    _evict(con)
+        finally:
+            con.close()
+    except Exception as exc:                                # noqa: BLE001 - cache is best effort
+        log.warning("Analysis cache: %s not indexed (%s)", analysis_type, exc)
+        shutil.rmtree(folder, ignore_errors=True)            # unindexed folders are never evicted
+
+
+def cached_run(
+    analysis_type: str, data: AnalysisData, params: dict, *, force: bool = False
+) -> tuple[AnalysisOutput, bool]:
+    """
+    ``run_analysis`` with the result cache (only for input files – their content is the key).
+    Returns ``(output, from_cache)``; *force* recomputes and overwrites the entry.
+    """
+    from modules.analysis import run_analysis
+
+    if not ANALYSIS_CACHE_ENABLED or not isinstance(data, (str, Path)):
+        return run_analysis(analysis_type, data, params), False
+    try:
+        version = current_import_version()
+    except Exception as exc:                                # noqa: BLE001 - e.g. DuckDB locked by an import
+        log.warning("Analysis cache bypassed (import version unavailable: %s)", exc)
+        return run_analysis(analysis_type, data, params), False
+    key = result_key(analysis_type, Path(data), params)
+    if not force:
+        output = lookup(key, analysis_type, version)
+        if output is not None:
+            return output, True
+    output = run_analysis(analysis_type, data, params)
+    store(key, analysis_type, output, version)
+    return output, False
+
+
+def cache_stats() -> dict[str, float]:
+    """Hits/misses of this process plus entries and size on disk."""
+    with _lock:
+        stats = dict(_stats)
+    con = _connect()
+    try:
+        entries, size = con.execute("SELECT count(*), coalesce(sum(size), 0) FROM results").fetchone()
+    finally:
+        con.close()
+    lookups = stats.get("hit", 0) + stats.get("miss", 0)
+    return {**stats, "lookups": lookups, "hit_rate": stats.get("hit", 0) / lookups if lookups else 0.0,
+            "entries": entries, "size_mb": round(size / 2**20, 2)}
+
+
+def clear_cache() -> None:
+    con = _connect()
+    try:
+        with con:
+            _drop(con, [r[0] for r in con.execute("SELECT key FROM results")])
+    finally:
+        con.close()
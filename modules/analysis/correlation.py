@@ -0,0 +1,51 @@
+"""
+Korrelation zweier numerischer Spalten
+--------------------------------------
+* Pearson r und Spearman ρ für ``x_column`` / ``y_column``
+  (Standard: ``site_NoOfFeatures`` gegen ``site_Shape_Area``)
+* Liest nur die beiden Spalten, keine Geometrie
+
+Einfache Nutzung:  ▸  from modules.analysis import correlation
+"""
+
+from __future__ import annotations
+
+import pandas as pd
+
+from modules.analysis.base import AnalysisData, AnalysisError, AnalysisOutput, as_dataframe, param
+
+
+def _columns(params: dict) -> tuple[str, str]:
+    return param(params, "x_column", "site_NoOfFeatures"), param(params, "y_column", "site_Shape_Area")
+
+def input_columns(params: dict) -> set[str]:
+    """Columns of the analysis input :func:`correlation` reads with *params*."""
+    return set(_columns(params))
+
+
+def correlation(data: AnalysisData, params: dict) -> AnalysisOutput:
+    """Pearson and Spearman correlation of two columns (rows with missing values dropped)."""
+    from scipy.stats import pearsonr, spearmanr
+
+    x_col, y_col = _columns(params)
+    if x_col == y_col:
+        raise AnalysisError("x_column and y_column are the same")
+    df = as_dataframe(data, [x_col, y_col]).apply(pd.to_numeric, errors="coerce").dropna()
+    if len(df) < 3:
+        raise AnalysisError(f"too few numeric value pairs ({len(df)})")
+    if df[x_col].nunique() < 2 or df[y_col].nunique() < 2:
+        raise AnalysisError("one of the columns is constant")
+
+    r_p, p_p = pearsonr(df[x_col], df[y_col])
+    r_s, p_s = spearmanr(df[x_col], df[y_col])
+    summary = {
+        "x_column": x_col,
+        "y_column": y_col,
+        "pearson_r": float(r_p),
+        "pearson_p": float(p_p),
+        "spearman_r": float(r_s),
+        "p_value": float(p_s),
+        "n": len(df),
+    }
+    messages = [f"Pearson r = {r_p:.4f} (p = {p_p:.4g})", f"Spearman ρ = {r_s:.4f} (p = {p_s:.4g})"]
+    return AnalysisOutput("correlation", summary, messages=messages)
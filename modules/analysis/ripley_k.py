@@ -0,0 +1,75 @@
+"""
+Ripley's K
+----------
+* K(d) für ``intervals`` Distanzen bis zur halben Ausdehnung des Gebiets
+* Simulationshülle (2.5 / 97.5 %) aus ``simulations`` CSR-Realisierungen
+  (Standard 99) → Distanzen mit Clusterung bzw. Regelmäßigkeit
+
+Einfache Nutzung:  ▸  from modules.analysis import ripley_k
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from modules.analysis.base import (
+    AnalysisData,
+    AnalysisError,
+    AnalysisOutput,
+    as_geodataframe,
+    coordinates,
+    param,
+    point_columns,
+    points,
+    report_progress,
+)
+
+MIN_POINTS = 10
+
+
+def input_columns(params: dict) -> set[str]:
+    """Columns of the analysis input :func:`ripley_k` reads with *params* (coordinates only)."""
+    return point_columns(params)
+
+
+def ripley_k(data: AnalysisData, params: dict) -> AnalysisOutput:
+    """Observed K against the envelope of complete spatial randomness."""
+    from pointpats import distance_statistics
+
+    gdf = points(as_geodataframe(data, params))
+    if len(gdf) < MIN_POINTS:
+        raise AnalysisError(f"too few points ({len(gdf)} < {MIN_POINTS})")
+
+    coords = coordinates(gdf)
+    extent = coords.max(axis=0) - coords.min(axis=0)
+    r_max = float(extent.max() / 2)
+    if r_max <= 0:
+        raise AnalysisError("all points share the same location")
+    intervals = int(param(params, "intervals", 20))
+    simulations = int(param(params, "simulations", 99))
+    support = np.linspace(r_max / intervals, r_max, intervals)
+
+    report_progress("simulations", 0, simulations)
+    test = distance_statistics.k_test(
+        coords, support=support, keep_simulations=True, n_simulations=simulations, n_jobs=1,
+    )
+    report_progress("simulations", simulations, simulations)
+    lower, upper = np.percentile(test.simulations, [2.5, 97.5], axis=0)
+    table = pd.DataFrame({"d": test.support, "K": test.statistic, "lo": lower, "hi": upper, "p": test.pvalue})
+    clustered = table.loc[table["K"] > table["hi"], "d"]
+    regular = table.loc[table["K"] < table["lo"], "d"]
+
+    summary = {
+        "n": len(gdf),
+        "r_max": r_max,
+        "simulations": simulations,
+        "r_values": table["d"].round(1).tolist(),
+        "k_values": table["K"].tolist(),
+        "clustered_distances": clustered.round(1).tolist(),
+        "regular_distances": regular.round(1).tolist(),
+    }
+    messages = [f"Input records: {len(gdf):,}",
+                f"K above envelope at {len(clustered)}/{len(table)} distances, below at {len(regular)}"]
+    return AnalysisOutput("ripley_k", summary, layers={"ripley_k_result": gdf},
+                          tables={"ripley_k": table}, messages=messages)
@@ -0,0 +1,76 @@
+"""
+Abstand zwischen zwei Kategoriegruppen
+--------------------------------------
+* Für jeden Punkt aus ``group_a`` der nächste Punkt aus ``group_b`` (KD-Baum)
+* Gruppe A / B über ``<group_x_type>_Category`` (``feature`` | ``site``, Standard ``feature``)
+* Kennzahlen: Mittel, Median, Streuung, Min/Max, Anteil innerhalb ``distance_threshold``
+
+Einfache Nutzung:  ▸  from modules.analysis import spatial_distance
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from modules.analysis.base import (
+    AnalysisData,
+    AnalysisError,
+    AnalysisOutput,
+    as_geodataframe,
+    category_column,
+    coordinates,
+    labels,
+    param,
+    point_columns,
+    points,
+    require_columns,
+)
+
+
+def input_columns(params: dict) -> set[str]:
+    """Columns of the analysis input :func:`spatial_distance` reads (FeatureID labels the nearest B)."""
+    return point_columns(params) | {category_column(params, "a"), category_column(params, "b"), "FeatureID"}
+
+
+def spatial_distance(data: AnalysisData, params: dict) -> AnalysisOutput:
+    """Nearest-neighbour distance from group A to group B."""
+    group_a, group_b = labels(param(params, "group_a")), labels(param(params, "group_b"))
+    if not group_a or not group_b:
+        raise AnalysisError("group_a and group_b are required")
+
+    gdf = points(as_geodataframe(data, params))
+    column_a, column_b = category_column(params, "a"), category_column(params, "b")
+    require_columns(gdf, column_a, column_b)
+    df_a = gdf[gdf[column_a].notna() & gdf[column_a].isin(group_a)].copy()
+    df_b = gdf[gdf[column_b].notna() & gdf[column_b].isin(group_b)]
+    if df_a.empty or df_b.empty:
+        raise AnalysisError(f"filtered group A or B is empty (A: {len(df_a)}, B: {len(df_b)})")
+
+    distances, nearest = cKDTree(coordinates(df_b)).query(coordinates(df_a), k=1)
+    df_a["min_dist"] = distances
+    df_a["nearest_b"] = df_b.index.to_numpy()[nearest]
+    for key in ("FeatureID", "SiteID"):
+        if key in df_b.columns:
+            df_a["nearest_b"] = df_b[key].to_numpy()[nearest]
+            break
+
+    summary = {
+        "group_a": group_a,
+        "group_b": group_b,
+        "mean_distance": float(np.mean(distances)),
+        "median_distance": float(np.median(distances)),
+        "std_distance": float(np.std(distances)),
+        "min_distance": float(np.min(distances)),
+        "max_distance": float(np.max(distances)),
+        "n_pairs": len(distances),
+        "n_b": len(df_b),
+    }
+    threshold = param(params, "distance_threshold")
+    if threshold is not None:
+        summary["distance_threshold"] = float(threshold)
+        summary["share_within_threshold"] = round(float(np.mean(distances <= float(threshold))), 4)
+    messages = [f"Group A = {len(df_a)}, Group B = {len(df_b)}",
+                f"Mean nearest distance A→B = {summary['mean_distance']:.1f} m"]
+    return AnalysisOutput("spatial_distance", summary, layers={"spatial_distance_result": df_a},
+                          tables={"distance_stats": df_a[["min_dist", "nearest_b"]]}, messages=messages)
@@ -0,0 +1,167 @@
+"""
+Übergabe der Analysedaten an die generierten Skripte
+----------------------------------------------------
+* ``results/analysis_input.arrow`` – Arrow-IPC-Datei (typisierte Spalten, memory-mapped lesbar)
+* Vorberechnete ``geometry``-Spalte (WKB, EPSG:32636) aus dem ersten passenden X/Y-Paar
+* GeoParquet-ähnliche ``geo``-Metadaten im Schema (Spalte, Encoding, CRS, Quellspalten)
+* ``results/analysis_input.json`` nur noch als optionaler Debug-Dump (``ANALYSIS_DEBUG_JSON=1``)
+
+Einfache Nutzung im Analyse-Skript:  ▸  from modules.analysis_io import load_analysis_input
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import shapely
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+# Overridden per run by the orchestrator (one input file per distinct extraction)
+ANALYSIS_INPUT = Path(os.getenv("ANALYSIS_INPUT", "results/analysis_input.arrow"))
+ANALYSIS_DEBUG_JSON = Path("results/analysis_input.json")
+DEBUG_JSON = os.getenv("ANALYSIS_DEBUG_JSON", "0").lower() in {"1", "true", "yes"}
+DEFAULT_CRS = "EPSG:32636"
+# Tables kept per process (>0 only in long-lived analysis workers, see modules.worker_pool)
+INPUT_CACHE_SIZE = int(os.getenv("ANALYSIS_INPUT_CACHE", "0"))
+_TABLES: dict[tuple, pa.Table] = {}
+
+# Preferred coordinate pairs for the precomputed geometry (first match wins)
+XY_CANDIDATES = [("feature_X", "feature_Y"), ("site_X", "site_Y"), ("X", "Y")]
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _xy_columns(names: list[str]) -> Optional[tuple[str, str]]:
+    for x, y in XY_CANDIDATES:
+        if x in names and y in names:
+            return x, y
+    return None
+
+def _to_float(column: pa.ChunkedArray) -> np.ndarray:
+    return pd.to_numeric(column.to_pandas(), errors="coerce").to_numpy(dtype=np.float64)
+
+def _write_debug_json(table: pa.Table, path: Path) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("[")
+        first = True
+        for batch in table.drop_columns(["geometry"] if "geometry" in table.column_names else []).to_batches(5000):
+            for row in batch.to_pylist():
+                fh.write("\n" if first else ",\n")
+                json.dump(row, fh, ensure_ascii=False, default=str)
+                first = False
+        fh.write("\n]")
+
+# ---------------------------------------------------------------------------
+# Write
+# ---------------------------------------------------------------------------
+def write_analysis_input(
+    table: pa.Table,
+    path: Union[str, Path] = ANALYSIS_INPUT,
+    *,
+    crs: str = DEFAULT_CRS,
+    debug_json: Optional[bool] = None,
+) -> Path:
+    """
+    Write *table* as Arrow IPC file with a WKB ``geometry`` column built
+    vectorised from the first known X/Y column pair (rows without valid
+    coordinates get a null geometry).
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    geo_meta = None
+    xy = _xy_columns(table.column_names)
+    if xy and "geometry" not in table.column_names:
+        x, y = _to_float(table.column(xy[0])), _to_float(table.column(xy[1]))
+        valid = np.isfinite(x) & np.isfinite(y)
+        wkb = np.full(len(x), None, dtype=object)
+        wkb[valid] = shapely.to_wkb(shapely.points(x[valid], y[valid]))
+        table = table.append_column("geometry", pa.array(wkb, type=pa.binary()))
+        geo_meta = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"], "crs": crs}},
+            "source_columns": list(xy),
+        }
+    if geo_meta:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"geo": json.dumps(geo_meta).encode()})
+
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")   # concurrent writers
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=65_536)
+    os.replace(tmp, path)
+
+    if DEBUG_JSON if debug_json is None else debug_json:
+        _write_debug_json(table, path.with_suffix(".json"))
+    return path
+
+# ---------------------------------------------------------------------------
+# Read
+# ---------------------------------------------------------------------------
+def input_path(path: Union[str, Path, None] = None) -> Path:
+    """*path*, else ``$ANALYSIS_INPUT`` read at call time (warm workers switch inputs per job)."""
+    return Path(path) if path else Path(os.getenv("ANALYSIS_INPUT", str(ANALYSIS_INPUT)))
+
+def read_analysis_table(path: Union[str, Path, None] = None) -> pa.Table:
+    """Memory-map the IPC file; the returned table references the mapped buffers (zero-copy)."""
+    path = input_path(path)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    if key in _TABLES:
+        return _TABLES[key]
+    source = pa.memory_map(str(path), "r")
+    table = pa.ipc.open_file(source).read_all()
+    if INPUT_CACHE_SIZE:
+        _TABLES[key] = table
+        while len(_TABLES) > INPUT_CACHE_SIZE:
+            _TABLES.pop(next(iter(_TABLES)))
+    return table
+
+def load_analysis_input(
+    path: Union[str, Path, None] = None,
+    *,
+    x_col: Optional[str] = None,
+    y_col: Optional[str] = None,
+    crs: Optional[str] = None,
+):
+    """
+    Load the hand-off as GeoDataFrame (``geometry`` from WKB, or from *x_col*/*y_col*
+    if they differ from the precomputed pair). Without coordinates a plain DataFrame is returned.
+    """
+    return table_to_geodataframe(read_analysis_table(path), x_col=x_col, y_col=y_col, crs=crs)
+
+def table_to_geodataframe(
+    table: pa.Table,
+    *,
+    x_col: Optional[str] = None,
+    y_col: Optional[str] = None,
+    crs: Optional[str] = None,
+):
+    """Conversion behind :func:`load_analysis_input` for a table already in memory."""
+    import geopandas as gpd
+
+    meta = json.loads((table.schema.metadata or {}).get(b"geo", b"{}"))
+    crs = crs or meta.get("columns", {}).get("geometry", {}).get("crs", DEFAULT_CRS)
+    source = meta.get("source_columns")
+
+    if x_col and y_col and [x_col, y_col] != source and {x_col, y_col} <= set(table.column_names):
+        df = table.drop_columns(["geometry"] if "geometry" in table.column_names else []).to_pandas()
+        x = pd.to_numeric(df[x_col], errors="coerce")
+        y = pd.to_numeric(df[y_col], errors="coerce")
+        return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(x, y), crs=crs)
+
+    if "geometry" not in table.column_names:
+        return table.to_pandas()
+
+    df = table.drop_columns(["geometry"]).to_pandas()
+    geometry = gpd.GeoSeries(shapely.from_wkb(table.column("geometry").to_numpy(zero_copy_only=False)), crs=crs)
+    return gpd.GeoDataFrame(df, geometry=geometry.values, crs=crs)
@@ -0,0 +1,255 @@
+"""
+Extraktions-Backends für die Analyse-Eingabedaten
+-------------------------------------------------
+Beantwortet ``MATCH (s:Site)-[:HAS_FEATURE]->(f:Feature) WHERE … RETURN …`` entweder
+
+* ``neo4j``     – über Bolt (``connection.cypher_to_arrow``)
+* ``duckdb``    – als vektorisierte SQL-Abfrage auf ``cache/duckdb/archaeology.duckdb``
+* ``auto``      – DuckDB, sofern sich WHERE/RETURN übersetzen lassen, sonst Neo4j
+* ``benchmark`` – beide Backends, Laufzeiten und Ergebnisgrößen werden geloggt
+
+Die Übersetzung deckt den Cypher-Teil ab, den die LLM-Prompts erzeugen
+(Vergleiche, AND/OR/NOT, IN-Listen, STARTS WITH/ENDS WITH/CONTAINS, =~, IS NULL,
+toLower/toUpper/toFloat/toInteger/toString/size). Alles andere (Pfadmuster,
+EXISTS, Aggregationen, Parameter, räumliche Funktionen) gilt als nicht
+übersetzbar → Neo4j.
+
+Einfache Nutzung:  ▸  from modules.extraction import extract
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import duckdb
+import pyarrow as pa
+
+from modules.logger import get_logger
+from modules.neo4j.connection import cypher_to_arrow
+from modules.neo4j.import_state import DUCKDB_PATH
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+EXTRACTION_BACKEND = os.getenv("EXTRACTION_BACKEND", "auto").lower()
+BACKENDS = ("neo4j", "duckdb", "auto", "benchmark")
+
+MATCH_PATTERN = "MATCH (s:Site)-[:HAS_FEATURE]->(f:Feature)"
+
+# Same key types as in Neo4j (IDs as strings, counts/ages as integers – see neo4j_import)
+SQL_FROM = """
+WITH s AS (
+    SELECT * REPLACE (CAST(SiteID AS VARCHAR) AS SiteID,
+                      TRY_CAST(NoOfFeatures AS BIGINT) AS NoOfFeatures)
+    FROM Sites
+), f AS (
+    SELECT * REPLACE (CAST(FeatureID AS VARCHAR) AS FeatureID,
+                      CAST(Site AS VARCHAR) AS Site,
+                      TRY_CAST(Age AS BIGINT) AS Age)
+    FROM Features
+)
+"""
+
+# Cypher functions → DuckDB macros (registered per connection)
+CYPHER_MACROS = {
+    "toLower(x)":   "lower(x)",
+    "toUpper(x)":   "upper(x)",
+    "toFloat(x)":   "TRY_CAST(x AS DOUBLE)",
+    "toInteger(x)": "TRY_CAST(x AS BIGINT)",
+    "toString(x)":  "CAST(x AS VARCHAR)",
+    "toBoolean(x)": "TRY_CAST(x AS BOOLEAN)",
+    "size(x)":      "length(x)",
+}
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_UNSUPPORTED = re.compile(
+    r"-\s*\[|\]\s*-|\)\s*<?-|\bEXISTS\b|\bpoint\b|\bdistance\s*\(|\b(any|all|none|single|reduce)\s*\("
+    r"|\b(count|sum|avg|min|max|collect|stdev|stdevp|percentilecont|percentiledisc)\s*\(|\bXOR\b|\$|\||:|\{",
+    re.I,
+)
+
+
+class UnsupportedCypher(ValueError):
+    """Raised when a WHERE/RETURN clause cannot be translated to DuckDB SQL."""
+
+# ---------------------------------------------------------------------------
+# Cypher → SQL
+# ---------------------------------------------------------------------------
+def split_return_items(clause: str) -> list[str]:
+    """Split a RETURN clause on top-level commas (ignores commas inside (), [], {} and strings)."""
+    items, depth, quote, buf = [], 0, None, []
+    for ch in clause:
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"":
+            quote = ch
+        elif ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            items.append("".join(buf).strip())
+            buf = []
+            continue
+        buf.append(ch)
+    items.append("".join(buf).strip())
+    return [i for i in items if i]
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def _unquote(token: str) -> str:
+    body = token[1:-1]
+    return re.sub(r"\\(['\"\\])", r"\1", body)
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def cypher_expr_to_sql(expr: str) -> str:
+    """Translate one Cypher expression over ``s``/``f`` into DuckDB SQL (or raise ``UnsupportedCypher``)."""
+    parts: list[tuple[str, str]] = []       # (kind, text) – kind: code | str
+    pos = 0
+    for m in _STRING.finditer(expr):
+        parts.append(("code", expr[pos:m.start()]))
+        parts.append(("str", _unquote(m.group(0))))
+        pos = m.end()
+    parts.append(("code", expr[pos:]))
+
+    out: list[str] = []
+    brackets: list[str] = []
+    pending_like: Optional[str] = None      # pattern template for the next string literal
+    for kind, text in parts:
+        if kind == "str":
+            if pending_like:
+                out.append(_sql_literal(pending_like.replace("{}", _like_escape(text))) + " ESCAPE '\\'")
+                pending_like = None
+            else:
+                out.append(_sql_literal(text))
+            continue
+
+        if pending_like and text.strip():
+            raise UnsupportedCypher("STARTS/ENDS WITH and CONTAINS need a string literal on the right")
+        if _UNSUPPORTED.search(text):
+            raise UnsupportedCypher(f"unsupported Cypher construct in: {text.strip()!r}")
+
+        code = text.replace("`", '"').replace("=~", " SIMILAR TO ")
+        like = None
+        for op, pattern in ((r"STARTS\s+WITH", "{}%"), (r"ENDS\s+WITH", "%{}"), ("CONTAINS", "%{}%")):
+            m = re.search(r"\b" + op + r"\s*$", code, flags=re.I)
+            if m:
+                code, like = code[:m.start()] + " LIKE ", pattern
+                break
+        if re.search(r"\b(STARTS\s+WITH|ENDS\s+WITH|CONTAINS)\b", code, flags=re.I):
+            raise UnsupportedCypher("STARTS/ENDS WITH and CONTAINS need a string literal on the right")
+
+        chars = []
+        for i, ch in enumerate(code):
+            if ch == "[":
+                is_in = bool(re.search(r"\bIN\s*$", code[:i], flags=re.I))
+                brackets.append("in" if is_in else "list")
+                chars.append("(" if is_in else "[")
+            elif ch == "]":
+                if not brackets:
+                    raise UnsupportedCypher("unbalanced list brackets")
+                chars.append(")" if brackets.pop() == "in" else "]")
+            else:
+                chars.append(ch)
+        out.append("".join(chars))
+        pending_like = like
+
+    if pending_like or brackets:
+        raise UnsupportedCypher("incomplete expression")
+    return "".join(out)
+
+def cypher_to_sql(where_clause: str, return_clause: str) -> str:
+    """Full SQL equivalent of ``MATCH (s:Site)-[:HAS_FEATURE]->(f:Feature) WHERE … RETURN …``."""
+    distinct = ""
+    ret = return_clause.strip()
+    if re.match(r"DISTINCT\b", ret, flags=re.I):
+        distinct, ret = "DISTINCT ", ret[len("DISTINCT"):].strip()
+
+    select = []
+    for item in split_return_items(ret):
+        m = re.search(r"\s+AS\s+`?(\w+)`?\s*$", item, flags=re.I)
+        expr, alias = (item[:m.start()], m.group(1)) if m else (item, item.strip())
+        if re.fullmatch(r"\s*[sf]\s*", expr):
+            raise UnsupportedCypher("whole-node projections are not supported")
+        select.append(f'{cypher_expr_to_sql(expr)} AS "{alias}"')
+
+    where = cypher_expr_to_sql(where_clause or "TRUE")
+    return (
+        f"{SQL_FROM}SELECT {distinct}{', '.join(select)}\n"
+        f"FROM s JOIN f ON f.Site = s.SiteID\n"
+        f"WHERE {where}"
+    )
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+def extract_neo4j(where_clause: str, return_clause: str) -> pa.Table:
+    return cypher_to_arrow(f"{MATCH_PATTERN} WHERE {where_clause} RETURN {return_clause}")
+
+def extract_duckdb(
+    where_clause: str, return_clause: str, db_path: Union[str, Path] = DUCKDB_PATH
+) -> pa.Table:
+    sql = cypher_to_sql(where_clause, return_clause)
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        for signature, body in CYPHER_MACROS.items():
+            con.execute(f"CREATE TEMP MACRO {signature} AS {body}")
+        return con.execute(sql).arrow()
+    finally:
+        con.close()
+
+def _timed(fn, *args) -> tuple[pa.Table, float]:
+    started = time.perf_counter()
+    table = fn(*args)
+    return table, time.perf_counter() - started
+
+def extract(
+    where_clause: str,
+    return_clause: str,
+    *,
+    backend: Optional[str] = None,
+    db_path: Union[str, Path] = DUCKDB_PATH,
+) -> tuple[pa.Table, str]:
+    """
+    Run the extraction with the chosen *backend* (default ``EXTRACTION_BACKEND``).
+    Returns ``(table, backend actually used)``.
+    """
+    backend = (backend or EXTRACTION_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"EXTRACTION_BACKEND must be one of {BACKENDS}, got {backend!r}")
+
+    if backend == "neo4j":
+        return extract_neo4j(where_clause, return_clause), "neo4j"
+    if backend == "duckdb":
+        return extract_duckdb(where_clause, return_clause, db_path), "duckdb"
+
+    if backend == "auto":
+        try:
+            return extract_duckdb(where_clause, return_clause, db_path), "duckdb"
+        except (UnsupportedCypher, duckdb.Error) as exc:
+            log.info("DuckDB extraction not possible (%s) → Neo4j", exc)
+            return extract_neo4j(where_clause, return_clause), "neo4j"
+
+    # benchmark: run both, report, prefer DuckDB when the results agree
+    neo_table, neo_s = _timed(extract_neo4j, where_clause, return_clause)
+    try:
+        duck_table, duck_s = _timed(extract_duckdb, where_clause, return_clause, db_path)
+    except (UnsupportedCypher, duckdb.Error) as exc:
+        log.warning("Benchmark: DuckDB failed (%s); Neo4j %.3fs, %d rows", exc, neo_s, neo_table.num_rows)
+        return neo_table, "neo4j"
+    same = neo_table.num_rows == duck_table.num_rows and neo_table.column_names == duck_table.column_names
+    log.info(
+        "Benchmark extraction: neo4j %.3fs / duckdb %.3fs (×%.1f), rows %d / %d, columns %s",
+        neo_s, duck_s, neo_s / max(duck_s, 1e-9), neo_table.num_rows, duck_table.num_rows,
+        "equal" if same else "DIFFER",
+    )
+    return (duck_table, "duckdb") if same else (neo_table, "neo4j")
@@ -6,16 +6,25 @@ import yaml
 import pandas as pd
 from jinja2 import Environment, FileSystemLoader
 from openai import OpenAI
-from modules.logger import log_result
-from neo4j import GraphDatabase
+from modules.logger import get_logger, log_result
+from modules import worker_pool, workspace
+from modules import llm_cache
+from modules.prompting import COMPACT_JSON, Prompt, build_messages, record_call
+from modules.neo4j.connection import read_query
 import csv
 from typing import Any, List
 import subprocess
 import tempfile
 from typing import Tuple
+from typing import AsyncIterator, Iterator
+import asyncio
+import contextvars
+import threading
+import time
 
 MODEL_NAME = os.getenv("OPENAI_MODEL", "gpt-4")
 CLIENT_NAME     = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = get_logger("debug")
 
 
 DEFAULTS: dict = {
@@ -26,7 +35,8 @@ DEFAULTS: dict = {
     "output_file": "analysis_result.geojson",
 }
 
-TEMPLATE_FOLDER = Path(__file__).parent.parent / "templates"
+PROJECT_ROOT    = Path(__file__).parent.parent
+TEMPLATE_FOLDER = PROJECT_ROOT / "templates"
 CONFIG_FOLDER   = Path(__file__).parent.parent / "config"
 
 env = Environment(
@@ -34,6 +44,7 @@ env = Environment(
     trim_blocks=True,
     lstrip_blocks=True
 )
+env.policies["json.dumps_kwargs"] = COMPACT_JSON     # minified JSON in every prompt
 
 
 def load_llm_json(raw: str) -> dict:
@@ -51,6 +62,23 @@ def render_template(name: str, context: dict, folder: str = "") -> str:
         raise FileNotFoundError(f"Template not found: {path}")
     return env.get_template(str(path.relative_to(TEMPLATE_FOLDER))).render(**context)
 
+def render_prompt(name: str, context: dict, folder: str = "") -> Prompt:
+    """
+    Render a system template as :class:`Prompt`: ``{% block static %}`` becomes the
+    cacheable prefix, ``{% block variable %}`` the per-call part. Templates without
+    blocks are static as a whole.
+    """
+    path = TEMPLATE_FOLDER / folder / name if folder else TEMPLATE_FOLDER / name
+    if not path.exists():
+        raise FileNotFoundError(f"Template not found: {path}")
+    template = env.get_template(str(path.relative_to(TEMPLATE_FOLDER)))
+    if "static" not in template.blocks:
+        return Prompt(template.render(**context).strip())
+    ctx = template.new_context(context)
+    static = "".join(template.blocks["static"](ctx)).strip()
+    variable = "".join(template.blocks["variable"](ctx)).strip() if "variable" in template.blocks else ""
+    return Prompt(static, variable)
+
 def strip_code_fences(txt: str) -> str:
     """entfernt ```json …``` bzw. ``` … ``` Hüllen"""
     return re.sub(r"^```(?:json)?|```$", "", txt.strip(), flags=re.I).strip()
@@ -74,39 +102,159 @@ def load_yaml(name: str) -> dict:
 def call_llm_with_prompt(
     function_name: str,
     question: str,
-    prompt: str,
+    prompt: Prompt | str,
     preview: str,
     result_data=None,
     temperature: float = 0.2,
     model: Optional[str] = None,
+    use_cache: bool = True,
 ) -> str:
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": f"Frage: {question}"},
-        {"role": "assistant", "content": preview},
-    ]
+    model = model or MODEL_NAME
+    messages = build_messages(prompt, question, preview)
+    start_time = time.time()
+
+    cached = llm_cache.lookup(function_name, question, model, temperature, messages) if use_cache else None
+    if cached:
+        final_answer, tier = cached
+        record_call(function_name, model, messages, time.time() - start_time, cache=tier)
+        log_result(
+            function_name=function_name,
+            user_question=question,
+            generated_prompt=str(prompt),
+            result_data=result_data or [],
+            llm_response={"cache": tier, "model": model},
+            code_generated=final_answer,
+            status=f"cache_{tier}",
+            results_dir=workspace.llm_log_dir()
+        )
+        return final_answer
 
     response = CLIENT_NAME.chat.completions.create(
-        model=model or MODEL_NAME,
+        model=model,
         messages=messages,
         temperature=temperature,
     )
 
     final_answer = response.choices[0].message.content.strip()
+    record_call(function_name, model, messages, time.time() - start_time, usage=response.usage)
+    if use_cache:
+        llm_cache.store(function_name, question, model, temperature, messages, final_answer)
 
     log_result(
         function_name=function_name,
         user_question=question,
-        generated_prompt=prompt,
+        generated_prompt=str(prompt),
         result_data=result_data or [],
         llm_response=response.model_dump(),
         code_generated=final_answer,
         status="success",
-        results_dir="results"
+        results_dir=workspace.llm_log_dir()
     )
 
     return final_answer
 
+def stream_llm_with_prompt(
+    function_name: str,
+    question: str,
+    prompt: Prompt | str,
+    preview: str,
+    result_data=None,
+    temperature: float = 0.2,
+    model: Optional[str] = None,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """
+    Same call as :func:`call_llm_with_prompt`, but yields the answer in chunks as the
+    model produces them. The final text is cached and logged through ``log_result``
+    once the stream is complete (a cache hit is yielded as one chunk).
+    """
+    model = model or MODEL_NAME
+    messages = build_messages(prompt, question, preview)
+    start_time = time.time()
+
+    cached = llm_cache.lookup(function_name, question, model, temperature, messages) if use_cache else None
+    if cached:
+        final_answer, tier = cached
+        record_call(function_name, model, messages, time.time() - start_time, cache=tier)
+        yield final_answer
+        log_result(
+            function_name=function_name,
+            user_question=question,
+            generated_prompt=str(prompt),
+            result_data=result_data or [],
+            llm_response={"cache": tier, "model": model},
+            code_generated=final_answer,
+            status=f"cache_{tier}",
+            results_dir=workspace.llm_log_dir()
+        )
+        return
+
+    parts: list[str] = []
+    complete = False
+    stream = CLIENT_NAME.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        complete = True
+    finally:
+        stream.close()
+        final_answer = "".join(parts).strip()
+        record_call(function_name, model, messages, time.time() - start_time)
+        if complete and use_cache:
+            llm_cache.store(function_name, question, model, temperature, messages, final_answer)
+        log_result(
+            function_name=function_name,
+            user_question=question,
+            generated_prompt=str(prompt),
+            result_data=result_data or [],
+            llm_response={"stream": True, "model": model, "chunks": len(parts), "start_time": start_time},
+            code_generated=final_answer,
+            status="success" if complete else "stopped",
+            results_dir=workspace.llm_log_dir()
+        )
+
+async def astream_llm_with_prompt(*args, **kwargs) -> AsyncIterator[str]:
+    """
+    Async iterator over :func:`stream_llm_with_prompt`. The blocking stream runs in a
+    worker thread; leaving the loop early stops it after the current chunk.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def pump() -> None:
+        chunks = stream_llm_with_prompt(*args, **kwargs)
+        try:
+            for chunk in chunks:
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                if stop.is_set():
+                    break
+        except Exception as exc:
+            loop.call_soon_threadsafe(queue.put_nowait, exc)
+        finally:
+            chunks.close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    # run_in_executor does not carry contextvars over (current workspace for the logs)
+    worker = loop.run_in_executor(None, contextvars.copy_context().run, pump)
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        await worker
+
 def load_llm_json(raw: str) -> dict:
     """
     Strip ``` / ```json fences and parse JSON.
@@ -132,19 +280,37 @@ def _clean(code: str) -> str:
     return code.strip()
 
 
-def run_python_code(raw_code: str) -> Tuple[str, str]:
-    """Returns (stdout, stderr) of executed script."""
+def run_python_code(
+    raw_code: str, extra_env: Optional[dict] = None, cwd: Optional[str | Path] = None
+) -> Tuple[str, str]:
+    """
+    Returns (stdout, stderr) of executed script (*extra_env* is added to its environment,
+    relative paths resolve against *cwd*, e.g. the request workspace).
+    Runs in a warm worker of ``modules.worker_pool``; a fresh interpreter if that is disabled or broken.
+    """
     script_code = _clean(raw_code)
 
+    if worker_pool.POOL_ENABLED:
+        try:
+            return worker_pool.run_in_pool(script_code, extra_env, cwd=cwd)
+        except RuntimeError as exc:                 # pool unusable → cold interpreter as before
+            logger.warning("Worker pool failed (%s) – running in a fresh interpreter", exc)
+
     with tempfile.TemporaryDirectory() as td:
         tmp = Path(td) / "gpt_script.py"
         tmp.write_text(script_code, encoding="utf-8")
 
+        # project root on PYTHONPATH so scripts can use modules.analysis_io
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(
+            p for p in [str(PROJECT_ROOT), os.environ.get("PYTHONPATH", "")] if p
+        ), **(extra_env or {})}
         proc = subprocess.run(
             ["python", str(tmp)],
             capture_output=True,
             text=True,
-            timeout=900,
+            timeout=worker_pool.JOB_TIMEOUT,
+            env=env,
+            cwd=cwd,
         )
     return proc.stdout, proc.stderr
 
@@ -160,12 +326,6 @@ def load_prompt(name: str) -> dict:
     with path.open("r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
-_driver = GraphDatabase.driver(
-    os.getenv("NEO4J_URI"),
-    auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD"))
-)
-
-
-def run_cypher(query: str) -> List[dict[str, Any]]:
-    with _driver.session() as session:
-        return [rec.data() for rec in session.run(query)]
\ No newline at end of file
+def run_cypher(query: str, params: Optional[dict[str, Any]] = None) -> List[dict[str, Any]]:
+    """Read-only Cypher über den gemeinsamen Driver (geroutete Read-Transaktion)."""
+    return read_query(query, params)
\ No newline at end of file
@@ -0,0 +1,457 @@
+"""
+Hintergrund-Jobs für lange Analysen
+-----------------------------------
+Eine Frage läuft nicht mehr im Streamlit-Skript, sondern als Job in einem eigenen
+Prozess (``python -m modules.jobs <id>``):
+
+* Zustand in SQLite (``cache/jobs.sqlite``): Status, Priorität, Arbeitsbereich,
+  Fortschritt je Analyse (Stufe, Permutationen erledigt/gesamt, Zwischenergebnisse)
+* ``JobRunner`` startet höchstens ``JOB_WORKERS`` Job-Prozesse gleichzeitig,
+  wartende Jobs nach Priorität (höher zuerst), dann nach Alter
+* Freie Plätze (mindestens einer) halten vorgestartete Job-Prozesse mit bereits importierten
+  Bibliotheken (geopandas, esda, Orchestrator …) – ein Job übernimmt einen davon und startet warm.
+  Der Skript-Pool (``ANALYSIS_WORKER_POOL``) bleibt in Job-Prozessen aus: generierte
+  Skripte laufen als eigener ``python``-Prozess in der Prozessgruppe des Jobs, damit
+  Abbrechen sie mit beendet
+* Abbrechen: wartende Jobs sofort, laufende per SIGTERM an die Prozessgruppe
+  (generierte Skripte inklusive)
+* Grenzen wie im Skript-Pool: ``ANALYSIS_WORKER_MEMORY_MB`` als ``RLIMIT_AS`` für den
+  Job-Prozess, ``ANALYSIS_TIMEOUT`` je Analyse auch für Standardanalysen; ein danach
+  noch laufender Analyse-Thread hält den Prozess nicht am Leben
+* Die UI fragt den Zustand ab (``get_job``) und findet einen Job nach einem
+  Neuladen der Seite über seine ID wieder; Browser-Refresh oder Rerun brechen ihn nicht ab
+* Neustart der App: wartende Jobs laufen weiter, Jobs ohne lebenden Prozess → ``failed``
+
+Einfache Nutzung:  ▸  from modules.jobs import submit, get_job, cancel
+"""
+
+from __future__ import annotations
+
+import importlib
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from modules.logger import get_logger
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+JOBS_ENABLED = os.getenv("ANALYSIS_JOBS", "1").lower() in {"1", "true", "yes"}
+JOBS_PATH = Path(os.getenv("JOBS_PATH", "cache/jobs.sqlite"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))                  # job processes at the same time
+JOB_RETENTION_H = float(os.getenv("JOB_RETENTION_H", "168"))      # finished jobs kept in the table
+JOB_POLL = 0.5                      # seconds between dispatcher rounds
+WRITE_EVERY = 0.5                   # min. seconds between progress writes of a running job
+KILL_GRACE = 5.0                    # seconds between SIGTERM and SIGKILL on cancel
+MAX_ROWS = 200                      # rows per analysis kept in the job state
+PROJECT_ROOT = Path(__file__).parent.parent
+
+ACTIVE = ("queued", "starting", "running")
+FINISHED = ("done", "failed", "cancelled")
+
+
+@dataclass
+class Job:
+    """One submitted question and everything the UI needs to render it."""
+    id: str
+    question: str
+    status: str
+    priority: int = 0
+    force: bool = False
+    session: Optional[str] = None
+    workspace: Optional[str] = None
+    stage: str = ""                     # planning / analyses / done
+    error: Optional[str] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    pid: Optional[int] = None
+    cancel: bool = False
+    results: list[dict[str, Any]] = field(default_factory=list)    # AnalysisResult fields per analysis
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+def _connect() -> sqlite3.Connection:
+    JOBS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(JOBS_PATH), timeout=10)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id          TEXT PRIMARY KEY,
+            question    TEXT NOT NULL,
+            status      TEXT NOT NULL,
+            priority    INTEGER NOT NULL DEFAULT 0,
+            force       INTEGER NOT NULL DEFAULT 0,
+            session     TEXT,
+            workspace   TEXT,
+            stage       TEXT NOT NULL DEFAULT '',
+            error       TEXT,
+            created_at  REAL NOT NULL,
+            started_at  REAL,
+            finished_at REAL,
+            pid         INTEGER,
+            cancel      INTEGER NOT NULL DEFAULT 0,
+            results     TEXT NOT NULL DEFAULT '[]'
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+    return con
+
+def _job(row: sqlite3.Row) -> Job:
+    data = dict(row)
+    data.update(force=bool(data["force"]), cancel=bool(data["cancel"]), results=json.loads(data["results"]))
+    return Job(**data)
+
+def _update(job_id: str, **values: Any) -> None:
+    if "results" in values:
+        values["results"] = json.dumps(values["results"], ensure_ascii=False, default=str)
+    con = _connect()
+    try:
+        with con:
+            con.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in values)} WHERE id = ?",
+                        [*values.values(), job_id])
+    finally:
+        con.close()
+
+def _finish(job_id: str, status: str, error: Optional[str] = None) -> None:
+    """Final status, unless the job already has one (cancel vs. normal end race)."""
+    con = _connect()
+    try:
+        with con:
+            con.execute(f"UPDATE jobs SET status = ?, error = coalesce(?, error), finished_at = ? "
+                        f"WHERE id = ? AND status IN ({', '.join('?' * len(ACTIVE))})",
+                        [status, error, time.time(), job_id, *ACTIVE])
+    finally:
+        con.close()
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _result_state(result) -> dict[str, Any]:
+    """JSON-able AnalysisResult (rows capped – the UI shows previews only)."""
+    state = asdict(result)
+    if isinstance(state["rows"], list):
+        state["rows"] = state["rows"][:MAX_ROWS]
+    return state
+
+# ---------------------------------------------------------------------------
+# Job process
+# ---------------------------------------------------------------------------
+def _execute(job_id: str) -> None:
+    """Body of ``python -m modules.jobs <id>``: plan and run the question, writing progress as it goes."""
+    from modules.orchestrator import iter_updates, plan
+    from modules.workspace import open_workspace
+
+    job = get_job(job_id)
+    if job is None or job.status != "starting":
+        log.warning("Job %s not startable (%s)", job_id, job.status if job else "unknown")
+        return
+    workspace = open_workspace(job.question, session=job.session)
+    _update(job_id, status="running", pid=os.getpid(), started_at=time.time(),
+            workspace=workspace.id, stage="planning")
+
+    def stop(signum, frame):                # cancel → SIGTERM from the runner
+        _finish(job_id, "cancelled")
+        workspace.close("cancelled")
+        os._exit(128 + signum)             # worker threads would keep a normal exit waiting
+
+    signal.signal(signal.SIGTERM, stop)
+    status, error = "failed", None
+    try:
+        with workspace.active():
+            decisions, prepared = plan(job.question)
+            if not decisions:
+                error = "Keine gültige Analyse erkannt."
+                return
+            results: dict[int, Any] = {}
+            written = 0.0
+            _update(job_id, stage="analyses")
+            for update in iter_updates(job.question, decisions, prepared=prepared,
+                                       force=job.force, workspace=workspace):
+                results[update.result.index] = update.result
+                now = time.monotonic()
+                if update.kind != "token" or now - written >= WRITE_EVERY:
+                    _update(job_id, results=[_result_state(r) for _, r in sorted(results.items())])
+                    written = now
+            _update(job_id, stage="done", results=[_result_state(r) for _, r in sorted(results.items())])
+            status = "done"
+    except Exception as exc:                # noqa: BLE001 - reported to the UI as job error
+        log.exception("Job %s failed", job_id)
+        error = f"{type(exc).__name__}: {exc}"
+    finally:
+        workspace.close(status)
+        _finish(job_id, status, error)
+
+def _wait_for_job() -> None:
+    """Body of a pre-started ``python -m modules.jobs``: import the libraries, then run the job id sent on stdin."""
+    from modules.worker_pool import PRELOAD
+
+    started = time.perf_counter()
+    for name in [*PRELOAD, "modules.orchestrator"]:
+        try:
+            importlib.import_module(name)
+        except Exception:                   # noqa: BLE001 - optional libraries; _execute reports real errors
+            pass
+    log.debug("Job process %s warm (imports %.2fs)", os.getpid(), time.perf_counter() - started)
+    job_id = sys.stdin.readline().strip()   # empty when the runner closes the pipe (app shutdown)
+    if job_id:
+        _execute(job_id)
+
+def _exit() -> None:
+    """After the final status: don't let an analysis thread abandoned after ``ANALYSIS_TIMEOUT`` keep the process."""
+    busy = [t for t in threading.enumerate() if t is not threading.main_thread() and not t.daemon and t.is_alive()]
+    if busy:
+        log.warning("Job process %s: %d analysis thread(s) still running → hard exit", os.getpid(), len(busy))
+        os._exit(0)
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+class JobRunner:
+    """Dispatcher thread: starts queued jobs in (pre-started) processes, cancels and reaps them."""
+
+    def __init__(self, workers: int = JOB_WORKERS) -> None:
+        self.workers = max(1, workers)
+        self._procs: dict[str, subprocess.Popen] = {}
+        self._warm: list[subprocess.Popen] = []          # pre-started, waiting for a job id on stdin
+        if os.getenv("ANALYSIS_WORKER_POOL", "").lower() in {"1", "true", "yes"}:
+            log.warning("ANALYSIS_WORKER_POOL=1 has no effect with ANALYSIS_JOBS=1: "
+                        "job processes are pre-started instead and run scripts as plain subprocesses")
+        self._stopping: dict[str, float] = {}           # job id → time of SIGTERM
+        self._stop = threading.Event()
+        self._recover()
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def _recover(self) -> None:
+        """After a restart: jobs whose process is gone did not finish; old finished jobs are dropped."""
+        con = _connect()
+        try:
+            rows = con.execute("SELECT id, pid FROM jobs WHERE status IN ('starting', 'running')").fetchall()
+            with con:
+                con.execute(f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+                            [*FINISHED, time.time() - JOB_RETENTION_H * 3600])
+        finally:
+            con.close()
+        for row in rows:
+            if not _alive(row["pid"]):
+                _finish(row["id"], "failed", "interrupted (app restarted)")
+
+    def _popen(self, *args: str) -> subprocess.Popen:
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(
+            p for p in [str(PROJECT_ROOT), os.environ.get("PYTHONPATH", "")] if p
+        ), "ANALYSIS_WORKER_POOL": "0"}         # scripts stay in the job's process group (see module docstring)
+        return subprocess.Popen(
+            [sys.executable, "-m", "modules.jobs", *args], env=env, text=True,
+            stdin=subprocess.DEVNULL if args else subprocess.PIPE,
+            start_new_session=True,             # own group → cancel hits its scripts too
+        )
+
+    def _spawn(self, job_id: str) -> None:
+        """Hand *job_id* to a warm process; cold start only if none is alive."""
+        while self._warm:
+            proc = self._warm.pop(0)
+            if proc.poll() is not None:
+                continue
+            try:
+                proc.stdin.write(job_id + "\n")
+                proc.stdin.close()
+                break
+            except OSError:                     # died between poll and write
+                proc.kill()
+        else:
+            proc = self._popen(job_id)
+        self._procs[job_id] = proc
+        log.info("Job %s started (pid %s)", job_id, proc.pid)
+
+    def _prewarm(self) -> None:
+        """One warm process per free slot, at least one spare for the next queued job when all are busy."""
+        self._warm = [p for p in self._warm if p.poll() is None]
+        while len(self._warm) < max(1, self.workers - len(self._procs)):
+            try:
+                self._warm.append(self._popen())
+            except OSError as exc:
+                log.warning("Could not pre-start job process: %s", exc)
+                break
+
+    def _claim(self) -> Optional[str]:
+        """Next queued job by priority, marked ``starting`` atomically (several app processes may poll)."""
+        con = _connect()
+        try:
+            with con:
+                row = con.execute("SELECT id FROM jobs WHERE status = 'queued' AND cancel = 0 "
+                                  "ORDER BY priority DESC, created_at LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                claimed = con.execute("UPDATE jobs SET status = 'starting' WHERE id = ? AND status = 'queued'",
+                                      [row["id"]]).rowcount
+            return row["id"] if claimed else None
+        finally:
+            con.close()
+
+    def _round(self) -> None:
+        for job_id, proc in list(self._procs.items()):
+            if proc.poll() is None:
+                continue
+            del self._procs[job_id]
+            self._stopping.pop(job_id, None)
+            job = get_job(job_id)
+            if job and job.active:          # process ended without writing a final status
+                _finish(job_id, "cancelled" if job.cancel else "failed", f"job process exited with {proc.returncode}")
+
+        for job_id, proc in self._procs.items():
+            job = get_job(job_id)
+            if not (job and job.cancel):
+                continue
+            if job_id not in self._stopping:
+                log.info("Cancelling job %s", job_id)
+                os.killpg(proc.pid, signal.SIGTERM)
+                self._stopping[job_id] = time.monotonic()
+            elif time.monotonic() - self._stopping[job_id] > KILL_GRACE:
+                os.killpg(proc.pid, signal.SIGKILL)
+
+        while len(self._procs) < self.workers:
+            job_id = self._claim()
+            if job_id is None:
+                break
+            try:
+                self._spawn(job_id)
+            except OSError as exc:
+                _finish(job_id, "failed", f"job process not started: {exc}")
+        self._prewarm()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(JOB_POLL):
+            try:
+                self._round()
+            except Exception:               # noqa: BLE001 - the dispatcher must keep running
+                log.exception("Job runner round failed")
+
+    def close(self) -> None:
+        """Stop dispatching (running job processes finish on their own, warm ones exit)."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        for proc in self._warm:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+        self._warm = []
+
+
+_RUNNER: Optional[JobRunner] = None
+_RUNNER_LOCK = threading.Lock()
+
+def get_runner() -> JobRunner:
+    """Process-wide runner, started on first use."""
+    global _RUNNER
+    with _RUNNER_LOCK:
+        if _RUNNER is None:
+            _RUNNER = JobRunner()
+        return _RUNNER
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def submit(question: str, *, session: Optional[str] = None, priority: int = 0, force: bool = False) -> str:
+    """Queue *question*; returns the job id (the runner picks it up within ``JOB_POLL`` seconds)."""
+    job_id = uuid.uuid4().hex[:12]
+    con = _connect()
+    try:
+        with con:
+            con.execute("INSERT INTO jobs (id, question, status, priority, force, session, created_at) "
+                        "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                        [job_id, question, priority, int(force), session, time.time()])
+    finally:
+        con.close()
+    get_runner()
+    log.info("Job %s queued (priority %d): %s", job_id, priority, question)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    con = _connect()
+    try:
+        row = con.execute("SELECT * FROM jobs WHERE id = ?", [job_id]).fetchone()
+    finally:
+        con.close()
+    return _job(row) if row else None
+
+
+def list_jobs(session: Optional[str] = None, limit: int = 20) -> list[Job]:
+    """Most recent jobs first (of one *session* if given)."""
+    con = _connect()
+    try:
+        if session:
+            rows = con.execute("SELECT * FROM jobs WHERE session = ? ORDER BY created_at DESC LIMIT ?",
+                               [session, limit]).fetchall()
+        else:
+            rows = con.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", [limit]).fetchall()
+    finally:
+        con.close()
+    return [_job(r) for r in rows]
+
+
+def queue_position(job_id: str) -> Optional[int]:
+    """1-based place among the waiting jobs, ``None`` if the job is not waiting."""
+    job = get_job(job_id)
+    if job is None or job.status != "queued":
+        return None
+    con = _connect()
+    try:
+        ahead = con.execute("SELECT count(*) FROM jobs WHERE status = 'queued' AND cancel = 0 AND "
+                            "(priority > ? OR (priority = ? AND created_at < ?))",
+                            [job.priority, job.priority, job.created_at]).fetchone()[0]
+    finally:
+        con.close()
+    return ahead + 1
+
+
+def cancel(job_id: str) -> None:
+    """Waiting jobs end at once; running ones are stopped by the runner."""
+    con = _connect()
+    try:
+        with con:
+            con.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", [job_id])
+            con.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                        [time.time(), job_id])
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":            # job process (started by JobRunner, never by hand)
+    from modules.worker_pool import set_memory_limit
+
+    set_memory_limit()                  # ANALYSIS_WORKER_MEMORY_MB, as for pool workers
+    if len(sys.argv) > 1:
+        _execute(sys.argv[1])
+    else:
+        _wait_for_job()
+    _exit()
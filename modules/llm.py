@@ -1,19 +1,32 @@
 import json
+import re
 from typing import Optional
 import os
-from typing import Optional, Any, List, Dict
+from typing import Optional, Any, AsyncIterator, List, Dict
 import pandas as pd
+import pyarrow as pa
+from modules.extraction import extract, split_return_items
+from modules.analysis import input_columns
+from modules.analysis_io import ANALYSIS_INPUT, write_analysis_input
+from pathlib import Path
 from modules.helper import (
     load_llm_json,
     load_prompt,
     call_llm_with_prompt,
+    astream_llm_with_prompt,
     strip_code_fences,
     render_template,
+    render_prompt,
     load_yaml,
     sanitize_cypher_code,
     run_cypher
 )
 from modules.logger import get_logger, log_json
+from modules.prompting import Prompt
+from modules.vector_search import search as vector_search
+from modules.vocabulary import local_structure, validate_params
+from modules.neo4j.proximity import FEATURE_RADIUS, SITE_RADIUS
+from modules.neo4j.spatial_queries import prompt_patterns
 logger = get_logger("debug")
 
 concepts = load_yaml("concepts.yml")
@@ -29,17 +42,44 @@ SUPPORTED_ANALYSES = [
 ALLOWED_FEATURE_KEYS = set(concepts.get("feature_keys", []))
 ALLOWED_SITE_KEYS    = set(concepts.get("site_keys", []))
 analysis_patterns = set(SUPPORTED_ANALYSES)
-
-
-def explain_de(question: str, stdout: str, stderr: str, *, model: Optional[str] = None) -> str:
+SEMANTIC_ANALYSES = {"similarity"}
+
+# Parameter keys per analysis (same as templates/system/analysis_params.jinja2)
+ANALYSIS_PARAM_KEYS = {
+    "autocorrelation":  ["x_column", "y_column", "value_column",
+                         "group_column", "group_a", "group_b", "distance_threshold"],
+    "colocation":       ["x_column", "y_column",
+                         "group_a", "group_b", "group_a_type", "group_b_type",
+                         "filter_a_column", "filter_a_value",
+                         "filter_b_column", "filter_b_value",
+                         "distance_threshold"],
+    "correlation":      ["x_column", "y_column"],
+    "hotspot":          ["x_column", "y_column", "value_column"],
+    "ripley_k":         ["x_column", "y_column", "simulations", "intervals"],
+    "spatial_distance": ["group_a", "group_b", "group_a_type", "group_b_type",
+                         "x_column", "y_column", "distance_threshold"],
+}
+# Large node properties that never belong in a tabular extraction (embedding only on request)
+HEAVY_PROPERTIES = {"embedding", "geometry", "location", "location_wgs84"}
+
+
+def _explain_de_shortcut(stdout: str, stderr: str) -> Optional[str]:
+    """Fixed answer when there is nothing for the LLM to explain."""
     if stderr.strip():
         return f"Die Analyse konnte nicht durchgeführt werden."
     if not stdout.strip():
         return "Die Analyse lieferte keine Ausgaben."
     if "error" in stdout.lower():
         return "Die Analyse konnte nicht durchgeführt werden."
+    return None
+
+
+def explain_de(question: str, stdout: str, stderr: str, *, model: Optional[str] = None) -> str:
+    shortcut = _explain_de_shortcut(stdout, stderr)
+    if shortcut:
+        return shortcut
 
-    prompt = render_template("explain_de.jinja2", {
+    prompt = render_prompt("explain_de.jinja2", {
         "question": question,
         "preview": stdout.strip()
     }, folder="system")
@@ -52,13 +92,41 @@ def explain_de(question: str, stdout: str, stderr: str, *, model: Optional[str]
     )
 
 
-def explain_cypher_result(question: str, rows: list[dict], *, model: Optional[str] = None) -> str:
-    preview = json.dumps(rows[:5], indent=2, ensure_ascii=False)
+async def stream_explain_de(
+    question: str, stdout: str, stderr: str, *, model: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Token stream of :func:`explain_de`."""
+    shortcut = _explain_de_shortcut(stdout, stderr)
+    if shortcut:
+        yield shortcut
+        return
 
-    prompt = render_template("explain_cypher_result.jinja2", {
+    prompt = render_prompt("explain_de.jinja2", {
+        "question": question,
+        "preview": stdout.strip()
+    }, folder="system")
+    async for chunk in astream_llm_with_prompt(
+        function_name="explain_de",
+        question=question,
+        prompt=prompt,
+        preview=stdout.strip(),
+        model=model
+    ):
+        yield chunk
+
+
+def _explain_cypher_prompt(question: str, rows: list[dict]) -> tuple[Prompt, str]:
+    preview = json.dumps(rows[:5], ensure_ascii=False, default=str)
+
+    prompt = render_prompt("explain_cypher_result.jinja2", {
         "question": question,
         "concepts": concepts
     }, folder="system")
+    return prompt, preview
+
+
+def explain_cypher_result(question: str, rows: list[dict], *, model: Optional[str] = None) -> str:
+    prompt, preview = _explain_cypher_prompt(question, rows)
 
     return call_llm_with_prompt(
         function_name="explain_cypher_result",
@@ -69,17 +137,32 @@ def explain_cypher_result(question: str, rows: list[dict], *, model: Optional[st
     )
 
 
+async def stream_explain_cypher_result(
+    question: str, rows: list[dict], *, model: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Token stream of :func:`explain_cypher_result`."""
+    prompt, preview = _explain_cypher_prompt(question, rows)
 
+    async for chunk in astream_llm_with_prompt(
+        function_name="explain_cypher_result",
+        question=question,
+        prompt=prompt,
+        preview=preview,
+        model=model
+    ):
+        yield chunk
 
-def generate_analysis_code(
+
+
+
+def generate_analysis_params(
     user_input: str,
     structure: dict,
     analysis_type: str,
     model: Optional[str] = None
-) -> List[Dict]:
-    """Return a parameter JSON + executable Python code block for the requested analysis."""
-    # 1 ─ Parameter extraction ───────────────────────────────────────────
-    param_prompt = render_template(
+) -> dict:
+    """Ask the LLM for the parameter JSON of *analysis_type* (every expected key present, None if absent)."""
+    param_prompt = render_prompt(
         "analysis_params.jinja2",
         {
             "question":       user_input,
@@ -93,29 +176,32 @@ def generate_analysis_code(
         function_name="analysis_params",
         question=user_input,
         prompt=param_prompt,
-        preview=json.dumps(structure, indent=2),
+        preview=json.dumps(structure, ensure_ascii=False, separators=(",", ":")),
         model=model,
     )
 
     try:
         params = json.loads(strip_code_fences(raw))
     except Exception as exc:
-        logger.warning("Parameter parsing failed (%s) → fallback to {}", exc, analysis_type)
+        logger.warning("Parameter parsing failed for %s (%s) → fallback to {}", analysis_type, exc)
         params = {}
 
-    # Ensure every required key exists (None if absent)
-    req_keys = {
-        "autocorrelation": ["x_column","y_column","value_column",
-                            "group_column","group_a","group_b","distance_threshold"],
-        "colocation":      ["x_column","y_column",
-                            "group_a","group_b","group_a_type","group_b_type",
-                            "filter_a_column","filter_a_value",
-                            "filter_b_column","filter_b_value",
-                            "distance_threshold"],
-        # … other types omitted for brevity
-    }[analysis_type]
-    for k in req_keys:
+    for k in ANALYSIS_PARAM_KEYS.get(analysis_type, []):
         params.setdefault(k, None)
+    return validate_params(analysis_type, params)     # VocabularyError if a group matches nothing
+
+
+def generate_analysis_code(
+    user_input: str,
+    structure: dict,
+    analysis_type: str,
+    model: Optional[str] = None,
+    params: Optional[dict] = None,
+) -> List[Dict]:
+    """Return a parameter JSON + executable Python code block for the requested analysis."""
+    # 1 ─ Parameter extraction (skipped if the caller already has them) ─
+    if params is None:
+        params = generate_analysis_params(user_input, structure, analysis_type, model=model)
 
     # 2 ─ Code generation ────────────────────────────────────────────────
     code_block = render_template(
@@ -137,6 +223,28 @@ def generate_analysis_code(
 
 
 
+def find_similar(
+    question: str,
+    structure: dict | None = None,
+    *,
+    k: int = 10,
+    category: Optional[List[str]] = None,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    mode: str = "ivf",
+) -> List[Dict]:
+    """
+    Semantische Top-k-Suche über den lokalen Embedding-Index (modules.vector_search).
+    Die Entität (Site/Feature) wird aus der extrahierten Struktur übernommen.
+    """
+    nodes = (structure or {}).get("nodes") or []
+    entity = "Sites" if nodes and nodes[0].get("type") == "Site" else "Features"
+    hits = vector_search(question, entity, k, category=category, bbox=bbox, mode=mode)
+    key = "SiteID" if entity == "Sites" else "FeatureID"
+    rows = hits.rename(columns={"id": key}).to_dict(orient="records")
+    logger.info("Vector search (%s, %s): %d hits", entity, mode, len(rows))
+    return rows
+
+
 def generate_cypher(question: str, *, model: Optional[str] = None) -> str:
     """
     Erzeugt einen Cypher-Query durch das LLM basierend auf einem systemweiten Template.
@@ -144,9 +252,11 @@ def generate_cypher(question: str, *, model: Optional[str] = None) -> str:
     """
 
     # 1. Systemprompt aus Template generieren
-    prompt = render_template("generate_cypher.jinja2", {
+    prompt = render_prompt("generate_cypher.jinja2", {
         "question": question,
-        "concepts": concepts
+        "concepts": concepts,
+        "close_to_radius": int(min(SITE_RADIUS, FEATURE_RADIUS)),
+        "spatial_patterns": prompt_patterns(),
     }, folder="system")
 
     # 2. LLM aufrufen
@@ -165,7 +275,11 @@ def generate_cypher(question: str, *, model: Optional[str] = None) -> str:
 
     
 def extract_semantic_structure(question: str, analysis_type: Optional[str] = None, model: Optional[str] = None) -> dict:
-    prompt = render_template("extract_semantic_structure.jinja2", {
+    local = local_structure(question, analysis_type)     # all terms known → no LLM call
+    if local is not None:
+        return local
+
+    prompt = render_prompt("extract_semantic_structure.jinja2", {
         "question": question,
         "concepts": concepts,
         "analysis_type": analysis_type or "",  # leer als fallback
@@ -187,17 +301,29 @@ def extract_semantic_structure(question: str, analysis_type: Optional[str] = Non
         return {"analysis_type": []}
 
 
-def decide_query_or_python(user_input: str) -> tuple[str, dict, str]:
-    # Schritt 1: Typ klassifizieren
-        # Schritt 1: Typ klassifizieren
-    prompt = render_template("classify_analysis_type.jinja2", {
+def classify_analysis_types(user_input: str) -> List[str]:
+    """Ask the LLM which analysis types the question contains (lower-cased)."""
+    prompt = render_prompt("classify_analysis_type.jinja2", {
         "question": user_input
     }, folder="system")
+    raw = call_llm_with_prompt("classify_analysis_type", user_input, prompt, "")
+    analysis_types = json.loads(strip_code_fences(raw))["analysis_types"]
+    return [a.strip().lower() for a in analysis_types]
+
+
+def decision_for(analysis_type: str) -> str:
+    """Execution path of an analysis type: python | vector | cypher."""
+    if analysis_type in analysis_patterns:
+        return "python"
+    if analysis_type in SEMANTIC_ANALYSES:
+        return "vector"
+    return "cypher"
 
+
+def decide_query_or_python(user_input: str) -> tuple[str, dict, str]:
+    # Schritt 1: Typ klassifizieren
     try:
-        raw = call_llm_with_prompt("classify_analysis_type", user_input, prompt, "")
-        analysis_types = json.loads(strip_code_fences(raw))["analysis_types"]
-        analysis_types = [a.strip().lower() for a in analysis_types]
+        analysis_types = classify_analysis_types(user_input)
         logger.info(f"🧠 Analyse-Typen erkannt: {analysis_types}")
     except Exception as e:
         logger.error(f"❌ Fehler bei der Typ-Klassifizierung: {e}")
@@ -207,7 +333,7 @@ def decide_query_or_python(user_input: str) -> tuple[str, dict, str]:
     for analysis_type in analysis_types:
         try:
             structure = extract_semantic_structure(user_input, analysis_type=analysis_type)
-            decision = "python" if analysis_type in analysis_patterns else "cypher"
+            decision = decision_for(analysis_type)
             results.append((decision, structure, analysis_type))
             logger.debug(f"📦 Struktur für {analysis_type.upper()}:\n{json.dumps(structure, indent=2)}")
         except Exception as e:
@@ -219,28 +345,76 @@ def decide_query_or_python(user_input: str) -> tuple[str, dict, str]:
 
 
 
-def extract_relevant_data(
+def required_columns(analysis_type: Optional[str], params: Optional[dict]) -> Optional[set[str]]:
+    """
+    Minimal column set (aliases of analysis_input) for *analysis_type* and its *params* –
+    what the library function in modules/analysis reads (``input_columns``).
+    None if the analysis is unknown – then the RETURN clause is only cleaned, not reduced.
+    """
+    return input_columns(analysis_type, params)
+
+
+def _projection(alias: str) -> Optional[str]:
+    """``feature_X`` → ``f.X AS feature_X`` (None for unknown columns)."""
+    if alias in ("FeatureID", "SiteID"):
+        var = "f" if alias == "FeatureID" else "s"
+        return f"{var}.{alias} AS {alias}"
+    for prefix, var, allowed in (("feature_", "f", ALLOWED_FEATURE_KEYS), ("site_", "s", ALLOWED_SITE_KEYS)):
+        if alias.startswith(prefix):
+            col = alias[len(prefix):]
+            if col in allowed and col not in HEAVY_PROPERTIES:
+                return f"{var}.{col} AS {alias}"
+    return None
+
+
+def prune_return_clause(
+    return_clause: str,
+    required: Optional[set[str]] = None,
+    *,
+    include_embeddings: bool = False,
+) -> str:
+    """
+    Projection pushdown for the extraction query: drop heavy properties
+    (embedding only if not requested) and, with *required*, reduce the clause
+    to exactly those aliases – missing ones are added as ``f.<col>``/``s.<col>``.
+    """
+    heavy = HEAVY_PROPERTIES - ({"embedding"} if include_embeddings else set())
+    heavy_re = re.compile(r"\.\s*(" + "|".join(sorted(heavy)) + r")\b")
+    kept: Dict[str, str] = {}
+    for item in split_return_items(return_clause):
+        match = re.search(r"\s+AS\s+`?(\w+)`?\s*$", item, flags=re.I)
+        alias = match.group(1) if match else item.strip()
+        if heavy_re.search(item) or (required is not None and alias not in required):
+            continue
+        kept.setdefault(alias, item)
+    for alias in sorted((required or set()) - set(kept)):
+        projection = _projection(alias)
+        if projection:
+            kept[alias] = projection
+    return ", ".join(kept.values()) or "f.FeatureID AS FeatureID, s.SiteID AS SiteID"
+
+
+def plan_extraction(
     question: str,
     structure: dict | None = None,
-    path: str = "results/analysis_input.json",
     model: Optional[str] = None,
-) -> List[Dict]:
+    *,
+    analysis_type: Optional[str] = None,
+    params: Optional[dict] = None,
+    include_embeddings: Optional[bool] = None,
+) -> tuple[str, str]:
     """
-    ● Ask the LLM (via Jinja template) for a Cypher WHERE and RETURN clause that match the user question.  
-    ● Run the resulting query against Neo4j (`(s:Site)-[:HAS_FEATURE]->(f:Feature)`).  
-    ● Dump the rows to *analysis_input.json*.
-
-    Returns the list of dictionaries written to disk.
+    Ask the LLM (via Jinja template) for the Cypher WHERE and RETURN clause that match
+    the user question and reduce the RETURN clause to the columns *analysis_type* /
+    *params* need (see ``required_columns``). Returns ``(where_clause, return_clause)``.
     """
-    prompt = render_template("extract_relevant_headers.jinja2", {
+    prompt = render_prompt("extract_relevant_headers.jinja2", {
             "question": question,
             "concepts": concepts,
             "structure": structure or {},  # leer als fallback
         }, folder="system")
 
     raw = call_llm_with_prompt("extract_relevant_headers", question, prompt, "", model=model)
-    # ---- 1 Render prompt & call LLM --------------------------------------------------------------
-   
 
     try:
         clauses: Dict[str, str] = load_llm_json(raw)
@@ -253,22 +427,61 @@ def extract_relevant_data(
         where_clause  = "TRUE"
         return_clause = "f.FeatureID AS FeatureID, s.SiteID AS SiteID"
 
-    # ---- 2 Build & run Cypher -------------------------------------------------------------------
-    cypher = (
-        f"MATCH (s:Site)-[:HAS_FEATURE]->(f:Feature) "
-        f"WHERE {where_clause} "
-        f"RETURN {return_clause}"
+    if include_embeddings is None:
+        include_embeddings = "embedding" in question.lower()
+    pruned = prune_return_clause(
+        return_clause, required_columns(analysis_type, params), include_embeddings=include_embeddings
     )
-
+    if pruned != return_clause:
+        logger.info("RETURN clause pruned: %s → %s", return_clause, pruned)
+    return where_clause, pruned
+
+
+def run_extraction(
+    where_clause: str,
+    return_clause: str,
+    path: str | Path = ANALYSIS_INPUT,
+    *,
+    backend: Optional[str] = None,
+) -> pa.Table:
+    """
+    Run the extraction (Neo4j or DuckDB, see modules/extraction.py) and write it to *path*.
+    A failing extraction raises and writes nothing, so a file at *path* always holds a
+    complete result (``orchestrator._SharedExtractions`` reuses it on that basis).
+    """
     try:
-            rows = run_cypher(cypher)
-            logger.info("Retrieved %d rows via extract_relevant_data", len(rows))
-    except Exception as exc:                                   # noqa: BLE001
-        logger.exception("Cypher execution failed: %s", exc)
+        table, used = extract(where_clause, return_clause, backend=backend)
+    except Exception as exc:
+        logger.error("Extraction failed: %s", exc)
+        raise
+    logger.info("Retrieved %d rows (%d columns) via %s", table.num_rows, table.num_columns, used)
+
+    # Arrow IPC + WKB geometry (written atomically); JSON only as debug dump
+    write_analysis_input(table, path)
+    return table
+
 
-    # ---- 3 Persist to disk ----------------------------------------------------------------------
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as fh:
-        json.dump(rows, fh, indent=2, ensure_ascii=False)
+def extract_relevant_data(
+    question: str,
+    structure: dict | None = None,
+    path: str | Path = ANALYSIS_INPUT,
+    model: Optional[str] = None,
+    *,
+    analysis_type: Optional[str] = None,
+    params: Optional[dict] = None,
+    include_embeddings: Optional[bool] = None,
+    backend: Optional[str] = None,
+) -> pa.Table:
+    """
+    ● Ask the LLM for the WHERE and RETURN clause (``plan_extraction``).  
+    ● Run `(s:Site)-[:HAS_FEATURE]->(f:Feature)` with these clauses on the configured backend  
+      (Neo4j via Bolt or DuckDB on the local file, ``EXTRACTION_BACKEND``) into Arrow columns.  
+    ● Hand the rows over as Arrow IPC file (*analysis_input.arrow*, see modules/analysis_io.py).
 
-    return rows
\ No newline at end of file
+    Returns the Arrow table that was written to disk.
+    """
+    where_clause, return_clause = plan_extraction(
+        question, structure, model,
+        analysis_type=analysis_type, params=params, include_embeddings=include_embeddings,
+    )
+    return run_extraction(where_clause, return_clause, path, backend=backend)
@@ -0,0 +1,253 @@
+"""
+Persistenter Cache für LLM-Antworten
+------------------------------------
+Sitzt vor ``helper.call_llm_with_prompt``:
+
+* Exakt   – Schlüssel = sha256(model, temperature, messages) → identische Anfrage, identische Antwort
+* Semantisch (optional, ``LLM_CACHE_SEMANTIC=1``) – für Planungsschritte
+  (``LLM_CACHE_SEMANTIC_FUNCTIONS``) wird eine Antwort wiederverwendet, wenn
+  Funktion, Modell, Temperatur und Prompt ohne die Frage übereinstimmen und das
+  Embedding der neuen Frage ≥ ``LLM_CACHE_SIMILARITY`` (Kosinus) zu einer gecachten Frage ist
+* TTL (``LLM_CACHE_TTL`` Sekunden) und Größenlimit (``LLM_CACHE_MAX_MB``, LRU)
+* Treffer/Fehlschläge werden mitgezählt und geloggt (``cache_stats()``)
+
+SQLite statt DuckDB, weil mehrere Streamlit-Sessions gleichzeitig kleine
+Einzelzeilen schreiben (WAL erlaubt parallele Leser neben einem Schreiber).
+
+Einfache Nutzung:  ▸  from modules.llm_cache import lookup, store
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from modules.logger import get_logger
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+LLM_CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").lower() in {"1", "true", "yes"}
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))        # seconds, 0 = no expiry
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+SEMANTIC_ENABLED = os.getenv("LLM_CACHE_SEMANTIC", "0").lower() in {"1", "true", "yes"}
+SEMANTIC_THRESHOLD = float(os.getenv("LLM_CACHE_SIMILARITY", "0.97"))
+# Steps whose answer is a plan for the question (not an explanation of results)
+SEMANTIC_FUNCTIONS = set(filter(None, os.getenv(
+    "LLM_CACHE_SEMANTIC_FUNCTIONS",
+    "classify_analysis_type,extract_semantic_structure,extract_relevant_headers,analysis_params,generate_cypher,"
+    "plan_analysis",
+).split(",")))
+
+QUESTION_PLACEHOLDER = "\x00QUESTION\x00"
+EVICT_EVERY = 50                    # size check every n writes
+
+_stats: Counter = Counter()
+_lock = threading.Lock()
+_writes = 0
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _connect() -> sqlite3.Connection:
+    LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(LLM_CACHE_PATH), timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key          TEXT PRIMARY KEY,
+            semantic_key TEXT NOT NULL,
+            function     TEXT NOT NULL,
+            model        TEXT NOT NULL,
+            question     TEXT,
+            response     TEXT NOT NULL,
+            embedding    BLOB,
+            created_at   REAL NOT NULL,
+            last_used    REAL NOT NULL,
+            hits         INTEGER NOT NULL DEFAULT 0,
+            size         INTEGER NOT NULL
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS llm_cache_semantic ON llm_cache (semantic_key)")
+    return con
+
+def _sha(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+def exact_key(model: str, temperature: float, messages: list[dict]) -> str:
+    return _sha({"model": model, "temperature": round(float(temperature), 4), "messages": messages})
+
+def semantic_key(function_name: str, model: str, temperature: float, question: str, messages: list[dict]) -> str:
+    """Same as :func:`exact_key` but with every occurrence of *question* masked."""
+    masked = [
+        {**m, "content": m["content"].replace(question, QUESTION_PLACEHOLDER) if question else m["content"]}
+        for m in messages
+    ]
+    return _sha({"function": function_name, "model": model,
+                 "temperature": round(float(temperature), 4), "messages": masked})
+
+def _embed(question: str) -> Optional[np.ndarray]:
+    from modules.neo4j.generate_embeddings import cached_embeddings
+
+    try:
+        vec = np.asarray(cached_embeddings([question])[0], dtype=np.float32)
+    except Exception as exc:
+        log.warning("LLM cache: question embedding failed (%s) → semantic tier skipped", exc)
+        return None
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else None
+
+def _semantic_enabled(function_name: str, question: str) -> bool:
+    return SEMANTIC_ENABLED and bool(question.strip()) and function_name in SEMANTIC_FUNCTIONS
+
+def _not_expired_sql() -> tuple[str, list]:
+    if LLM_CACHE_TTL <= 0:
+        return "1 = 1", []
+    return "created_at >= ?", [time.time() - LLM_CACHE_TTL]
+
+def _record(function_name: str, outcome: str) -> None:
+    with _lock:
+        _stats[outcome] += 1
+        total = sum(_stats.values())
+        hits = _stats["exact"] + _stats["semantic"]
+    log.info("LLM cache %s for %s (hit rate %.0f%% over %d lookups)",
+             outcome, function_name, 100 * hits / total, total)
+
+def _evict(con: sqlite3.Connection) -> int:
+    """Drop expired rows, then least recently used rows until the cache fits ``LLM_CACHE_MAX_MB``."""
+    removed = 0
+    if LLM_CACHE_TTL > 0:
+        removed += con.execute("DELETE FROM llm_cache WHERE created_at < ?", [time.time() - LLM_CACHE_TTL]).rowcount
+    budget = int(LLM_CACHE_MAX_MB * 1024 * 1024)
+    total = con.execute("SELECT coalesce(sum(size), 0) FROM llm_cache").fetchone()[0]
+    if total > budget:
+        cur = con.execute("SELECT key, size FROM llm_cache ORDER BY last_used")
+        drop = []
+        for key, size in cur:
+            if total <= budget:
+                break
+            drop.append((key,))
+            total -= size
+        con.executemany("DELETE FROM llm_cache WHERE key = ?", drop)
+        removed += len(drop)
+    if removed:
+        log.info("LLM cache: evicted %d entries", removed)
+    return removed
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def lookup(
+    function_name: str,
+    question: str,
+    model: str,
+    temperature: float,
+    messages: list[dict],
+) -> Optional[tuple[str, str]]:
+    """
+    Cached answer for this call or ``None``.
+    Returns ``(response, tier)`` with tier ``"exact"`` or ``"semantic"``.
+    """
+    if not LLM_CACHE_ENABLED:
+        return None
+    key = exact_key(model, temperature, messages)
+    alive, alive_args = _not_expired_sql()
+    con = _connect()
+    try:
+        row = con.execute(f"SELECT response FROM llm_cache WHERE key = ? AND {alive}", [key, *alive_args]).fetchone()
+        if row:
+            with con:
+                con.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", [time.time(), key])
+            _record(function_name, "exact")
+            return row[0], "exact"
+
+        if _semantic_enabled(function_name, question):
+            skey = semantic_key(function_name, model, temperature, question, messages)
+            candidates = con.execute(
+                f"SELECT key, response, embedding FROM llm_cache "
+                f"WHERE semantic_key = ? AND embedding IS NOT NULL AND {alive}",
+                [skey, *alive_args],
+            ).fetchall()
+            query = _embed(question) if candidates else None
+            if query is not None:
+                matrix = np.stack([np.frombuffer(c[2], dtype=np.float32) for c in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= SEMANTIC_THRESHOLD:
+                    with con:
+                        con.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                                    [time.time(), candidates[best][0]])
+                    log.debug("LLM cache: semantic match %.3f for %r", scores[best], question)
+                    _record(function_name, "semantic")
+                    return candidates[best][1], "semantic"
+    finally:
+        con.close()
+
+    _record(function_name, "miss")
+    return None
+
+
+def store(
+    function_name: str,
+    question: str,
+    model: str,
+    temperature: float,
+    messages: list[dict],
+    response: str,
+) -> None:
+    """Persist *response*; planning steps also get the question embedding for the semantic tier."""
+    global _writes
+    if not LLM_CACHE_ENABLED:
+        return
+    key = exact_key(model, temperature, messages)
+    skey = semantic_key(function_name, model, temperature, question, messages)
+    vec = _embed(question) if _semantic_enabled(function_name, question) else None
+    blob = vec.tobytes() if vec is not None else None
+    size = len(response.encode("utf-8")) + len(question.encode("utf-8")) + (len(blob) if blob else 0)
+    now = time.time()
+
+    con = _connect()
+    try:
+        with con:
+            con.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                [key, skey, function_name, model, question, response, blob, now, now, size],
+            )
+            with _lock:
+                _writes += 1
+                due = _writes % EVICT_EVERY == 1
+            if due:
+                _evict(con)
+    finally:
+        con.close()
+
+
+def cache_stats() -> dict[str, float]:
+    """Lookup counters of this process plus the hit rate."""
+    with _lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    hits = stats.get("exact", 0) + stats.get("semantic", 0)
+    return {**stats, "lookups": total, "hit_rate": hits / total if total else 0.0}
+
+
+def clear_cache() -> None:
+    con = _connect()
+    try:
+        with con:
+            con.execute("DELETE FROM llm_cache")
+    finally:
+        con.close()
@@ -0,0 +1,355 @@
+"""
+Neo4j-Verbindungsverwaltung
+---------------------------
+* Ein gemeinsamer, gepoolter Driver pro (URI, User) – erst beim ersten Zugriff erzeugt
+* Async-Variante (ein Driver pro Event-Loop, beim Beenden mit geschlossen)
+* Lesezugriffe als geroutete Read-Transaktionen mit Fetch-Size und Timeout
+* Streaming-Abfragen als Arrow-RecordBatches (Limit, Abbruch, typisierte Spalten)
+* "Datenbank befüllt?"-Check über den ``(:ImportMeta)``-Marker statt ``count(n)``, gecacht
+* Einfache Session-/Query-Metriken (Sidebar der App, Log beim Beenden)
+
+Einfache Nutzung:  ▸  from modules.neo4j.connection import read_query, is_populated
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Union
+
+from neo4j import (
+    READ_ACCESS,
+    AsyncDriver,
+    AsyncGraphDatabase,
+    Driver,
+    GraphDatabase,
+    Query,
+    basic_auth,
+    unit_of_work,
+)
+
+import pyarrow as pa
+from neo4j.graph import Node, Relationship
+
+from modules.logger import get_logger
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASS = os.getenv("NEO4J_PASS") or os.getenv("NEO4J_PASSWORD", "")
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE") or None
+
+POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+FETCH_SIZE = int(os.getenv("NEO4J_FETCH_SIZE", "1000"))
+QUERY_TIMEOUT = float(os.getenv("NEO4J_QUERY_TIMEOUT", "60"))
+HEALTH_TTL = float(os.getenv("NEO4J_HEALTH_TTL", "30"))
+
+_lock = threading.Lock()
+_drivers: dict[tuple[str, str], Driver] = {}
+_async_drivers: dict[asyncio.AbstractEventLoop, AsyncDriver] = {}
+_health: dict[str, Any] = {"populated": None, "version": None, "checked_at": 0.0}
+_metrics: dict[str, float] = {
+    "drivers_created": 0, "sessions_opened": 0, "sessions_active": 0,
+    "queries": 0, "query_errors": 0, "query_seconds": 0.0,
+}
+
+# ---------------------------------------------------------------------------
+# Drivers
+# ---------------------------------------------------------------------------
+def _driver_kwargs() -> dict[str, Any]:
+    return {
+        "max_connection_pool_size": POOL_SIZE,
+        "connection_acquisition_timeout": QUERY_TIMEOUT,
+        "liveness_check_timeout": 30.0,
+    }
+
+def get_driver(uri: Optional[str] = None, user: Optional[str] = None, password: Optional[str] = None) -> Driver:
+    """Shared pooled driver; created on first use, never at import time."""
+    uri, user = uri or NEO4J_URI, user or NEO4J_USER
+    key = (uri, user)
+    with _lock:
+        driver = _drivers.get(key)
+        if driver is None:
+            driver = GraphDatabase.driver(
+                uri, auth=basic_auth(user, password if password is not None else NEO4J_PASS), **_driver_kwargs()
+            )
+            _drivers[key] = driver
+            _metrics["drivers_created"] += 1
+            log.info("Neo4j driver created for %s (pool size %d).", uri, POOL_SIZE)
+        return driver
+
+def get_async_driver() -> AsyncDriver:
+    """Async driver for the running event loop (async drivers must not cross loops)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        driver = _async_drivers.get(loop)
+        if driver is None:
+            driver = AsyncGraphDatabase.driver(
+                NEO4J_URI, auth=basic_auth(NEO4J_USER, NEO4J_PASS), **_driver_kwargs()
+            )
+            _async_drivers[loop] = driver
+            _metrics["drivers_created"] += 1
+        return driver
+
+async def close_async_driver() -> None:
+    """Close the driver of the running loop – call before the loop ends (``close_drivers`` is the fallback)."""
+    with _lock:
+        driver = _async_drivers.pop(asyncio.get_running_loop(), None)
+    if driver is not None:
+        await driver.close()
+
+def _close_async(loop: asyncio.AbstractEventLoop, driver: AsyncDriver) -> None:
+    """Close *driver* on the loop it was created on (its sockets belong to that loop)."""
+    if loop.is_closed():
+        log.debug("Event loop already closed – async Neo4j driver released with the process.")
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(driver.close(), loop).result(timeout=5.0)
+    else:
+        loop.run_until_complete(driver.close())
+
+def close_drivers() -> None:
+    if not _drivers and not _async_drivers:
+        return
+    log.info("Neo4j metrics at shutdown: %s", pool_metrics())
+    with _lock:
+        drivers, async_drivers = list(_drivers.values()), list(_async_drivers.items())
+        _drivers.clear()
+        _async_drivers.clear()
+    for driver in drivers:
+        driver.close()
+    for loop, driver in async_drivers:
+        try:
+            _close_async(loop, driver)
+        except Exception as exc:                               # noqa: BLE001 - best effort at shutdown
+            log.warning("Could not close async Neo4j driver: %s", exc)
+    log.info("Neo4j drivers closed.")
+
+atexit.register(close_drivers)
+
+@contextmanager
+def session(access_mode: str = READ_ACCESS, fetch_size: int = FETCH_SIZE, **kwargs) -> Iterator[Any]:
+    """Session on the shared driver (counted in the pool metrics)."""
+    with _lock:
+        _metrics["sessions_opened"] += 1
+        _metrics["sessions_active"] += 1
+    try:
+        with get_driver().session(
+            database=NEO4J_DATABASE, default_access_mode=access_mode, fetch_size=fetch_size, **kwargs
+        ) as s:
+            yield s
+    finally:
+        with _lock:
+            _metrics["sessions_active"] -= 1
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+def _record(started: float, failed: bool) -> None:
+    with _lock:
+        _metrics["queries"] += 1
+        _metrics["query_seconds"] += time.perf_counter() - started
+        if failed:
+            _metrics["query_errors"] += 1
+
+def _run_tx(query: str, params: dict[str, Any], timeout: float):
+    @unit_of_work(timeout=timeout)
+    def work(tx):
+        return [rec.data() for rec in tx.run(query, params)]
+    return work
+
+def read_query(
+    query: str,
+    params: Optional[dict[str, Any]] = None,
+    *,
+    fetch_size: int = FETCH_SIZE,
+    timeout: float = QUERY_TIMEOUT,
+) -> list[dict[str, Any]]:
+    """Run *query* in a routed read transaction (retried by the driver on transient errors)."""
+    started, failed = time.perf_counter(), True
+    try:
+        with session(READ_ACCESS, fetch_size) as s:
+            rows = s.execute_read(_run_tx(query, params or {}, timeout))
+        failed = False
+        return rows
+    finally:
+        _record(started, failed)
+
+async def read_query_async(
+    query: str,
+    params: Optional[dict[str, Any]] = None,
+    *,
+    fetch_size: int = FETCH_SIZE,
+    timeout: float = QUERY_TIMEOUT,
+) -> list[dict[str, Any]]:
+    """Async ``read_query`` on the driver of the running event loop."""
+    async def work(tx):
+        result = await tx.run(query, params or {})
+        return [rec.data() async for rec in result]
+
+    with _lock:
+        _metrics["sessions_opened"] += 1
+        _metrics["sessions_active"] += 1
+    started, failed = time.perf_counter(), True
+    try:
+        async with get_async_driver().session(
+            database=NEO4J_DATABASE, default_access_mode=READ_ACCESS, fetch_size=fetch_size
+        ) as s:
+            rows = await s.execute_read(unit_of_work(timeout=timeout)(work))
+        failed = False
+        return rows
+    finally:
+        _record(started, failed)
+        with _lock:
+            _metrics["sessions_active"] -= 1
+
+# ---------------------------------------------------------------------------
+# Streaming (columnar)
+# ---------------------------------------------------------------------------
+Cancel = Union[threading.Event, Callable[[], bool], None]
+
+def _cancelled(cancel: Cancel) -> bool:
+    if cancel is None:
+        return False
+    return cancel.is_set() if isinstance(cancel, threading.Event) else bool(cancel())
+
+def _native(value: Any) -> Any:
+    """Neo4j temporal/graph values → plain Python (points stay coordinate tuples)."""
+    if isinstance(value, (Node, Relationship)):
+        return dict(value.items())
+    to_native = getattr(value, "to_native", None)
+    return to_native() if callable(to_native) else value
+
+def _column(values: list[Any]) -> pa.Array:
+    sample = next((v for v in values if v is not None), None)
+    if sample is not None and (isinstance(sample, (Node, Relationship)) or hasattr(sample, "to_native")):
+        values = [None if v is None else _native(v) for v in values]
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed types in one column (e.g. '12' and 12) → keep as text
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+def stream_cypher(
+    query: str,
+    params: Optional[dict[str, Any]] = None,
+    *,
+    chunk_size: int = FETCH_SIZE,
+    limit: Optional[int] = None,
+    cancel: Cancel = None,
+    timeout: float = QUERY_TIMEOUT,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Stream *query* as Arrow record batches of up to *chunk_size* rows.
+
+    Records are pulled from the server *chunk_size* at a time (fetch size) and
+    appended column-wise – no per-row dicts. Stops after *limit* rows or as soon
+    as *cancel* (Event or callable) fires; the rest of the result is discarded
+    server-side and the read transaction is rolled back.
+    Column types are inferred per batch; use ``cypher_to_arrow`` for one table.
+    """
+    started, failed = time.perf_counter(), True
+    emitted = 0
+    try:
+        with session(READ_ACCESS, chunk_size) as s, s.begin_transaction(timeout=timeout) as tx:
+            result = tx.run(query, params or {})
+            keys = list(result.keys())
+            columns: list[list[Any]] = [[] for _ in keys]
+            stopped = False
+            for record in result:
+                for col, value in zip(columns, record.values()):
+                    col.append(value)
+                emitted += 1
+                if len(columns[0]) >= chunk_size:
+                    yield pa.RecordBatch.from_arrays([_column(c) for c in columns], names=keys)
+                    columns = [[] for _ in keys]
+                    if _cancelled(cancel):
+                        log.info("Cypher stream cancelled after %d rows.", emitted)
+                        stopped = True
+                if limit is not None and emitted >= limit:
+                    stopped = True
+                if stopped:
+                    result.consume()
+                    break
+            if keys and columns[0]:
+                yield pa.RecordBatch.from_arrays([_column(c) for c in columns], names=keys)
+        failed = False
+    finally:
+        _record(started, failed)
+        log.debug("Cypher stream: %d rows in %.2fs", emitted, time.perf_counter() - started)
+
+def _stringify(table: pa.Table, columns: set[str]) -> pa.Table:
+    for name in columns:
+        i = table.column_names.index(name)
+        text = pa.array([None if v is None else str(v) for v in table.column(name).to_pylist()], type=pa.string())
+        table = table.set_column(i, name, text)
+    return table
+
+def cypher_to_arrow(query: str, params: Optional[dict[str, Any]] = None, **kwargs) -> pa.Table:
+    """Collect ``stream_cypher`` into one Arrow table (schemas of the batches are unified)."""
+    tables = [pa.Table.from_batches([batch]) for batch in stream_cypher(query, params, **kwargs)]
+    if not tables:
+        return pa.table({})
+    try:
+        return pa.concat_tables(tables, promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # a column changed type between batches → fall back to text for those columns
+        mixed = {
+            name for name in tables[0].column_names
+            if len({str(t.schema.field(name).type) for t in tables if t.schema.field(name).type != pa.null()}) > 1
+        }
+        tables = [_stringify(t, mixed) for t in tables]
+        return pa.concat_tables(tables, promote_options="permissive")
+
+# ---------------------------------------------------------------------------
+# Health
+# ---------------------------------------------------------------------------
+def invalidate_health_cache() -> None:
+    _health.update(populated=None, version=None, checked_at=0.0)
+
+def is_populated(local_version: Optional[int] = None, ttl: float = HEALTH_TTL) -> bool:
+    """
+    True if Neo4j holds an import. Reads the ``(:ImportMeta)`` marker (one index
+    lookup) and caches the answer for *ttl* seconds or until *local_version*
+    (the last completed DuckDB import) changes. The probe is a single auto-commit
+    query without driver retries, so an unreachable server fails fast (→ False).
+    """
+    fresh = time.monotonic() - _health["checked_at"] < ttl
+    if _health["populated"] is not None and fresh and _health["version"] == local_version:
+        return _health["populated"]
+    started, failed = time.perf_counter(), True
+    try:
+        with session(READ_ACCESS) as s:
+            row = s.run(Query(
+                "OPTIONAL MATCH (m:ImportMeta {name: 'wadi'}) "
+                "RETURN m.version AS version, EXISTS { MATCH (:Site) } AS has_sites",
+                timeout=5.0,
+            )).single()
+        populated = bool(row and (row["version"] or row["has_sites"]))
+        failed = False
+    except Exception as exc:                                   # noqa: BLE001
+        log.warning("Could not check Neo4j state: %s", exc)
+        populated = False
+    finally:
+        _record(started, failed)
+    _health.update(populated=populated, version=local_version, checked_at=time.monotonic())
+    return populated
+
+def pool_metrics() -> dict[str, Any]:
+    """
+    Session/query counters of this process plus the open drivers. Only our own
+    counters – the driver's pool internals are private and change between versions.
+    """
+    with _lock:
+        metrics: dict[str, Any] = dict(_metrics)
+        metrics["drivers_open"] = len(_drivers) + len(_async_drivers)
+    metrics["avg_query_ms"] = round(metrics["query_seconds"] / metrics["queries"] * 1000, 2) if metrics["queries"] else 0.0
+    metrics["max_pool_size"] = POOL_SIZE
+    return metrics
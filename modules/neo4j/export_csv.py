@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import duckdb
+import pandas as pd
 from pathlib import Path
 import logging
 
+from modules.neo4j.import_state import pending_changes
+
 CACHE_DUCKDB = Path("cache/duckdb")
 CACHE_DUCKDB.mkdir(parents=True, exist_ok=True)
 DB_PATH = CACHE_DUCKDB / "archaeology.duckdb"
@@ -15,11 +18,27 @@ FEATS_CSV = DATA_DIR / "feat_vec.csv"
 
 log = logging.getLogger(__name__)
 
-def export_csvs() -> tuple[Path, Path]:
+def _copy(con: duckdb.DuckDBPyConnection, table: str, key: str, target: Path, delta: bool) -> None:
+    if not delta:
+        con.execute(f"COPY (SELECT * EXCLUDE (geometry) FROM {table}) TO '{target}' (HEADER, DELIMITER ',')")
+        return
+    keys = pending_changes(con, table)["upsert"]
+    con.register("_keys", pd.DataFrame({"key": pd.Series(keys, dtype="object")}))
+    con.execute(
+        f"COPY (SELECT t.* EXCLUDE (geometry) FROM {table} t JOIN _keys k ON CAST(t.{key} AS VARCHAR) = k.key) "
+        f"TO '{target}' (HEADER, DELIMITER ',')"
+    )
+    con.unregister("_keys")
+
+def export_csvs(delta: bool = False) -> tuple[Path, Path]:
+    """
+    Export Sites/Features; with ``delta=True`` only rows inserted/updated since the last complete import.
+    The WKB ``geometry`` column stays in DuckDB – Neo4j derives its WKT from X/Y.
+    """
     con = duckdb.connect(str(DB_PATH))
 
-    con.execute(f"COPY (SELECT * FROM Sites) TO '{SITES_CSV}' (HEADER, DELIMITER ',')")
-    con.execute(f"COPY (SELECT * FROM Features) TO '{FEATS_CSV}' (HEADER, DELIMITER ',')")
+    _copy(con, "Sites", "SiteID", SITES_CSV, delta)
+    _copy(con, "Features", "FeatureID", FEATS_CSV, delta)
 
     con.close()
     log.info("Exported CSVs: %s, %s", SITES_CSV, FEATS_CSV)
@@ -1,15 +1,19 @@
 from __future__ import annotations
 
 import os
-import json
+import asyncio
 import hashlib
 import pickle
 import logging
+import random
+import sqlite3
+import threading
 import time
 from pathlib import Path
-from typing import List
+from typing import Callable, Optional
 
 import duckdb
+import numpy as np
 import pandas as pd
 import openai
 import streamlit as st
@@ -21,84 +25,322 @@ CACHE_DUCKDB = Path("cache/duckdb")
 CACHE_DUCKDB.mkdir(parents=True, exist_ok=True)
 DB_PATH = CACHE_DUCKDB / "archaeology.duckdb"
 EMBED_CACHE_PATH = CACHE_DUCKDB / "embeddings.duckdb"
+QUERY_EMBED_CACHE_PATH = Path(os.getenv("QUERY_EMBED_CACHE_PATH", "cache/query_embeddings.sqlite"))
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-EMBED_MODEL = "text-embedding-3-small"
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")          # e.g. a local fake endpoint for tests
+EMBED_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))     # inputs per request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))     # requests in flight
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "8"))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "500000"))
+LEGACY_MODEL = "text-embedding-3-small"                          # model of the old pickled cache
 SITE_TEXT_COLS = ["Category", "Location1", "Location2", "Surface"]
 FEAT_TEXT_COLS = ["Category", "Location1", "Location2", "Condition", "Age", "Category2",
                   "RockArt1", "RockArt2", "RockArt3", "RockArt4", "RockArt5", "RockArt6"]
 
+QUERY_EVICT_EVERY = 50             # size check every n query-cache writes
+QUERY_LOOKUP_CHUNK = 900           # keys per IN (...) lookup, below SQLite's variable limit
+RETRYABLE = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
 log = logging.getLogger(__name__)
-openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+
+_query_lock = threading.Lock()
+_query_writes = 0
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
-def _concat_text(row: pd.Series, cols: list[str]) -> str:
-    return " | ".join(str(row[c]) for c in cols if pd.notna(row.get(c)))
+def _text_sql(cols: list[str]) -> str:
+    """Same text as ``" | ".join`` over the non-null columns, built inside DuckDB."""
+    return "concat_ws(' | ', " + ", ".join(f'CAST("{c}" AS VARCHAR)' for c in cols) + ")"
 
 def _make_cache_key(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-def _load_embedding_cache(con: duckdb.DuckDBPyConnection) -> dict[str, list[float]]:
-    con.execute("CREATE TABLE IF NOT EXISTS emb_cache (key TEXT PRIMARY KEY, vec BLOB)")
-    rows = con.execute("SELECT key, vec FROM emb_cache").fetchall()
-    return {k: pickle.loads(v) for k, v in rows}
+# ---------------------------------------------------------------------------
+# Embedding cache (embeddings.duckdb, attached as ``emb``)
+#   emb_cache(key = sha256(text), model, vec FLOAT[], last_used)
+# ---------------------------------------------------------------------------
+def _migrate_legacy_cache(con: duckdb.DuckDBPyConnection) -> None:
+    """Convert the old ``emb_cache(key, vec BLOB)`` with pickled lists once."""
+    legacy = con.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_catalog = 'emb' AND table_name = 'emb_cache' AND column_name = 'vec'
+    """).fetchone()
+    if not legacy or legacy[0] != "BLOB":
+        return
+    log.info("Migrating pickled embedding cache to FLOAT[] …")
+    con.execute("ALTER TABLE emb.emb_cache RENAME TO emb_cache_legacy")
+    _create_cache_table(con)
+    cur = con.cursor()
+    cur.execute("SELECT key, vec FROM emb.emb_cache_legacy")
+    while rows := cur.fetchmany(10_000):
+        _store_embeddings(con, [k for k, _ in rows], [pickle.loads(v) for _, v in rows], LEGACY_MODEL)
+    cur.close()
+    con.execute("DROP TABLE emb.emb_cache_legacy")
+
+def _create_cache_table(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS emb.emb_cache (
+            key       TEXT,
+            model     TEXT,
+            vec       FLOAT[],
+            last_used TIMESTAMP DEFAULT current_timestamp,
+            PRIMARY KEY (key, model)
+        )
+    """)
 
-def _store_embedding(con: duckdb.DuckDBPyConnection, key: str, vec: list[float]) -> None:
-    con.execute("INSERT OR REPLACE INTO emb_cache VALUES (?, ?)", [key, pickle.dumps(vec)])
+def _attach_cache(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute(f"ATTACH IF NOT EXISTS '{EMBED_CACHE_PATH}' AS emb")
+    _migrate_legacy_cache(con)
+    _create_cache_table(con)
 
-def _get_openai_embedding(text: str) -> list[float]:
-    res = openai_client.embeddings.create(input=[text], model=EMBED_MODEL)
-    return res.data[0].embedding
+def _store_embeddings(
+    con: duckdb.DuckDBPyConnection, keys: list[str], vecs: list[list[float]], model: str
+) -> None:
+    """Write all new cache entries in one statement."""
+    if not keys:
+        return
+    new = pd.DataFrame({"key": keys, "vec": [np.asarray(v, dtype=np.float32) for v in vecs]})
+    con.execute(
+        "INSERT OR REPLACE INTO emb.emb_cache SELECT key, ?, vec::FLOAT[], current_timestamp FROM new",
+        [model],
+    )
+
+def _evict(con: duckdb.DuckDBPyConnection, max_entries: int = EMBED_CACHE_MAX_ENTRIES) -> int:
+    """Drop the least recently used entries beyond *max_entries*."""
+    excess = con.execute("SELECT count(*) FROM emb.emb_cache").fetchone()[0] - max_entries
+    if excess <= 0:
+        return 0
+    con.execute("""
+        DELETE FROM emb.emb_cache USING (
+            SELECT key, model FROM emb.emb_cache ORDER BY last_used, key LIMIT ?
+        ) old
+        WHERE emb.emb_cache.key = old.key AND emb.emb_cache.model = old.model
+    """, [excess])
+    log.info("Embedding cache: evicted %d LRU entries", excess)
+    return excess
+
+# ---------------------------------------------------------------------------
+# Query-time cache (query_embeddings.sqlite)
+#   SQLite instead of DuckDB: many sessions and job processes look up single
+#   texts at once; DuckDB allows only one writing process per file ("Could not
+#   set lock on file"), WAL allows parallel readers next to one writer.
+#   The DuckDB cache above stays with the bulk run (generate_embeddings).
+# ---------------------------------------------------------------------------
+def _connect_query_cache() -> sqlite3.Connection:
+    QUERY_EMBED_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(QUERY_EMBED_CACHE_PATH), timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS query_emb (
+            key       TEXT NOT NULL,
+            model     TEXT NOT NULL,
+            vec       BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (key, model)
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS query_emb_last_used ON query_emb (last_used)")
+    return con
+
+def _evict_query_cache(con: sqlite3.Connection, max_entries: int = EMBED_CACHE_MAX_ENTRIES) -> int:
+    """Drop the least recently used query-cache entries beyond *max_entries*."""
+    excess = con.execute("SELECT count(*) FROM query_emb").fetchone()[0] - max_entries
+    if excess <= 0:
+        return 0
+    con.execute("""
+        DELETE FROM query_emb WHERE rowid IN (
+            SELECT rowid FROM query_emb ORDER BY last_used LIMIT ?
+        )
+    """, [excess])
+    log.info("Query embedding cache: evicted %d LRU entries", excess)
+    return excess
+
+def cached_embeddings(texts: list[str], model: str = EMBED_MODEL) -> list[list[float]]:
+    """
+    Embeddings for *texts* through the query-time cache: one read for the hits,
+    one batched API pass for the misses, one write transaction for the new
+    entries and ``last_used``. Used for query-time texts (search, resolver, …).
+    """
+    global _query_writes
+    if not texts:
+        return []
+    keys = [_make_cache_key(t) for t in texts]
+    unique = dict(zip(keys, texts))
+    con = _connect_query_cache()
+    try:
+        hits: dict[str, list[float]] = {}
+        wanted = list(unique)
+        for i in range(0, len(wanted), QUERY_LOOKUP_CHUNK):
+            chunk = wanted[i:i + QUERY_LOOKUP_CHUNK]
+            for key, blob in con.execute(
+                f"SELECT key, vec FROM query_emb WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                [model, *chunk],
+            ):
+                hits[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        missing = [k for k in unique if k not in hits]
+        if missing:
+            for key, vec in zip(missing, embed_texts([unique[k] for k in missing], model=model)):
+                hits[key] = vec
+        now = time.time()
+        with con:
+            con.executemany(
+                "INSERT INTO query_emb (key, model, vec, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key, model) DO UPDATE SET last_used = excluded.last_used",
+                [(k, model, np.asarray(hits[k], dtype=np.float32).tobytes(), now) for k in unique],
+            )
+            with _query_lock:
+                _query_writes += 1
+                due = _query_writes % QUERY_EVICT_EVERY == 0
+            if due:
+                _evict_query_cache(con)
+    finally:
+        con.close()
+    return [hits[k] for k in keys]
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, 60) * (0.5 + random.random())
+
+async def _embed_chunk(client: openai.AsyncOpenAI, chunk: list[str], model: str) -> list[list[float]]:
+    for attempt in range(1, EMBED_MAX_RETRIES + 1):
+        try:
+            res = await client.embeddings.create(input=chunk, model=model)
+            return [d.embedding for d in sorted(res.data, key=lambda d: d.index)]
+        except RETRYABLE as exc:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = _retry_delay(exc, attempt)
+            log.warning("Embedding request failed (%s), retry %d/%d in %.1fs",
+                        type(exc).__name__, attempt, EMBED_MAX_RETRIES, delay)
+            await asyncio.sleep(delay)
+    raise RuntimeError("unreachable")
+
+async def _embed_all(
+    texts: list[str],
+    *,
+    model: str,
+    base_url: Optional[str],
+    api_key: Optional[str],
+    batch_size: int,
+    concurrency: int,
+    progress_cb: Optional[Callable[[int], None]],
+) -> list[list[float]]:
+    client = openai.AsyncOpenAI(api_key=api_key or OPENAI_API_KEY, base_url=base_url or OPENAI_BASE_URL, max_retries=0)
+    sem = asyncio.Semaphore(concurrency)
+    results: list[list[float]] = [None] * len(texts)  # type: ignore[list-item]
+
+    async def run(start: int) -> None:
+        chunk = texts[start:start + batch_size]
+        async with sem:
+            vecs = await _embed_chunk(client, chunk, model)
+        results[start:start + len(chunk)] = vecs
+        if progress_cb:
+            progress_cb(len(chunk))
+
+    try:
+        await asyncio.gather(*(run(i) for i in range(0, len(texts), batch_size)))
+    finally:
+        await client.close()
+    return results
+
+def embed_texts(
+    texts: list[str],
+    *,
+    model: str = EMBED_MODEL,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+    progress_cb: Optional[Callable[[int], None]] = None,
+) -> list[list[float]]:
+    """
+    Embed *texts* with multi-input requests, at most *concurrency* in flight.
+    Rate-limit/timeout errors back off (honouring ``Retry-After``). *base_url*
+    points the client at another OpenAI-compatible endpoint (e.g. a local fake).
+    """
+    if not texts:
+        return []
+    return asyncio.run(_embed_all(
+        texts, model=model, base_url=base_url, api_key=api_key,
+        batch_size=batch_size, concurrency=concurrency, progress_cb=progress_cb,
+    ))
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 def generate_embeddings() -> None:
+    """Fill ``embedding`` for all rows that don't have one yet (new or changed rows)."""
     con = duckdb.connect(str(DB_PATH))
-    cache_con = duckdb.connect(str(EMBED_CACHE_PATH))
-    cache = _load_embedding_cache(cache_con)
+    _attach_cache(con)
 
-    for table, cols in [("Sites", SITE_TEXT_COLS), ("Features", FEAT_TEXT_COLS)]:
+    for table, key, cols in [("Sites", "SiteID", SITE_TEXT_COLS), ("Features", "FeatureID", FEAT_TEXT_COLS)]:
         st.write(f"### Embedding table: `{table}`")
-        df = con.execute(f"SELECT * FROM {table}").fetchdf()
+        con.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding FLOAT[]")
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE _todo AS
+            SELECT id, text, sha256(text) AS cache_key
+            FROM (SELECT {key} AS id, {_text_sql(cols)} AS text FROM {table} WHERE embedding IS NULL)
+            WHERE text <> ''
+        """)
+        n_rows = con.execute("SELECT count(*) FROM _todo").fetchone()[0]
 
-        if "embedding" not in df.columns:
-            df["embedding"] = None
+        # set-based lookup: only the texts the cache doesn't know yet leave DuckDB
+        missing = con.execute("""
+            SELECT DISTINCT t.cache_key, t.text FROM _todo t
+            ANTI JOIN emb.emb_cache c ON c.key = t.cache_key AND c.model = ?
+        """, [EMBED_MODEL]).fetchdf()
+        total = len(missing)
 
-        updated = 0
-        total = len(df)
         bar = st.progress(0)
         status = st.empty()
         stats = st.empty()
         start_time = time.time()
+        done = 0
 
-        for idx, row in df.iterrows():
-            if pd.notna(row.get("embedding")):
-                continue
-            text = _concat_text(row, cols)
-            key = _make_cache_key(text)
-            vec = cache.get(key)
-            if vec is None:
-                vec = _get_openai_embedding(text)
-                _store_embedding(cache_con, key, vec)
-                cache[key] = vec
-            df.at[idx, "embedding"] = vec
-            updated += 1
-
-            pct = int((idx + 1) / total * 100)
-            elapsed = time.time() - start_time
-            eta = (elapsed / (idx + 1)) * (total - idx - 1)
-            status.text(f"{table}: Row {idx + 1} / {total} — {pct}% — ETA: {int(eta)}s")
+        def on_progress(n: int) -> None:
+            nonlocal done
+            done += n
+            elapsed = max(time.time() - start_time, 1e-6)
+            rate = done / elapsed
+            eta = (total - done) / rate if rate else 0
+            pct = int(done / total * 100)
+            status.text(f"{table}: {done} / {total} texts — {pct}% — {rate:.0f} texts/s — ETA: {int(eta)}s")
             bar.progress(pct)
 
-        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM df")
-        log.info("%s: added %d new embeddings", table, updated)
-        stats.success(f"{table}: {updated} embeddings added out of {total} rows.")
+        vecs = embed_texts(missing["text"].tolist(), progress_cb=on_progress)
+        _store_embeddings(con, missing["cache_key"].tolist(), vecs, EMBED_MODEL)
+
+        con.execute(f"""
+            UPDATE {table} SET embedding = hit.vec
+            FROM (
+                SELECT t.id, c.vec FROM _todo t
+                JOIN emb.emb_cache c ON c.key = t.cache_key AND c.model = ?
+            ) hit
+            WHERE {table}.{key} = hit.id
+        """, [EMBED_MODEL])
+        con.execute("""
+            UPDATE emb.emb_cache SET last_used = current_timestamp
+            WHERE model = ? AND key IN (SELECT cache_key FROM _todo)
+        """, [EMBED_MODEL])
+        con.execute("DROP TABLE _todo")
+
+        bar.progress(100)
+        log.info("%s: %d rows embedded (%d texts requested, %d reused)", table, n_rows, total, n_rows - total)
+        stats.success(
+            f"{table}: {n_rows} embeddings added — {total} unique texts requested, "
+            f"{n_rows - total} reused from cache or duplicates."
+        )
 
+    _evict(con)
     con.close()
-    cache_con.close()
 
 if __name__ == "__main__":
     generate_embeddings()
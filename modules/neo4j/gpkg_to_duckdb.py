@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 import duckdb
+import json
+import numpy as np
 import pandas as pd
-import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
 from pathlib import Path
-from shapely.geometry import Point
-from typing import Union, BinaryIO
+from pyproj import CRS, Transformer
+from typing import Any, Union, BinaryIO
 import tempfile
 import io
 import logging
 
+from modules.neo4j.import_state import apply_delta, begin_import, row_hash_sql
+
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
@@ -18,6 +25,7 @@ CACHE_DUCKDB = Path("cache/duckdb")
 CACHE_PARQUET.mkdir(parents=True, exist_ok=True)
 CACHE_DUCKDB.mkdir(parents=True, exist_ok=True)
 DUCKDB_PATH = CACHE_DUCKDB / "archaeology.duckdb"
+DEFAULT_CRS = "EPSG:32636"
 
 SITE_COLS = [
     "SiteID", "Category", "Location1", "Location2", "Surface", "NoOfFeatures",
@@ -30,6 +38,10 @@ FEAT_COLS = [
     "RockArt3", "RockArt4", "RockArt5", "RockArt6"
 ]
 
+SITE_FLOAT_COLS = ["X", "Y", "NoOfFeatures", "Shape_Length", "Shape_Area"]
+FEAT_FLOAT_COLS = ["X", "Y", "Length", "Width", "Height", "Age"]
+XY_OK = 'TRY_CAST("X" AS DOUBLE) IS NOT NULL AND TRY_CAST("Y" AS DOUBLE) IS NOT NULL'
+
 log = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -48,69 +60,143 @@ def _ensure_path(src: Union[str, Path, BinaryIO]) -> Path:
         return _materialise_stream(src)
     raise TypeError(f"Unsupported gpkg input type: {type(src).__name__}")
 
-def _safe_reindex(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
-    return df.reindex(columns=cols)
+def _read_layer(path: Path, layer: str) -> tuple[pa.Table, str]:
+    """Read the attribute table of *layer* once as Arrow (the source geometry is rebuilt from X/Y)."""
+    meta, table = pyogrio.read_arrow(path, layer=layer, read_geometry=False)
+    table = table.append_column("__row", pa.array(np.arange(table.num_rows, dtype=np.int64)))
+    return table, meta.get("crs") or DEFAULT_CRS
 
-def _coerce_float(df: pd.DataFrame, cols: list[str]) -> None:
+def _projection(cols: list[str], available: set[str], float_cols: list[str]) -> str:
+    parts = []
     for c in cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce").astype("Float64")
-
-def _build_geom(df: pd.DataFrame, *, src_crs: str | None) -> gpd.GeoDataFrame:
-    gdf = gpd.GeoDataFrame(df, geometry=[Point(xy) for xy in zip(df.X, df.Y)], crs=src_crs or "EPSG:32636")
-    gdf_ll = gdf.to_crs(4326) if gdf.crs.to_epsg() != 4326 else gdf
-    gdf["Lon"] = gdf_ll.geometry.x.round(6)
-    gdf["Lat"] = gdf_ll.geometry.y.round(6)
-    gdf["geometry"] = gdf["geometry"].apply(lambda g: g.wkt if g else None)
-    return gdf
+        if c not in available:
+            parts.append(f'NULL::{"DOUBLE" if c in float_cols else "VARCHAR"} AS "{c}"')
+        elif c in float_cols:
+            parts.append(f'TRY_CAST("{c}" AS DOUBLE) AS "{c}"')
+        else:
+            parts.append(f'"{c}"')
+    return ", ".join(parts)
+
+def _add_geometry(table: pa.Table, src_crs: str) -> pa.Table:
+    """Vectorised Point/WKB construction plus WGS84 Lon/Lat columns."""
+    x = table.column("X").to_numpy()
+    y = table.column("Y").to_numpy()
+    wkb = shapely.to_wkb(shapely.points(x, y))
+    if CRS.from_user_input(src_crs).to_epsg() != 4326:
+        lon, lat = Transformer.from_crs(src_crs, 4326, always_xy=True).transform(x, y)
+    else:
+        lon, lat = x, y
+    return (
+        table.append_column("geometry", pa.array(wkb, type=pa.binary()))
+             .append_column("Lon", pa.array(np.round(lon, 6)))
+             .append_column("Lat", pa.array(np.round(lat, 6)))
+    )
+
+def _write_geoparquet(table: pa.Table, target: Path, crs: str) -> None:
+    geo = {
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {
+            "encoding": "WKB",
+            "geometry_types": ["Point"],
+            "crs": CRS.from_user_input(crs).to_json_dict(),
+        }},
+    }
+    meta = dict(table.schema.metadata or {})
+    meta[b"geo"] = json.dumps(geo).encode("utf-8")
+    pq.write_table(table.replace_schema_metadata(meta), target)
+
+def _clean_layer(
+    con: duckdb.DuckDBPyConnection,
+    raw: str,
+    key: str,
+    cols: list[str],
+    float_cols: list[str],
+    available: set[str],
+) -> tuple[pa.Table, pd.DataFrame, pd.DataFrame]:
+    """Drop rows without X/Y and duplicate keys (first wins) in one DuckDB scan over the Arrow table."""
+    dedup = f'row_number() OVER (PARTITION BY "{key}" ORDER BY __row)'
+    clean = con.execute(f"""
+        SELECT {_projection(cols, available, float_cols)}
+        FROM {raw}
+        WHERE {XY_OK}
+        QUALIFY {dedup} = 1
+        ORDER BY __row
+    """).arrow()
+    dropped_xy = con.execute(f"SELECT * EXCLUDE (__row) FROM {raw} WHERE NOT ({XY_OK})").df()
+    dropped_dup = con.execute(f"SELECT * EXCLUDE (__row) FROM {raw} WHERE {XY_OK} QUALIFY {dedup} > 1").df()
+    return clean, dropped_xy, dropped_dup
 
 # ---------------------------------------------------------------------------
 # Main Function
 # ---------------------------------------------------------------------------
-def gpkg_to_duckdb(gpkg: Union[str, Path, BinaryIO]) -> dict[str, int]:
+def gpkg_to_duckdb(gpkg: Union[str, Path, BinaryIO], *, delta: bool = False) -> dict[str, Any]:
+    """
+    Bereinigt beide Layer und schreibt sie nach DuckDB.
+
+    Jeder Layer wird genau einmal als Arrow-Tabelle gelesen; Bereinigung, Geometrie
+    (WKB) und Lon/Lat entstehen vektorisiert. Der Rückgabewert enthält neben den
+    Zählern unter ``"dropped"`` die verworfenen Zeilen als DataFrames.
+
+    ``delta=False`` ersetzt die Tabellen komplett, ``delta=True`` vergleicht die
+    Zeilen-Fingerprints mit dem letzten Stand und protokolliert nur Änderungen
+    (siehe ``import_state``). In beiden Fällen wird eine neue Import-Version begonnen.
+    """
     path = _ensure_path(gpkg)
 
-    sites_raw = gpd.read_file(path, layer="Sites")
-    feats_raw = gpd.read_file(path, layer="Features")
-
-    drop_sites_xy = sites_raw[sites_raw[["X", "Y"]].isnull().any(axis=1)]
-    drop_feats_xy = feats_raw[feats_raw[["X", "Y"]].isnull().any(axis=1)]
-    drop_sites_dup = sites_raw[sites_raw.duplicated("SiteID", keep="first")]
-    drop_feats_dup = feats_raw[feats_raw.duplicated("FeatureID", keep="first")]
-
-    sites = sites_raw.dropna(subset=["X", "Y"]).drop_duplicates("SiteID", keep="first").copy()
-    feats_clean = feats_raw.dropna(subset=["X", "Y"]).drop_duplicates("FeatureID", keep="first").copy()
-
-    drop_feats_orphan = feats_clean[~feats_clean["Site"].isin(sites["SiteID"])]
-    feats = feats_clean[feats_clean["Site"].isin(sites["SiteID"])].copy()
-
-    _coerce_float(sites, ["X", "Y", "NoOfFeatures", "Shape_Length", "Shape_Area"])
-    _coerce_float(feats, ["X", "Y", "Length", "Width", "Height", "Age"])
-
-    src_crs_sites = sites_raw.crs.to_string() if getattr(sites_raw, "crs", None) else None
-    src_crs_feats = feats_raw.crs.to_string() if getattr(feats_raw, "crs", None) else None
-
-    sites = _build_geom(sites, src_crs=src_crs_sites)
-    feats = _build_geom(feats, src_crs=src_crs_feats)
-
-    sites.to_parquet(CACHE_PARQUET / "sites_clean.parquet", index=False)
-    feats.to_parquet(CACHE_PARQUET / "features_clean.parquet", index=False)
+    sites_raw, crs_sites = _read_layer(path, "Sites")
+    feats_raw, crs_feats = _read_layer(path, "Features")
 
     con = duckdb.connect(str(DUCKDB_PATH))
-    con.register("sites", sites)
-    con.register("feats", feats)
-    con.execute(f"CREATE OR REPLACE TABLE Sites AS SELECT {', '.join(SITE_COLS + ['geometry', 'Lon', 'Lat'])} FROM sites")
-    con.execute(f"CREATE OR REPLACE TABLE Features AS SELECT {', '.join(FEAT_COLS + ['geometry', 'Lon', 'Lat'])} FROM feats")
+    con.register("sites_raw", sites_raw)
+    con.register("feats_raw", feats_raw)
+
+    sites, drop_sites_xy, drop_sites_dup = _clean_layer(
+        con, "sites_raw", "SiteID", SITE_COLS, SITE_FLOAT_COLS, set(sites_raw.column_names))
+    feats_clean, drop_feats_xy, drop_feats_dup = _clean_layer(
+        con, "feats_raw", "FeatureID", FEAT_COLS, FEAT_FLOAT_COLS, set(feats_raw.column_names))
+
+    sites = _add_geometry(sites, crs_sites)
+    con.register("sites_clean", sites)
+    con.register("feats_valid", feats_clean)
+    feats = con.execute("SELECT f.* FROM feats_valid f SEMI JOIN sites_clean s ON f.Site = s.SiteID").arrow()
+    drop_feats_orphan = con.execute("SELECT f.* FROM feats_valid f ANTI JOIN sites_clean s ON f.Site = s.SiteID").df()
+    feats = _add_geometry(feats, crs_feats)
+    con.register("feats_clean", feats)
+
+    _write_geoparquet(sites, CACHE_PARQUET / "sites_clean.parquet", crs_sites)
+    _write_geoparquet(feats, CACHE_PARQUET / "features_clean.parquet", crs_feats)
+
+    site_cols = SITE_COLS + ["geometry", "Lon", "Lat"]
+    feat_cols = FEAT_COLS + ["geometry", "Lon", "Lat"]
+
+    version = begin_import(con, "delta" if delta else "full")
+    changes: dict[str, dict[str, int]] = {}
+    if delta:
+        changes["sites"] = apply_delta(con, "Sites", "sites_clean", site_cols, version, hash_cols=SITE_COLS)
+        changes["feats"] = apply_delta(con, "Features", "feats_clean", feat_cols, version, hash_cols=FEAT_COLS)
+    else:
+        con.execute(f"CREATE OR REPLACE TABLE Sites AS SELECT {', '.join(site_cols)}, {row_hash_sql(SITE_COLS)} AS row_hash FROM sites_clean")
+        con.execute(f"CREATE OR REPLACE TABLE Features AS SELECT {', '.join(feat_cols)}, {row_hash_sql(FEAT_COLS)} AS row_hash FROM feats_clean")
     con.close()
 
     return {
-        "sites_total": len(sites_raw),
-        "feats_total": len(feats_raw),
-        "sites_valid": len(sites),
-        "feats_valid": len(feats),
+        "import_version": version,
+        "delta": changes,
+        "sites_total": sites_raw.num_rows,
+        "feats_total": feats_raw.num_rows,
+        "sites_valid": sites.num_rows,
+        "feats_valid": feats.num_rows,
         "dropped_sites_xy": len(drop_sites_xy),
         "dropped_feats_xy": len(drop_feats_xy),
         "dropped_sites_dup": len(drop_sites_dup),
         "dropped_feats_dup": len(drop_feats_dup),
-        "dropped_feats_orphan": len(drop_feats_orphan)
+        "dropped_feats_orphan": len(drop_feats_orphan),
+        "dropped": {
+            "sites_xy": drop_sites_xy,
+            "feats_xy": drop_feats_xy,
+            "sites_dup": drop_sites_dup,
+            "feats_dup": drop_feats_dup,
+            "feats_orphan": drop_feats_orphan,
+        },
     }
@@ -0,0 +1,191 @@
+"""
+Import-Versionierung & Delta-Erkennung
+--------------------------------------
+* Fingerprint (md5 über alle Fachspalten) pro SiteID / FeatureID in Spalte ``row_hash``
+* Diff gegen den Stand des letzten Imports in ``archaeology.duckdb``
+* Änderungsprotokoll (``RowChanges``) und fortlaufender Versionszähler (``ImportVersions``)
+
+Eine Version gilt erst als abgeschlossen, wenn auch Neo4j aktualisiert wurde.
+Änderungen aus abgebrochenen Läufen bleiben daher "pending" und werden beim
+nächsten Delta-Import mit übertragen.
+"""
+
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import Iterable
+
+import duckdb
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+CACHE_DUCKDB = Path("cache/duckdb")
+CACHE_DUCKDB.mkdir(parents=True, exist_ok=True)
+DUCKDB_PATH = CACHE_DUCKDB / "archaeology.duckdb"
+
+ENTITY_KEYS = {"Sites": "SiteID", "Features": "FeatureID"}
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _table_exists(con: duckdb.DuckDBPyConnection, table: str) -> bool:
+    return bool(con.execute(
+        "SELECT count(*) FROM information_schema.tables WHERE table_name = ?", [table]
+    ).fetchone()[0])
+
+def _table_columns(con: duckdb.DuckDBPyConnection, table: str) -> list[str]:
+    return [r[0] for r in con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = ?", [table]
+    ).fetchall()]
+
+def ensure_state_tables(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS ImportVersions (
+            version        INTEGER PRIMARY KEY,
+            mode           TEXT,
+            status         TEXT,
+            started_at     TIMESTAMP DEFAULT current_timestamp,
+            finished_at    TIMESTAMP,
+            sites_inserted INTEGER DEFAULT 0,
+            sites_updated  INTEGER DEFAULT 0,
+            sites_deleted  INTEGER DEFAULT 0,
+            feats_inserted INTEGER DEFAULT 0,
+            feats_updated  INTEGER DEFAULT 0,
+            feats_deleted  INTEGER DEFAULT 0
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS RowChanges (
+            version INTEGER,
+            entity  TEXT,
+            key     TEXT,
+            op      TEXT
+        )
+    """)
+
+def row_hash_sql(cols: Iterable[str]) -> str:
+    """SQL-Ausdruck für einen stabilen Inhalts-Hash über *cols* (NULL-sicher)."""
+    parts = ", ".join(f"coalesce(CAST(\"{c}\" AS VARCHAR), '\\N')" for c in cols)
+    return f"md5(concat_ws('|', {parts}))"
+
+# ---------------------------------------------------------------------------
+# Versions
+# ---------------------------------------------------------------------------
+def current_import_version(db_path: str | Path = DUCKDB_PATH) -> int:
+    """Return the last *completed* import version (0 if nothing was imported yet)."""
+    if not Path(db_path).exists():
+        return 0
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        if not _table_exists(con, "ImportVersions"):
+            return 0
+        row = con.execute("SELECT max(version) FROM ImportVersions WHERE status = 'complete'").fetchone()
+        return int(row[0] or 0)
+    finally:
+        con.close()
+
+def begin_import(con: duckdb.DuckDBPyConnection, mode: str) -> int:
+    ensure_state_tables(con)
+    version = con.execute("SELECT coalesce(max(version), 0) + 1 FROM ImportVersions").fetchone()[0]
+    con.execute("INSERT INTO ImportVersions (version, mode, status) VALUES (?, ?, 'running')", [version, mode])
+    log.info("Import version %d started (%s).", version, mode)
+    return int(version)
+
+def finish_import(version: int, db_path: str | Path = DUCKDB_PATH) -> None:
+    con = duckdb.connect(str(db_path))
+    try:
+        con.execute(
+            "UPDATE ImportVersions SET status = 'complete', finished_at = current_timestamp WHERE version = ?",
+            [version],
+        )
+    finally:
+        con.close()
+    log.info("Import version %d completed.", version)
+
+def _last_complete(con: duckdb.DuckDBPyConnection) -> int:
+    return int(con.execute(
+        "SELECT coalesce(max(version), 0) FROM ImportVersions WHERE status = 'complete'"
+    ).fetchone()[0])
+
+# ---------------------------------------------------------------------------
+# Diff
+# ---------------------------------------------------------------------------
+def apply_delta(
+    con: duckdb.DuckDBPyConnection,
+    table: str,
+    staged: str,
+    cols: list[str],
+    version: int,
+    hash_cols: list[str] | None = None,
+) -> dict[str, int]:
+    """
+    Vergleicht die frisch bereinigte Relation *staged* mit *table*, protokolliert
+    Inserts/Updates/Deletes in ``RowChanges`` und ersetzt *table* durch den neuen
+    Stand. Embeddings unveränderter Zeilen werden übernommen.
+
+    Der Fingerprint läuft über *hash_cols* (Standard: *cols*), damit abgeleitete
+    Spalten wie Geometrie oder Lon/Lat keine Scheinänderungen erzeugen.
+    """
+    key = ENTITY_KEYS[table]
+    entity_hash = row_hash_sql(hash_cols or cols)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _staged AS SELECT {', '.join(cols)}, {entity_hash} AS row_hash FROM {staged}")
+
+    if not _table_exists(con, table) or "row_hash" not in _table_columns(con, table):
+        con.execute(f"""
+            INSERT INTO RowChanges
+            SELECT ?, ?, CAST({key} AS VARCHAR), 'insert' FROM _staged
+        """, [version, table])
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT *, NULL::FLOAT[] AS embedding FROM _staged")
+    else:
+        con.execute(f"""
+            INSERT INTO RowChanges
+            SELECT ?, ?, CAST(coalesce(n.{key}, o.{key}) AS VARCHAR),
+                   CASE WHEN o.{key} IS NULL THEN 'insert'
+                        WHEN n.{key} IS NULL THEN 'delete'
+                        ELSE 'update' END
+            FROM _staged n
+            FULL OUTER JOIN {table} o ON n.{key} = o.{key}
+            WHERE n.{key} IS NULL OR o.{key} IS NULL OR n.row_hash <> o.row_hash
+        """, [version, table])
+
+        carry = "o.embedding" if "embedding" in _table_columns(con, table) else "NULL::FLOAT[]"
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {table} AS
+            SELECT n.*, CASE WHEN o.row_hash = n.row_hash THEN {carry} END AS embedding
+            FROM _staged n
+            LEFT JOIN {table} o ON n.{key} = o.{key}
+        """)
+    con.execute("DROP TABLE _staged")
+
+    counts = dict(con.execute(
+        "SELECT op, count(*) FROM RowChanges WHERE version = ? AND entity = ? GROUP BY op",
+        [version, table],
+    ).fetchall())
+    prefix = "sites" if table == "Sites" else "feats"
+    con.execute(
+        f"UPDATE ImportVersions SET {prefix}_inserted = ?, {prefix}_updated = ?, {prefix}_deleted = ? WHERE version = ?",
+        [counts.get("insert", 0), counts.get("update", 0), counts.get("delete", 0), version],
+    )
+    log.info("%s delta (v%d): %s", table, version, counts)
+    return {op: counts.get(op, 0) for op in ("insert", "update", "delete")}
+
+def pending_changes(con: duckdb.DuckDBPyConnection, entity: str) -> dict[str, list[str]]:
+    """
+    Alle noch nicht nach Neo4j übertragenen Änderungen seit der letzten
+    abgeschlossenen Version, pro Schlüssel zusammengefasst (letzte Operation gewinnt).
+    """
+    ensure_state_tables(con)
+    rows = con.execute("""
+        SELECT key, arg_max(op, version) AS op
+        FROM RowChanges
+        WHERE entity = ? AND version > ?
+        GROUP BY key
+    """, [entity, _last_complete(con)]).fetchall()
+    result: dict[str, list[str]] = {"upsert": [], "delete": []}
+    for key, op in rows:
+        result["delete" if op == "delete" else "upsert"].append(key)
+    return result
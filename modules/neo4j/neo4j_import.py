@@ -1,15 +1,47 @@
-import json
+import os
+import queue
+import random
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from functools import partial
 from pathlib import Path
 from typing import Any, Callable, Iterator, Union
 
+import duckdb
 import pandas as pd
-from neo4j import GraphDatabase, basic_auth
-from shapely import wkt
+from neo4j.exceptions import ClientError, TransientError
 
 from modules.logger import get_logger
+from modules.neo4j.connection import get_driver, invalidate_health_cache
+from modules.neo4j.import_state import DUCKDB_PATH, pending_changes
+from modules.neo4j.proximity import PROXIMITY, build_proximity
 
 log = get_logger(__name__)
 DEFAULT_BATCH_SIZE = 1000
+IMPORT_WORKERS = int(os.getenv("NEO4J_IMPORT_WORKERS", "4"))
+MAX_WRITE_RETRIES = 5
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", "1536"))
+
+# Site ↔ Feature relationship(s) written by the import:
+#   has_feature → (Site)-[:HAS_FEATURE]->(Feature)
+#   both        → additionally (Feature)-[:LOCATED_ON]->(Site)
+# HAS_FEATURE is always written: extraction, Cypher generation and the planner all match on it.
+FEATURE_REL = os.getenv("NEO4J_FEATURE_REL", "has_feature").lower()
+REL_CLAUSES = {
+    "has_feature": "MERGE (s)-[:HAS_FEATURE]->(f)",
+    "both":        "MERGE (s)-[:HAS_FEATURE]->(f)\n        MERGE (f)-[:LOCATED_ON]->(s)",
+}
+
+# Columns sent to Neo4j; keys are cast to VARCHAR so node IDs stay strings.
+SITE_SELECT = (
+    "CAST(SiteID AS VARCHAR) AS SiteID, Category, Location1, Location2, Surface, NoOfFeatures, "
+    "X, Y, Shape_Length, Shape_Area, Lat, Lon, embedding"
+)
+FEAT_SELECT = (
+    "CAST(FeatureID AS VARCHAR) AS FeatureID, CAST(Site AS VARCHAR) AS Site, Category, Location1, "
+    "Location2, Length, Width, Height, Condition, Age, X, Y, Lat, Lon, Category2, RockArt1, RockArt2, "
+    "RockArt3, RockArt4, RockArt5, RockArt6, embedding"
+)
 
 
 def _create_constraints(tx) -> None:
@@ -17,17 +49,85 @@ def _create_constraints(tx) -> None:
     tx.run("CREATE CONSTRAINT IF NOT EXISTS FOR (f:Feature) REQUIRE f.FeatureID IS UNIQUE")
 
 
-def _read_csv_in_chunks(csv_path: Union[str, Path], chunk_size: int) -> Iterator[list[dict[str, Any]]]:
-    path = Path(csv_path)
-    for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str):
-        records = chunk.to_dict(orient="records")
-        for row in records:
-            if "embedding" in row and isinstance(row["embedding"], str):
-                try:
-                    row["embedding"] = json.loads(row["embedding"])
-                except json.JSONDecodeError:
-                    row["embedding"] = None
-        yield records
+def _create_indexes(session, dimensions: int) -> None:
+    """
+    Point indexes on ``location`` (UTM 36N, cartesian metres) and ``location_wgs84``
+    plus a cosine vector index on ``embedding`` for both labels.
+    Vector indexes need Neo4j ≥ 5.11 – older servers only log a warning.
+    """
+    for label, var in [("Site", "s"), ("Feature", "f")]:
+        name = label.lower()
+        for prop in ("location", "location_wgs84"):
+            session.run(f"CREATE POINT INDEX {name}_{prop} IF NOT EXISTS FOR ({var}:{label}) ON ({var}.{prop})")
+        try:
+            session.run(f"""
+                CREATE VECTOR INDEX {name}_embedding IF NOT EXISTS
+                FOR ({var}:{label}) ON ({var}.embedding)
+                OPTIONS {{indexConfig: {{
+                    `vector.dimensions`: {int(dimensions)},
+                    `vector.similarity_function`: 'cosine'
+                }}}}
+            """)
+        except ClientError as exc:
+            log.warning("Vector index on %s.embedding not created: %s", label, exc.message)
+
+
+def _embedding_dimensions(con: duckdb.DuckDBPyConnection) -> int:
+    """Dimension of the stored embeddings (falls back to ``VECTOR_DIMENSIONS``)."""
+    row = con.execute(
+        "SELECT len(embedding) FROM Sites WHERE embedding IS NOT NULL LIMIT 1"
+    ).fetchone()
+    return int(row[0]) if row else VECTOR_DIMENSIONS
+
+
+def _set_import_version(tx, version: int) -> None:
+    tx.run(
+        "MERGE (m:ImportMeta {name: 'wadi'}) SET m.version = $version, m.updated_at = datetime()",
+        version=version,
+    )
+
+
+def neo4j_import_version(session) -> int:
+    """Return the import version stored in Neo4j (0 if the database was never imported)."""
+    rec = session.run("MATCH (m:ImportMeta {name: 'wadi'}) RETURN m.version AS version").single()
+    return int(rec["version"]) if rec and rec["version"] is not None else 0
+
+
+def _delete_batch(tx, label: str, key: str, ids: list[str]) -> None:
+    tx.run(f"UNWIND $ids AS id MATCH (n:{label} {{{key}: id}}) DETACH DELETE n", ids=ids)
+
+
+def _estimated_rows(con: duckdb.DuckDBPyConnection, table: str) -> int:
+    """Row count from DuckDB's table metadata – no scan of the data."""
+    row = con.execute(
+        "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ?", [table]
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _iter_batches(
+    con: duckdb.DuckDBPyConnection,
+    table: str,
+    select: str,
+    key: str,
+    batch_size: int,
+    keys: list[str] | None = None,
+    where: str = "TRUE",
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Stream *table* as Arrow record batches and hand them on as row dicts with
+    native floats and float lists (embeddings) – no CSV, no JSON parsing.
+    With *keys* only those rows are read (delta import).
+    """
+    sql = f"SELECT {select} FROM {table} WHERE {where}"
+    if keys is not None:
+        con.register("_import_keys", pd.DataFrame({"key": pd.Series(keys, dtype="object")}))
+        sql += f" AND CAST({key} AS VARCHAR) IN (SELECT key FROM _import_keys)"
+    reader = con.execute(sql).fetch_record_batch(batch_size)
+    for batch in reader:
+        yield batch.to_pylist()
+    if keys is not None:
+        con.unregister("_import_keys")
 
 
 def _import_sites_batch(tx, batch: list[dict[str, Any]]) -> None:
@@ -46,20 +146,21 @@ def _import_sites_batch(tx, batch: list[dict[str, Any]]) -> None:
             s.Shape_Area   = toFloat(row.Shape_Area),
             s.Lat          = toFloat(row.Lat),
             s.Lon          = toFloat(row.Lon),
-            s.geometry     = row.geometry,
-            s.embedding    = CASE WHEN row.embedding IS NOT NULL THEN row.embedding ELSE NULL END
+            s.geometry     = 'POINT (' + toString(row.X) + ' ' + toString(row.Y) + ')',
+            s.location       = point({x: toFloat(row.X), y: toFloat(row.Y), crs: 'cartesian'}),
+            s.location_wgs84 = point({longitude: toFloat(row.Lon), latitude: toFloat(row.Lat)}),
+            s.embedding    = row.embedding
         """,
         rows=batch,
     )
 
 
-def _import_feats_batch(tx, batch: list[dict[str, Any]]) -> int:
+def _import_feats_batch(tx, batch: list[dict[str, Any]], rel: str = FEATURE_REL) -> int:
+    # Orphans are already filtered in gpkg_to_duckdb; MATCH simply skips any leftovers.
     tx.run(
         """
         UNWIND $rows AS row
-        OPTIONAL MATCH (s:Site {SiteID: row.Site})
-        WITH row, s
-        WHERE s IS NOT NULL
+        MATCH (s:Site {SiteID: row.Site})
         MERGE (f:Feature {FeatureID: row.FeatureID})
         SET f.Category  = row.Category,
             f.Location1 = row.Location1,
@@ -80,102 +181,229 @@ def _import_feats_batch(tx, batch: list[dict[str, Any]]) -> int:
             f.RockArt4  = row.RockArt4,
             f.RockArt5  = row.RockArt5,
             f.RockArt6  = row.RockArt6,
-            f.geometry  = row.geometry,
-            f.embedding = CASE WHEN row.embedding IS NOT NULL THEN row.embedding ELSE NULL END
-        MERGE (s)-[:HAS_FEATURE]->(f)
-        MERGE (f)-[:LOCATED_ON]->(s)
+            f.geometry  = 'POINT (' + toString(row.X) + ' ' + toString(row.Y) + ')',
+            f.location       = point({x: toFloat(row.X), y: toFloat(row.Y), crs: 'cartesian'}),
+            f.location_wgs84 = point({longitude: toFloat(row.Lon), latitude: toFloat(row.Lat)}),
+            f.embedding = row.embedding
+        __REL__
+        WITH s, f
+        OPTIONAL MATCH (f)-[stale:HAS_FEATURE|LOCATED_ON]-(other:Site)
+        WHERE other <> s
+        DELETE stale
+        """.replace("__REL__", REL_CLAUSES[rel]),
+        rows=batch,
+    )
+    return len(batch)
+
+
+def _delete_edges_batch(tx, label: str, key: str, rel: str, ids: list[str]) -> None:
+    tx.run(f"UNWIND $ids AS id MATCH (n:{label} {{{key}: id}})-[r:{rel}]-() DELETE r", ids=ids)
+
+
+def _import_close_to_batch(tx, batch: list[dict[str, Any]], label: str, key: str, rel: str) -> int:
+    # Edges touching the batch were deleted beforehand, so CREATE is safe (and much cheaper than MERGE).
+    tx.run(
+        f"""
+        UNWIND $rows AS row
+        MATCH (a:{label} {{{key}: row.a}})
+        MATCH (b:{label} {{{key}: row.b}})
+        CREATE (a)-[:{rel} {{distance: row.distance}}]->(b)
         """,
         rows=batch,
     )
     return len(batch)
 
 
+def _write_with_retry(session, tx_fn: Callable, *args) -> None:
+    """``execute_write`` plus an outer backoff for deadlocks that outlive the driver's own retries."""
+    for attempt in range(1, MAX_WRITE_RETRIES + 1):
+        try:
+            session.execute_write(tx_fn, *args)
+            return
+        except TransientError as exc:
+            if attempt == MAX_WRITE_RETRIES:
+                raise
+            delay = min(2 ** attempt, 30) * (0.5 + random.random())
+            log.warning("Transient Neo4j error (%s), retry %d/%d in %.1fs", exc.code, attempt, MAX_WRITE_RETRIES, delay)
+            time.sleep(delay)
+
+
+def _write_partitioned(
+    driver,
+    con: duckdb.DuckDBPyConnection,
+    table: str,
+    select: str,
+    key: str,
+    part_col: str,
+    tx_fn: Callable,
+    *,
+    batch_size: int,
+    workers: int,
+    keys: list[str] | None,
+    on_progress: Callable[[int], None],
+    where: str = "TRUE",
+) -> int:
+    """
+    Write *table* with *workers* concurrent sessions. Rows are partitioned by
+    ``hash(part_col)``: for Sites and Features (by parent SiteID) two workers never
+    lock the same Site node. Proximity edges lock both endpoints, so partitioning by
+    ``a`` only spreads the work – conflicts on ``b`` are deadlock-retried by
+    ``_write_with_retry``. Progress is reported from the calling thread (Streamlit
+    widgets must not be updated from worker threads).
+    """
+    done: queue.SimpleQueue[int] = queue.SimpleQueue()
+
+    def worker(part: int) -> None:
+        cur = con.cursor()
+        try:
+            with driver.session() as session:
+                for batch in _iter_batches(cur, table, select, key, batch_size, keys,
+                                           where=f"({where}) AND hash({part_col}) % {workers} = {part}"):
+                    _write_with_retry(session, tx_fn, batch)
+                    done.put(len(batch))
+        finally:
+            cur.close()
+
+    processed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"neo4j-{table}") as pool:
+        futures = [pool.submit(worker, part) for part in range(workers)]
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.2, return_when=FIRST_EXCEPTION)
+            while not done.empty():
+                processed += done.get()
+                on_progress(processed)
+            for fut in finished:
+                fut.result()
+    while not done.empty():
+        processed += done.get()
+        on_progress(processed)
+    return processed
+
+
+def _import_proximity(
+    driver,
+    con: duckdb.DuckDBPyConnection,
+    version: int,
+    affected: dict[str, list[str]] | None,
+    *,
+    batch_size: int,
+    workers: int,
+    report: Callable[[str, int], Callable[[int], None]],
+) -> None:
+    """Compute the proximity pairs in DuckDB, drop the outdated edges and bulk-load the new ones."""
+    build_proximity(con, version, affected)
+    for entity, (table, rel, label, key, _, _) in PROXIMITY.items():
+        with driver.session() as session:
+            if affected is None:
+                session.run(f"MATCH ()-[r:{rel}]->() CALL {{ WITH r DELETE r }} IN TRANSACTIONS OF 10000 ROWS").consume()
+            else:
+                ids = affected[entity]
+                for i in range(0, len(ids), batch_size):
+                    _write_with_retry(session, _delete_edges_batch, label, key, rel, ids[i:i + batch_size])
+
+        total = con.execute(f"SELECT count(*) FROM {table} WHERE version = ?", [version]).fetchone()[0]
+        written = _write_partitioned(
+            driver, con, table, "a, b, distance", "a", "a",
+            partial(_import_close_to_batch, label=label, key=key, rel=rel),
+            batch_size=batch_size, workers=workers, keys=None,
+            on_progress=report("proximity", total), where=f"version = {int(version)}",
+        )
+        log.info("Imported %d :%s edges.", written, rel)
+
+
 def import_to_neo4j(
     uri: str,
     user: str,
     password: str,
-    sites_csv: Union[str, Path],
-    feats_csv: Union[str, Path],
+    db_path: Union[str, Path] = DUCKDB_PATH,
     batch_size: int = DEFAULT_BATCH_SIZE,
     progress_cb: Callable[[str, int, int], None] | None = None,
+    delta: bool = False,
+    import_version: int | None = None,
+    workers: int = IMPORT_WORKERS,
+    proximity: bool = True,
 ) -> None:
-    sites_path = Path(sites_csv)
-    feats_path = Path(feats_csv)
+    """
+    MERGE the ``Sites``/``Features`` tables from DuckDB into Neo4j.
+
+    Rows are streamed as Arrow record batches straight into ``UNWIND $rows``,
+    written by *workers* parallel sessions (Features partitioned by parent SiteID).
+    With ``delta=True`` only the pending inserts/updates are sent and pending
+    deletes are removed with ``DETACH DELETE``. *import_version* is written to
+    the ``(:ImportMeta)`` marker node once everything is in place.
+
+    Besides the WKT ``geometry`` string every node gets native ``location``
+    (EPSG:32636 as cartesian point, metres) and ``location_wgs84`` points,
+    backed by point indexes, and ``embedding`` is covered by a vector index.
 
-    if not sites_path.exists():
-        raise FileNotFoundError(f"Sites CSV not found: {sites_path}")
-    if not feats_path.exists():
-        raise FileNotFoundError(f"Features CSV not found: {feats_path}")
+    With *proximity* the ``CLOSE_TO_SITE``/``CLOSE_TO_FEATURE`` edges are
+    (re)built from a KD-tree pass (see ``proximity.py``); a delta import only
+    replaces the edges of changed or deleted nodes.
+    """
+    db_path = Path(db_path)
+    if not db_path.exists():
+        raise FileNotFoundError(f"DuckDB file not found: {db_path}")
+    if FEATURE_REL not in REL_CLAUSES:
+        raise ValueError(f"NEO4J_FEATURE_REL must be one of {sorted(REL_CLAUSES)}, got {FEATURE_REL!r}")
+    workers = max(1, workers)
 
     try:
-        driver = GraphDatabase.driver(uri, auth=basic_auth(user, password))
+        driver = get_driver(uri, user, password)
     except Exception as exc:
         log.error("Could not connect to Neo4j at %s: %s", uri, exc)
         raise ConnectionError(f"Failed to connect to Neo4j: {exc}")
 
-    total_sites = sum(1 for _ in pd.read_csv(sites_path, chunksize=batch_size))
-    total_feats = sum(1 for _ in pd.read_csv(feats_path, chunksize=batch_size))
+    con = duckdb.connect(str(db_path))
+    site_keys = feat_keys = None
+    deleted_sites: list[str] = []
+    deleted_feats: list[str] = []
+    if delta:
+        site_changes = pending_changes(con, "Sites")
+        feat_changes = pending_changes(con, "Features")
+        site_keys, deleted_sites = site_changes["upsert"], site_changes["delete"]
+        feat_keys, deleted_feats = feat_changes["upsert"], feat_changes["delete"]
 
-    processed_sites = 0
-    processed_feats = 0
+    total_sites = len(site_keys) if site_keys is not None else _estimated_rows(con, "Sites")
+    total_feats = len(feat_keys) if feat_keys is not None else _estimated_rows(con, "Features")
+
+    def report(phase: str, total: int) -> Callable[[int], None]:
+        return lambda processed: progress_cb(phase, processed, total) if progress_cb else None
 
     try:
         with driver.session() as session:
             _create_constraints(session)
+            _create_indexes(session, _embedding_dimensions(con))
+
+            for label, key, ids in [("Feature", "FeatureID", deleted_feats), ("Site", "SiteID", deleted_sites)]:
+                for i in range(0, len(ids), batch_size):
+                    _write_with_retry(session, _delete_batch, label, key, ids[i:i + batch_size])
+                if ids:
+                    log.info("Deleted %d %s nodes.", len(ids), label)
+
+        processed_sites = _write_partitioned(
+            driver, con, "Sites", SITE_SELECT, "SiteID", "SiteID", _import_sites_batch,
+            batch_size=batch_size, workers=workers, keys=site_keys, on_progress=report("sites", total_sites),
+        )
+        log.info("Imported all Site rows: %s total.", processed_sites)
 
-            for batch in _read_csv_in_chunks(sites_path, batch_size):
-                session.execute_write(_import_sites_batch, batch)
-                processed_sites += len(batch)
-                if progress_cb:
-                    progress_cb("sites", processed_sites, total_sites)
-            log.info("Imported all Site rows: %s total.", processed_sites)
-
-            for batch in _read_csv_in_chunks(feats_path, batch_size):
-                parent_ids = {row["Site"] for row in batch if row.get("Site") is not None}
-                existing = set()
-                if parent_ids:
-                    result = session.run(
-                        "MATCH (s:Site) WHERE s.SiteID IN $ids RETURN collect(s.SiteID) AS existing",
-                        ids=list(parent_ids),
-                    )
-                    existing = set(result.single()["existing"]) or set()
-
-                valid_batch = [row for row in batch if row.get("Site") in existing]
-                if valid_batch:
-                    session.execute_write(_import_feats_batch, valid_batch)
-
-                processed_feats += len(batch)
-                if progress_cb:
-                    progress_cb("feats", processed_feats, total_feats)
-            log.info("Imported all Feature rows: %s total (orphans skipped).", processed_feats)
-
-            # Generate :CLOSE_TO relationships between Sites and Features
-            # session.run("""
-            #     MATCH (a:Site)
-            #     CALL {
-            #         WITH a
-            #         MATCH (b:Site)
-            #         WHERE a.SiteID < b.SiteID
-            #         AND point.distance(a.geometry, b.geometry) < 500
-            #         RETURN b
-            #     }
-            #     MERGE (a)-[:CLOSE_TO_SITE]->(b)
-            # """)
-
-
-            # session.run("""
-            #     MATCH (a:Feature)
-            #     CALL {
-            #         WITH a
-            #         MATCH (b:Feature)
-            #         WHERE a.FeatureID < b.FeatureID
-            #         AND point.distance(a.geometry, b.geometry) < 500
-            #         RETURN b
-            #     }
-            #     MERGE (a)-[:CLOSE_TO_FEATURE]->(b)
-            # """)
+        processed_feats = _write_partitioned(
+            driver, con, "Features", FEAT_SELECT, "FeatureID", "Site", _import_feats_batch,
+            batch_size=batch_size, workers=workers, keys=feat_keys, on_progress=report("feats", total_feats),
+        )
+        log.info("Imported all Feature rows: %s total (%d workers).", processed_feats, workers)
 
+        if proximity:
+            _import_proximity(
+                driver, con, import_version or 0,
+                affected={"Sites": site_keys + deleted_sites, "Features": feat_keys + deleted_feats} if delta else None,
+                batch_size=batch_size, workers=workers, report=report,
+            )
+
+        with driver.session() as session:
+            if import_version is not None:
+                session.execute_write(_set_import_version, import_version)
 
     finally:
-        driver.close()
-        log.info("Neo4j driver closed.")
\ No newline at end of file
+        con.close()
+        invalidate_health_cache()
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Proximity graph (CLOSE_TO_SITE / CLOSE_TO_FEATURE)
+--------------------------------------------------
+* Alle Site–Site- und Feature–Feature-Paare innerhalb eines Radius (Meter, UTM)
+  per KD-Tree über die bereinigten GeoParquet-Dateien
+* Ergebnis in DuckDB (``CloseToSites`` / ``CloseToFeatures``: a, b, distance, version),
+  Kanten immer gerichtet ``a < b``
+* Delta: nur Paare, die einen geänderten/gelöschten Knoten berühren, werden neu berechnet
+
+Der Upload nach Neo4j erfolgt in ``neo4j_import`` (parallele Batches).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+CACHE_PARQUET = Path("cache/parquet")
+SITE_RADIUS = float(os.getenv("CLOSE_TO_SITE_RADIUS", "500"))
+FEATURE_RADIUS = float(os.getenv("CLOSE_TO_FEATURE_RADIUS", "500"))
+
+# entity → (edge table, relationship type, node label, key, parquet file, radius)
+PROXIMITY = {
+    "Sites":    ("CloseToSites",    "CLOSE_TO_SITE",    "Site",    "SiteID",    "sites_clean.parquet",    SITE_RADIUS),
+    "Features": ("CloseToFeatures", "CLOSE_TO_FEATURE", "Feature", "FeatureID", "features_clean.parquet", FEATURE_RADIUS),
+}
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _load_points(con: duckdb.DuckDBPyConnection, parquet: Path, key: str) -> tuple[np.ndarray, np.ndarray]:
+    df = con.execute(
+        f"SELECT CAST({key} AS VARCHAR) AS id, X, Y FROM read_parquet(?)", [str(parquet)]
+    ).df()
+    return df["id"].to_numpy(dtype=object), df[["X", "Y"]].to_numpy(dtype=np.float64)
+
+def _pairs_frame(ids: np.ndarray, xy: np.ndarray, i: np.ndarray, j: np.ndarray) -> pd.DataFrame:
+    a, b = ids[i], ids[j]
+    swap = a > b
+    a, b = np.where(swap, b, a), np.where(swap, a, b)
+    dist = np.round(np.hypot(*(xy[i] - xy[j]).T), 2)
+    return pd.DataFrame({"a": a, "b": b, "distance": dist}).drop_duplicates(["a", "b"])
+
+def _all_pairs(tree: cKDTree, ids: np.ndarray, xy: np.ndarray, radius: float) -> pd.DataFrame:
+    pairs = tree.query_pairs(radius, output_type="ndarray")
+    return _pairs_frame(ids, xy, pairs[:, 0], pairs[:, 1])
+
+def _pairs_touching(
+    tree: cKDTree, ids: np.ndarray, xy: np.ndarray, radius: float, affected: set[str]
+) -> pd.DataFrame:
+    idx = np.flatnonzero(np.isin(ids, list(affected)))
+    if not len(idx):
+        return _pairs_frame(ids, xy, np.empty(0, int), np.empty(0, int))
+    hits = tree.query_ball_point(xy[idx], radius)
+    i = np.repeat(idx, [len(h) for h in hits])
+    j = np.concatenate([np.asarray(h, dtype=int) for h in hits])
+    keep = i != j
+    return _pairs_frame(ids, xy, i[keep], j[keep])
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def build_proximity(
+    con: duckdb.DuckDBPyConnection,
+    version: int,
+    affected: dict[str, list[str]] | None = None,
+) -> dict[str, int]:
+    """
+    (Re)compute the proximity pairs and tag new rows with *version*.
+
+    Without *affected* every pair is rebuilt; otherwise *affected* maps entity →
+    changed/deleted keys and only pairs touching one of them are replaced.
+    Returns the number of pairs written per entity.
+    """
+    written: dict[str, int] = {}
+    for entity, (table, _, _, key, parquet, radius) in PROXIMITY.items():
+        ids, xy = _load_points(con, CACHE_PARQUET / parquet, key)
+        tree = cKDTree(xy)
+        con.execute(f"CREATE TABLE IF NOT EXISTS {table} (a VARCHAR, b VARCHAR, distance DOUBLE, version INTEGER)")
+
+        if affected is None:
+            pairs = _all_pairs(tree, ids, xy, radius)
+            con.execute(f"DELETE FROM {table}")
+        else:
+            keys = set(affected.get(entity, []))
+            pairs = _pairs_touching(tree, ids, xy, radius, keys)
+            con.register("_prox_keys", pd.DataFrame({"key": pd.Series(sorted(keys), dtype="object")}))
+            con.execute(f"DELETE FROM {table} WHERE a IN (SELECT key FROM _prox_keys) OR b IN (SELECT key FROM _prox_keys)")
+            con.unregister("_prox_keys")
+
+        con.register("_prox_pairs", pairs)
+        con.execute(f"INSERT INTO {table} SELECT a, b, distance, ? FROM _prox_pairs", [version])
+        con.unregister("_prox_pairs")
+        written[entity] = len(pairs)
+        log.info("%s: %d pairs within %.0f m (%s)", table, len(pairs), radius, "delta" if affected is not None else "full")
+    return written
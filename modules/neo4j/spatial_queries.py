@@ -0,0 +1,118 @@
+"""
+Räumliche & semantische Abfragen direkt in Neo4j
+------------------------------------------------
+Nutzen die beim Import angelegten Indizes:
+
+* ``location``       – Punkt in UTM 36N (EPSG:32636, kartesisch, Meter) → Point-Index
+* ``location_wgs84`` – Punkt in WGS84 (Lon/Lat)                          → Point-Index
+* ``embedding``      – Vektorindex ``site_embedding`` / ``feature_embedding``
+
+Die Cypher-Konstanten dienen zugleich als Vorlage für ``generate_cypher``:
+``prompt_patterns()`` setzt sie in ``templates/system/generate_cypher.jinja2`` ein.
+
+Einfache Nutzung:  ▸  from modules.neo4j.spatial_queries import nearest, within_distance
+"""
+
+from __future__ import annotations
+
+from typing import Any, Optional, Sequence
+
+from modules.helper import run_cypher
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+LABEL_KEYS = {"Site": "SiteID", "Feature": "FeatureID"}
+KNN_START_RADIUS = 250.0       # metres
+KNN_MAX_RADIUS = 50_000.0
+
+# Nodes of one label within *radius* metres of a coordinate (index seek on n.location)
+WITHIN_DISTANCE = """
+MATCH (n:__LABEL__)
+WHERE point.distance(n.location, point({x: $x, y: $y, crs: 'cartesian'})) <= $radius
+RETURN n.__KEY__ AS id, n.Category AS Category,
+       point.distance(n.location, point({x: $x, y: $y, crs: 'cartesian'})) AS distance
+ORDER BY distance
+LIMIT $limit
+"""
+
+# Neighbours of an existing node within *radius* metres
+NEIGHBOURS_OF = """
+MATCH (a:__LABEL__ {__KEY__: $id})
+MATCH (b:__OTHER__)
+WHERE b <> a AND point.distance(b.location, a.location) <= $radius
+RETURN b.__OTHER_KEY__ AS id, b.Category AS Category,
+       point.distance(b.location, a.location) AS distance
+ORDER BY distance
+LIMIT $limit
+"""
+
+# Semantic neighbours through the vector index
+VECTOR_NEIGHBOURS = """
+CALL db.index.vector.queryNodes($index, $k, $embedding) YIELD node, score
+RETURN node.__KEY__ AS id, node.Category AS Category, score
+"""
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _cypher(template: str, label: str, other: Optional[str] = None) -> str:
+    if label not in LABEL_KEYS or (other and other not in LABEL_KEYS):
+        raise ValueError(f"label must be one of {sorted(LABEL_KEYS)}")
+    other = other or label
+    return (
+        template.replace("__LABEL__", label)
+        .replace("__KEY__", LABEL_KEYS[label])
+        .replace("__OTHER__", other)
+        .replace("__OTHER_KEY__", LABEL_KEYS[other])
+    )
+
+def prompt_patterns() -> dict[str, str]:
+    """The Cypher constants with concrete labels, as shown to the LLM in ``generate_cypher``."""
+    return {
+        "Features within a radius of a UTM coordinate": _cypher(WITHIN_DISTANCE, "Feature").strip(),
+        "Features within a radius of a Site": _cypher(NEIGHBOURS_OF, "Site", "Feature").strip(),
+        "Semantically similar Sites (vector index)": _cypher(VECTOR_NEIGHBOURS, "Site").strip(),
+    }
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+def within_distance(
+    label: str, x: float, y: float, radius: float, limit: int = 1000
+) -> list[dict[str, Any]]:
+    """All *label* nodes within *radius* metres of the UTM coordinate (x, y), nearest first."""
+    return run_cypher(_cypher(WITHIN_DISTANCE, label), {
+        "x": float(x), "y": float(y), "radius": float(radius), "limit": int(limit),
+    })
+
+
+def nearest(
+    label: str, x: float, y: float, k: int = 10, max_radius: float = KNN_MAX_RADIUS
+) -> list[dict[str, Any]]:
+    """
+    k nearest *label* nodes to (x, y). Neo4j has no native kNN operator, so the
+    search radius is doubled until *k* hits are found – every step is an index seek.
+    """
+    radius = KNN_START_RADIUS
+    while True:
+        rows = within_distance(label, x, y, radius, limit=k)
+        if len(rows) >= k or radius >= max_radius:
+            return rows
+        radius = min(radius * 2, max_radius)
+
+
+def neighbours_of(
+    label: str, node_id: str, radius: float, other: Optional[str] = None, limit: int = 1000
+) -> list[dict[str, Any]]:
+    """Nodes of label *other* (default: same label) within *radius* metres of the given node."""
+    return run_cypher(_cypher(NEIGHBOURS_OF, label, other), {
+        "id": str(node_id), "radius": float(radius), "limit": int(limit),
+    })
+
+
+def vector_neighbours(label: str, embedding: Sequence[float], k: int = 10) -> list[dict[str, Any]]:
+    """Top-*k* nodes by cosine similarity via the Neo4j vector index."""
+    return run_cypher(_cypher(VECTOR_NEIGHBOURS, label), {
+        "index": f"{label.lower()}_embedding", "k": int(k), "embedding": [float(v) for v in embedding],
+    })
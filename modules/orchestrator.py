@@ -0,0 +1,502 @@
+"""
+Nebenläufige Ausführung der Analyse-Pipeline
+--------------------------------------------
+Eine Frage mit mehreren Analyse-Typen (z. B. colocation + autocorrelation + hotspot)
+wird nicht mehr Typ für Typ abgearbeitet:
+
+* Planung: Klassifizierung, danach ``extract_semantic_structure`` für alle Typen parallel
+  (oder ein einziger Planer-Aufruf, ``LLM_PLANNER=1``, siehe ``modules.planner``)
+* Pro Typ eine Pipeline (Parameter → Extraktion → Analyse → Erklärung),
+  alle Pipelines laufen gleichzeitig, blockierende Schritte in Worker-Threads,
+  begrenzt durch ``ANALYSIS_CONCURRENCY``
+* Standardanalysen laufen direkt über ``modules.analysis`` (geladene Eingaben
+  bleiben im Speicher); nur andere Typen gehen über generierten Code + Skript.
+  ``ANALYSIS_TIMEOUT`` gilt auch hier: die Analyse bricht am nächsten
+  Fortschrittspunkt ab, spätestens wird ihr Thread aufgegeben
+* Gleiche Extraktion (WHERE/RETURN/Backend/Import-Version) → eine gemeinsame
+  Eingabedatei ``results/inputs/<hash>.arrow``, nur einmal abgefragt und bei
+  erneuter Frage wiederverwendet (``force=True`` fragt neu ab)
+* Ausgaben, Skripte und Logs einer Frage im eigenen Arbeitsbereich
+  (``modules.workspace``); höchstens ``MAX_CONCURRENT_ANALYSES`` Analysen
+  gleichzeitig über alle Sitzungen und Job-Prozesse
+* Zwischenstände (laufende Stufe, Permutationen erledigt/gesamt, Zeilen, stdout,
+  Karte) und die Erklärung Token für Token werden sofort gemeldet (``iter_updates``),
+  fertige Analysen in Fertigstellungsreihenfolge (``iter_results``)
+
+Einfache Nutzung:  ▸  from modules.orchestrator import plan, iter_updates
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+import pyarrow as pa
+
+from modules.analysis import ANALYSES, AnalysisError, cached_run, save_output
+from modules.analysis.base import Progress, progress_callback
+from modules.helper import run_cypher, run_python_code
+from modules.llm import (
+    classify_analysis_types,
+    decision_for,
+    extract_semantic_structure,
+    find_similar,
+    generate_analysis_code,
+    generate_analysis_params,
+    generate_cypher,
+    plan_extraction,
+    run_extraction,
+    stream_explain_cypher_result,
+    stream_explain_de,
+)
+from modules.logger import get_logger
+from modules.neo4j.import_state import current_import_version
+from modules.planner import PLANNER_ENABLED, PlannedAnalysis, plan_question
+from modules.worker_pool import JOB_TIMEOUT as ANALYSIS_TIMEOUT
+from modules.workspace import INPUT_DIR, Workspace, analysis_slot, open_workspace
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))     # blocking stages in flight
+ANALYSIS_LIBRARY = os.getenv("ANALYSIS_LIBRARY", "1").lower() in {"1", "true", "yes"}   # 0 = generated scripts
+
+Decision = tuple[str, dict, str]        # (decision, structure, analysis_type) as in decide_query_or_python
+Prepared = dict[str, PlannedAnalysis]   # analysis_type → params/clauses already known from the planner
+
+
+@dataclass
+class AnalysisResult:
+    """Outcome of one analysis pipeline (filled as far as the pipeline got)."""
+    index: int
+    analysis_type: str
+    decision: str
+    query: Optional[str] = None
+    rows: Any = None
+    code: Optional[str] = None
+    stdout: str = ""
+    stderr: str = ""
+    geojson: Optional[str] = None
+    explanation: Optional[str] = None
+    error: Optional[str] = None         # "<stage>: <message>"
+    cached: bool = False                # analysis result taken from modules.analysis.cache
+    workspace: Optional[str] = None     # id of the request workspace (modules.workspace)
+    stage: str = ""                     # stage currently running
+    progress: Optional[dict] = None     # {"label", "done", "total"} of a long step (permutations)
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class AnalysisUpdate:
+    """
+    Progress event of one pipeline: ``stage`` (a stage started, new rows/stdout, permutation
+    progress – see *text*), ``token`` (explanation chunk) or ``done``.
+    """
+    kind: str
+    result: AnalysisResult
+    text: str = ""
+
+
+Emit = Callable[[str, AnalysisResult, str], None]
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+class _Runner:
+    """Runs blocking stage functions in threads, at most *limit* at a time."""
+
+    def __init__(self, limit: int, emit: Optional[Emit] = None):
+        self._sem = asyncio.Semaphore(max(1, limit))
+        self._loop = asyncio.get_running_loop()
+        self._emit = emit
+
+    async def __call__(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        async with self._sem:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def timed(self, result: AnalysisResult, stage: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        result.stage, result.progress = stage, None
+        if self._emit:
+            self._emit("stage", result, stage)
+        started = self._loop.time()
+        try:
+            return await self(fn, *args, **kwargs)
+        finally:
+            result.timings[stage] = round(self._loop.time() - started, 2)
+
+    async def stream(self, result: AnalysisResult, chunks: AsyncIterator[str], emit: Emit) -> None:
+        """Consume an explanation token stream into ``result.explanation``, emitting every chunk."""
+        started = self._loop.time()
+        result.stage, result.explanation = "explain", ""
+        try:
+            async with self._sem:
+                async for chunk in chunks:
+                    result.explanation += chunk
+                    emit("token", result, chunk)
+        finally:
+            result.timings["explain"] = round(self._loop.time() - started, 2)
+
+
+def _reusable(path: Path) -> bool:
+    try:
+        with pa.memory_map(str(path)) as source:
+            return len(pa.ipc.open_file(source).schema) > 0
+    except (OSError, pa.ArrowInvalid):
+        return False
+
+
+class _SharedExtractions:
+    """One extraction task per distinct (WHERE, RETURN, backend); later callers await the same file."""
+
+    def __init__(self, run: _Runner, workspace: Workspace, *, reuse: bool = True):
+        self._run = run
+        self._workspace = workspace
+        self._reuse = reuse
+        self._tasks: dict[str, asyncio.Task] = {}
+        try:
+            self._version: Optional[int] = current_import_version()
+        except Exception as exc:                    # noqa: BLE001 - e.g. DuckDB locked by a running import
+            log.warning("Import version unavailable (%s) → no extraction reuse", exc)
+            self._version, self._reuse = None, False
+
+    def get(self, where_clause: str, return_clause: str, backend: Optional[str]) -> Awaitable[Path]:
+        key = hashlib.sha256(
+            json.dumps([where_clause, return_clause, backend, self._version]).encode()
+        ).hexdigest()[:16]
+        if key in self._tasks:
+            log.info("Extraction %s shared between analyses", key)
+        else:
+            path = INPUT_DIR / f"{key}.arrow"
+            self._tasks[key] = asyncio.ensure_future(self._extract(where_clause, return_clause, backend, path))
+        return asyncio.shield(self._tasks[key])
+
+    async def _extract(self, where_clause: str, return_clause: str, backend: Optional[str], path: Path) -> Path:
+        """
+        Reuses ``<key>.arrow`` from an earlier request: same query on the same import → same
+        rows. Only successful extractions leave a file (``run_extraction`` raises and writes
+        nothing on failure); column-less files from older failed runs are extracted again.
+        """
+        reused = self._reuse and _reusable(path)
+        if reused:
+            log.info("Extraction %s reused from %s", path.stem, path)
+            os.utime(path)                          # still in use → not removed by the workspace cleanup
+        else:
+            await self._run(run_extraction, where_clause, return_clause, path, backend=backend)
+        self._workspace.record_input(path.stem, path, where_clause=where_clause,
+                                     return_clause=return_clause, reused=reused)
+        return path
+
+
+def _run_library(
+    result: AnalysisResult, input_path: Path, params: dict, force: bool, workspace: Workspace,
+    progress: Progress,
+) -> tuple[str, str, Optional[str]]:
+    """In-process analysis (result cache first); data problems end up in stderr like a failing script's ``sys.exit``."""
+    try:
+        with progress_callback(progress):
+            output, result.cached = cached_run(result.analysis_type, input_path, params, force=force)
+    except AnalysisError as exc:
+        return "", f"❌ {exc}", None
+    geojson = save_output(output, workspace.results_dir)
+    return output.to_text(), "", str(geojson) if geojson else None
+
+
+def _latest_geojson(analysis_type: str, results_dir: Path) -> Optional[str]:
+    files = list(results_dir.rglob(f"visualisierung/{analysis_type}/*.geojson"))
+    return str(max(files, key=lambda f: f.stat().st_mtime)) if files else None
+
+
+def _record(workspace: Workspace, result: AnalysisResult, input_path: Optional[Path]) -> None:
+    workspace.record_analysis({
+        "index": result.index,
+        "analysis_type": result.analysis_type,
+        "decision": result.decision,
+        "input": str(input_path) if input_path else None,
+        "outputs": workspace.outputs(result.analysis_type) if result.decision == "python" else [],
+        "geojson": result.geojson,
+        "cached": result.cached,
+        "error": result.error,
+        "timings": result.timings,
+    })
+
+# ---------------------------------------------------------------------------
+# Pipelines
+# ---------------------------------------------------------------------------
+async def _cypher_pipeline(run: _Runner, question: str, result: AnalysisResult, emit: Emit) -> None:
+    stage = "cypher"
+    try:
+        result.query = await run.timed(result, "generate_cypher", generate_cypher, question)
+        result.rows = await run.timed(result, "run_cypher", run_cypher, result.query)
+        emit("stage", result, "rows")
+        stage = "explain"
+        await run.stream(result, stream_explain_cypher_result(question, result.rows), emit)
+    except Exception as exc:
+        result.error = f"{stage}: {exc}"
+
+
+async def _vector_pipeline(run: _Runner, question: str, structure: dict, result: AnalysisResult, emit: Emit) -> None:
+    stage = "vector"
+    try:
+        result.rows = await run.timed(result, "vector_search", find_similar, question, structure=structure)
+        emit("stage", result, "rows")
+        stage = "explain"
+        await run.stream(result, stream_explain_cypher_result(question, result.rows), emit)
+    except Exception as exc:
+        result.error = f"{stage}: {exc}"
+
+
+async def _python_pipeline(
+    run: _Runner,
+    extractions: _SharedExtractions,
+    workspace: Workspace,
+    question: str,
+    structure: dict,
+    result: AnalysisResult,
+    emit: Emit,
+    backend: Optional[str],
+    prepared: Optional[PlannedAnalysis] = None,
+    force: bool = False,
+) -> Optional[Path]:
+    """Returns the input file used (recorded in the workspace manifest)."""
+    analysis_type = result.analysis_type
+    input_path: Optional[Path] = None
+    stage = "params"
+    try:
+        if prepared and prepared.params is not None:
+            params = prepared.params
+        else:
+            params = await run.timed(result, stage, generate_analysis_params, question, structure, analysis_type)
+
+        stage = "extraction"
+        if prepared and prepared.return_clause:
+            where_clause, return_clause = prepared.where_clause or "TRUE", prepared.return_clause
+        else:
+            where_clause, return_clause = await run.timed(
+                result, "plan_extraction", plan_extraction, question, structure,
+                analysis_type=analysis_type, params=params,
+            )
+        result.stage = "extraction"
+        emit("stage", result, "extraction")
+        input_path = await extractions.get(where_clause, return_clause, backend)
+
+        if ANALYSIS_LIBRARY and analysis_type in ANALYSES:
+            stage = "run"
+            result.code = (f"from modules.analysis import run_analysis\n"
+                           f"run_analysis({analysis_type!r}, {str(input_path)!r}, {params!r})")
+            loop = asyncio.get_running_loop()
+            deadline = time.monotonic() + ANALYSIS_TIMEOUT
+
+            def progress(label: str, done: int, total: int) -> None:     # called from the worker thread
+                if time.monotonic() > deadline:                         # stop at the next checkpoint
+                    raise TimeoutError(f"analysis exceeded ANALYSIS_TIMEOUT ({ANALYSIS_TIMEOUT:.0f}s)")
+                result.progress = {"label": label, "done": done, "total": total}
+                loop.call_soon_threadsafe(emit, "stage", result, "progress")
+
+            try:
+                result.stdout, result.stderr, result.geojson = await asyncio.wait_for(run.timed(
+                    result, stage, _run_library, result, input_path, params, force, workspace, progress
+                ), ANALYSIS_TIMEOUT)
+            except asyncio.TimeoutError:        # the thread is abandoned (see _iterate and modules.jobs)
+                raise TimeoutError(f"analysis did not finish within ANALYSIS_TIMEOUT ({ANALYSIS_TIMEOUT:.0f}s)") from None
+            emit("stage", result, "output")
+            stage = "explain"
+            await run.stream(result, stream_explain_de(question, result.stdout, result.stderr), emit)
+            return input_path
+
+        stage = "code"
+        outputs = await run.timed(
+            result, stage, generate_analysis_code, question,
+            structure=structure, analysis_type=analysis_type, params=params,
+        )
+        current = next((o for o in outputs if isinstance(o, dict) and o.get("analysis_type") == analysis_type), None)
+        if not current:
+            raise ValueError(f"no code output for type {analysis_type!r}")
+        result.code = current["code"]
+        emit("stage", result, "code")
+
+        stage = "run"                               # script runs inside the workspace: its results/ is private
+        result.stdout, result.stderr = await run.timed(
+            result, stage, run_python_code, result.code,
+            {"ANALYSIS_INPUT": str(input_path.resolve())}, cwd=workspace.path,
+        )
+        result.geojson = _latest_geojson(analysis_type, workspace.results_dir)
+        emit("stage", result, "output")
+
+        stage = "explain"
+        await run.stream(result, stream_explain_de(question, result.stdout, result.stderr), emit)
+    except Exception as exc:
+        result.error = f"{stage}: {exc}"
+    return input_path
+
+
+async def _pipeline(
+    run: _Runner, extractions: _SharedExtractions, workspace: Workspace, question: str, emit: Emit,
+    index: int, decision: Decision, backend: Optional[str], prepared: Optional[PlannedAnalysis],
+    force: bool = False,
+) -> AnalysisResult:
+    decision_type, structure, analysis_type = decision
+    result = AnalysisResult(index=index, analysis_type=analysis_type, decision=decision_type, workspace=workspace.id)
+    input_path = None
+    try:
+        with workspace.active():
+            async with analysis_slot():
+                if decision_type == "cypher":
+                    await _cypher_pipeline(run, question, result, emit)
+                elif decision_type == "vector":
+                    await _vector_pipeline(run, question, structure, result, emit)
+                elif decision_type == "python":
+                    input_path = await _python_pipeline(run, extractions, workspace, question, structure,
+                                                        result, emit, backend, prepared, force)
+                else:
+                    result.error = f"decision: unknown decision type {decision_type!r}"
+            log.info("Analysis %d (%s/%s) finished in %s%s", index, decision_type, analysis_type,
+                     result.timings, f" – {result.error}" if result.error else "")
+            _record(workspace, result, input_path)
+    finally:
+        emit("done", result, "")
+    return result
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+async def plan_async(
+    question: str, *, concurrency: int = ANALYSIS_CONCURRENCY, planner: bool = PLANNER_ENABLED
+) -> tuple[list[Decision], Prepared]:
+    """
+    Like ``llm.decide_query_or_python``, with the per-type structure extraction in parallel.
+    With *planner* the whole plan comes from one completion (``modules.planner``); its
+    params and clauses are returned as *prepared* so the pipelines skip those steps.
+    """
+    run = _Runner(concurrency)
+    if planner:
+        try:
+            planned = await run(plan_question, question)
+            return (
+                [(p.decision, p.structure, p.analysis_type) for p in planned],
+                {p.analysis_type: p for p in planned},
+            )
+        except Exception as exc:
+            log.error("❌ Planer fehlgeschlagen (%s) → Einzelschritte", exc)
+
+    try:
+        analysis_types = await run(classify_analysis_types, question)
+        log.info("🧠 Analyse-Typen erkannt: %s", analysis_types)
+    except Exception as exc:
+        log.error("❌ Fehler bei der Typ-Klassifizierung: %s", exc)
+        return [("cypher", {}, "")], {}
+
+    structures = await asyncio.gather(
+        *(run(extract_semantic_structure, question, analysis_type=t) for t in analysis_types),
+        return_exceptions=True,
+    )
+    decisions: list[Decision] = []
+    for analysis_type, structure in zip(analysis_types, structures):
+        if isinstance(structure, BaseException):
+            log.error("❌ Fehler bei Extraktion für Typ '%s': %s", analysis_type, structure)
+            continue
+        decisions.append((decision_for(analysis_type), structure, analysis_type))
+    return decisions, {}
+
+
+async def run_updates(
+    question: str,
+    decisions: list[Decision],
+    *,
+    concurrency: int = ANALYSIS_CONCURRENCY,
+    backend: Optional[str] = None,
+    prepared: Optional[Prepared] = None,
+    force: bool = False,
+    workspace: Optional[Workspace] = None,
+) -> AsyncIterator[AnalysisUpdate]:
+    """
+    Run all pipelines concurrently; yield every progress event as it happens.
+    *force* re-extracts the data and recomputes analyses instead of using cached results.
+    Outputs go to *workspace*; without one a workspace is opened and closed for this run.
+    """
+    owned = workspace is None
+    workspace = workspace or open_workspace(question)
+    queue: asyncio.Queue[AnalysisUpdate] = asyncio.Queue()
+
+    def emit(kind: str, result: AnalysisResult, text: str) -> None:
+        queue.put_nowait(AnalysisUpdate(kind, result, text))
+
+    run = _Runner(concurrency, emit)
+    extractions = _SharedExtractions(run, workspace, reuse=not force)
+    prepared = prepared or {}
+
+    tasks = [
+        asyncio.ensure_future(_pipeline(run, extractions, workspace, question, emit, i, d, backend,
+                                        prepared.get(d[2]), force))
+        for i, d in enumerate(decisions, start=1)
+    ]
+    status = "cancelled"
+    try:
+        pending = len(tasks)
+        while pending:
+            update = await queue.get()
+            pending -= update.kind == "done"
+            yield update
+        status = "done"
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if owned:
+            workspace.close(status)
+
+
+async def run_analyses(
+    question: str,
+    decisions: list[Decision],
+    **kwargs,
+) -> AsyncIterator[AnalysisResult]:
+    """Run all pipelines concurrently; yield each result as soon as it is complete."""
+    async for update in run_updates(question, decisions, **kwargs):
+        if update.kind == "done":
+            yield update.result
+
+
+def plan(
+    question: str, *, concurrency: int = ANALYSIS_CONCURRENCY, planner: bool = PLANNER_ENABLED
+) -> tuple[list[Decision], Prepared]:
+    """Synchronous wrapper around :func:`plan_async` (for Streamlit)."""
+    return asyncio.run(plan_async(question, concurrency=concurrency, planner=planner))
+
+
+def _iterate(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Drive an async generator from synchronous code: the event loop runs in the
+    calling thread between items, so the caller can render each one right away.
+    """
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(thread_name_prefix="orchestrator")
+    loop.set_default_executor(executor)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        executor.shutdown(wait=False)           # don't wait for analyses abandoned after ANALYSIS_TIMEOUT
+        loop.close()
+
+
+def iter_updates(question: str, decisions: list[Decision], **kwargs) -> Iterator[AnalysisUpdate]:
+    """Synchronous generator over :func:`run_updates` (same keyword arguments)."""
+    return _iterate(run_updates(question, decisions, **kwargs))
+
+
+def iter_results(question: str, decisions: list[Decision], **kwargs) -> Iterator[AnalysisResult]:
+    """Synchronous generator over :func:`run_analyses` (same keyword arguments)."""
+    return _iterate(run_analyses(question, decisions, **kwargs))
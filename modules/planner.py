@@ -0,0 +1,219 @@
+"""
+Planer: kompletter Analyseplan in einem LLM-Aufruf
+--------------------------------------------------
+Statt vier Completions (classify → structure → headers → params) liefert
+``plan_analysis.jinja2`` alles in einer strukturierten JSON-Antwort:
+
+* ``analysis_types``
+* pro Typ: ``structure``, ``where_clause`` / ``return_clause``, ``params``
+
+Die Antwort wird gegen ``PLAN_SCHEMA`` geprüft; nur der fehlerhafte Teil
+(Typliste, Struktur, Klauseln oder Parameter eines Typs) fällt auf die
+bisherige Einzelschritt-Kette in ``modules.llm`` zurück. Gruppenlabels in
+``params`` müssen im Vokabular der Daten existieren (``modules.vocabulary``).
+
+Aktiv mit ``LLM_PLANNER=1``.
+
+Einfache Nutzung:  ▸  from modules.planner import plan_question
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from modules.helper import call_llm_with_prompt, load_llm_json, render_prompt
+from modules.llm import (
+    ANALYSIS_PARAM_KEYS,
+    SEMANTIC_ANALYSES,
+    SUPPORTED_ANALYSES,
+    classify_analysis_types,
+    concepts,
+    decision_for,
+    extract_semantic_structure,
+    generate_analysis_params,
+    plan_extraction,
+    prune_return_clause,
+    required_columns,
+)
+from modules.logger import get_logger
+from modules.vocabulary import VocabularyError, validate_params
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+PLANNER_ENABLED = os.getenv("LLM_PLANNER", "0").lower() in {"1", "true", "yes"}
+PLAN_TYPES = SUPPORTED_ANALYSES + sorted(SEMANTIC_ANALYSES)
+
+_NODE_SCHEMA = {
+    "type": "object",
+    "required": ["type"],
+    "properties": {
+        "type": {"enum": ["Feature", "Site"]},
+        "categories": {"type": "array", "items": {"type": "string"}},
+        "filters": {"type": "object"},
+    },
+}
+PLAN_SCHEMA = {
+    "type": "object",
+    "required": ["analysis_types", "analyses"],
+    "properties": {
+        "analysis_types": {"type": "array", "minItems": 1, "items": {"enum": PLAN_TYPES}},
+        "analyses": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "required": ["structure"],
+                "properties": {
+                    "structure": {
+                        "type": "object",
+                        "required": ["nodes"],
+                        "properties": {"nodes": {"type": "array", "items": _NODE_SCHEMA}},
+                    },
+                    "where_clause": {"type": "string"},
+                    "return_clause": {"type": "string", "minLength": 1},
+                    "params": {"type": "object"},
+                },
+            },
+        },
+    },
+}
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str}
+
+
+@dataclass
+class PlannedAnalysis:
+    """Everything the pipeline of one analysis type needs before extraction."""
+    analysis_type: str
+    decision: str
+    structure: dict
+    where_clause: Optional[str] = None
+    return_clause: Optional[str] = None
+    params: Optional[dict] = None
+    fallbacks: list[str] = field(default_factory=list)      # parts that came from the multi-step chain
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def schema_errors(value: Any, schema: dict, path: str = "$") -> list[str]:
+    """Validate *value* against the subset of JSON Schema used in ``PLAN_SCHEMA``."""
+    expected = schema.get("type")
+    if expected and not isinstance(value, _JSON_TYPES[expected]):
+        return [f"{path}: expected {expected}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} not in {schema['enum']}"]
+    if isinstance(value, str) and len(value.strip()) < schema.get("minLength", 0):
+        return [f"{path}: empty string"]
+
+    errors: list[str] = []
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        for i, item in enumerate(value):
+            errors += schema_errors(item, schema.get("items", {}), f"{path}[{i}]")
+    if isinstance(value, dict):
+        errors += [f"{path}.{k}: missing" for k in schema.get("required", []) if k not in value]
+        props = schema.get("properties", {})
+        for key, item in value.items():
+            sub = props.get(key, schema.get("additionalProperties"))
+            if sub and item is not None:
+                errors += schema_errors(item, sub, f"{path}.{key}")
+    return errors
+
+
+def _params_errors(analysis_type: str, params: Any) -> list[str]:
+    if not isinstance(params, dict):
+        return ["params missing"]
+    missing = [k for k in ANALYSIS_PARAM_KEYS.get(analysis_type, []) if k not in params]
+    return [f"params keys missing: {missing}"] if missing else []
+
+
+def _request_plan(question: str, model: Optional[str]) -> Any:
+    prompt = render_prompt("plan_analysis.jinja2", {
+        "question": question,
+        "concepts": concepts,
+        "analysis_types": PLAN_TYPES,
+        "param_keys": ANALYSIS_PARAM_KEYS,
+        "schema": PLAN_SCHEMA,
+    }, folder="system")
+    raw = call_llm_with_prompt("plan_analysis", question, prompt, "", model=model)
+    return load_llm_json(raw)
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def plan_question(question: str, model: Optional[str] = None) -> list[PlannedAnalysis]:
+    """
+    One planner completion for the whole question; every part that is missing
+    or fails validation is recomputed with the corresponding single step.
+    """
+    try:
+        plan = _request_plan(question, model)
+        errors = schema_errors(plan, {"type": "object"})
+    except Exception as exc:                                   # noqa: BLE001
+        plan, errors = {}, [f"planner call failed: {exc}"]
+
+    type_errors = errors or schema_errors(plan.get("analysis_types"), PLAN_SCHEMA["properties"]["analysis_types"])
+    if type_errors:
+        log.warning("Planner: analysis types invalid (%s) → classify step", "; ".join(type_errors))
+        analysis_types = classify_analysis_types(question)
+    else:
+        analysis_types = list(dict.fromkeys(plan["analysis_types"]))
+
+    entries = plan.get("analyses") if isinstance(plan.get("analyses"), dict) else {}
+    entry_schema = PLAN_SCHEMA["properties"]["analyses"]["additionalProperties"]
+    planned: list[PlannedAnalysis] = []
+    for analysis_type in analysis_types:
+        entry = entries.get(analysis_type)
+        entry = entry if isinstance(entry, dict) else {}
+        props = entry_schema["properties"]
+        item = PlannedAnalysis(analysis_type, decision_for(analysis_type), structure={})
+        if type_errors:
+            item.fallbacks.append("analysis_types")
+
+        structure_errors = schema_errors(entry.get("structure"), props["structure"], "structure")
+        if structure_errors:
+            item.structure = extract_semantic_structure(question, analysis_type=analysis_type, model=model)
+            item.fallbacks.append("structure")
+        else:
+            item.structure = {"analysis_types": [analysis_type], **entry["structure"]}
+
+        if item.decision == "python":
+            params_errors = _params_errors(analysis_type, entry.get("params"))
+            if params_errors:
+                item.params = generate_analysis_params(question, item.structure, analysis_type, model=model)
+                item.fallbacks.append("params")
+            else:
+                params = {k: entry["params"].get(k) for k in ANALYSIS_PARAM_KEYS.get(analysis_type, [])}
+                try:
+                    item.params = validate_params(analysis_type, params)
+                except VocabularyError as exc:
+                    log.warning("Planner: %s params not in vocabulary (%s) → params step", analysis_type, exc)
+                    item.params = None                 # pipeline re-asks and reports a persisting error
+                    item.fallbacks.append("params")
+
+            clause_errors = (
+                schema_errors(entry.get("where_clause", "TRUE"), props["where_clause"], "where_clause")
+                + schema_errors(entry.get("return_clause"), props["return_clause"], "return_clause")
+            )
+            if clause_errors:
+                item.where_clause, item.return_clause = plan_extraction(
+                    question, item.structure, model, analysis_type=analysis_type, params=item.params,
+                )
+                item.fallbacks.append("clauses")
+            else:
+                include_embeddings = "embedding" in question.lower()
+                item.where_clause = entry.get("where_clause") or "TRUE"
+                item.return_clause = prune_return_clause(
+                    entry["return_clause"], required_columns(analysis_type, item.params),
+                    include_embeddings=include_embeddings,
+                )
+
+        planned.append(item)
+        log.info("Planner: %s → %s%s", analysis_type, item.decision,
+                 f" (fallback: {', '.join(item.fallbacks)})" if item.fallbacks else "")
+    return planned
@@ -0,0 +1,188 @@
+"""
+Prompt-Aufbau & Prompt-Statistik
+--------------------------------
+* Systemprompts bestehen aus einem statischen Block (Anweisungen, Konzepte,
+  Vokabular – identisch für jede Frage) und einem variablen Block (Struktur,
+  Analyse-Typ, …). Templates markieren das mit ``{% block static %}`` /
+  ``{% block variable %}``; ``helper.render_prompt`` rendert beide getrennt.
+* Nachrichten-Layout: ``system`` = statischer Präfix, danach ``user`` = variabler
+  Teil + Frage → der Präfix ist über alle Fragen byte-identisch und damit
+  provider-seitig cachebar.
+* JSON in Templates wird kompakt serialisiert (``helper.env`` → ``tojson``).
+* Pro LLM-Aufruf: Tokens (Präfix / variabel / gesamt), Latenz, Cache-Status und
+  – falls vom Provider gemeldet – gecachte Prompt-Tokens in ``cache/prompt_stats.sqlite``.
+
+Einfache Nutzung:  ▸  from modules.prompting import prompt_stats, measure_templates
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+import pandas as pd
+
+from modules.logger import get_logger
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+PROMPT_STATS_PATH = Path(os.getenv("PROMPT_STATS_PATH", "cache/prompt_stats.sqlite"))
+PROMPT_STATS_ENABLED = os.getenv("PROMPT_STATS", "1").lower() in {"1", "true", "yes"}
+COMPACT_JSON = {"sort_keys": True, "separators": (",", ":"), "ensure_ascii": False}
+
+try:                                    # exact counts if tiktoken is installed
+    import tiktoken
+except ImportError:                     # pragma: no cover - optional dependency
+    tiktoken = None
+
+
+@dataclass(frozen=True)
+class Prompt:
+    """Rendered system prompt split into the cacheable prefix and the per-call part."""
+    static: str
+    variable: str = ""
+
+    def __str__(self) -> str:
+        return "\n\n".join(p for p in (self.static, self.variable) if p)
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Token count via tiktoken; without it the usual ~4 characters per token estimate."""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model or "gpt-4o")
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text))
+    return max(1, round(len(text) / 4))
+
+
+def build_messages(prompt: "Prompt | str", question: str, preview: str) -> list[dict]:
+    """Static prefix first, everything that changes per call at the end."""
+    if isinstance(prompt, Prompt):
+        user = "\n\n".join(p for p in (prompt.variable, f"Frage: {question}") if p)
+        system = prompt.static
+    else:
+        user, system = f"Frage: {question}", prompt
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+    if preview:
+        messages.append({"role": "assistant", "content": preview})
+    return messages
+
+
+def _connect() -> sqlite3.Connection:
+    PROMPT_STATS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(PROMPT_STATS_PATH), timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            ts              REAL,
+            function        TEXT,
+            model           TEXT,
+            prefix_tokens   INTEGER,
+            variable_tokens INTEGER,
+            prompt_tokens   INTEGER,
+            cached_tokens   INTEGER,
+            output_tokens   INTEGER,
+            latency_s       REAL,
+            cache           TEXT
+        )
+    """)
+    return con
+
+
+def _usage_value(usage: Any, *path: str) -> Optional[int]:
+    for key in path:
+        if usage is None:
+            return None
+        usage = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+    return usage
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def record_call(
+    function_name: str,
+    model: str,
+    messages: list[dict],
+    latency_s: float,
+    *,
+    usage: Any = None,
+    cache: Optional[str] = None,
+) -> None:
+    """Store size and latency of one call (provider ``usage`` wins over local counts)."""
+    if not PROMPT_STATS_ENABLED:
+        return
+    prefix = count_tokens(messages[0]["content"], model)
+    variable = sum(count_tokens(m["content"], model) for m in messages[1:])
+    row = (
+        time.time(), function_name, model, prefix, variable,
+        _usage_value(usage, "prompt_tokens") or prefix + variable,
+        _usage_value(usage, "prompt_tokens_details", "cached_tokens"),
+        _usage_value(usage, "completion_tokens"),
+        round(latency_s, 3), cache,
+    )
+    try:
+        con = _connect()
+        try:
+            with con:
+                con.execute("INSERT INTO llm_calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        finally:
+            con.close()
+    except sqlite3.Error as exc:
+        log.warning("Prompt stats not recorded: %s", exc)
+
+
+def prompt_stats(since: Optional[float] = None) -> pd.DataFrame:
+    """Per function: calls, mean prefix/variable/prompt tokens, provider-cached tokens, latency, cache hits."""
+    con = _connect()
+    try:
+        return pd.read_sql_query("""
+            SELECT function,
+                   count(*)                                        AS calls,
+                   round(avg(prefix_tokens))                       AS avg_prefix_tokens,
+                   round(avg(variable_tokens))                     AS avg_variable_tokens,
+                   round(avg(prompt_tokens))                       AS avg_prompt_tokens,
+                   round(avg(cached_tokens))                       AS avg_provider_cached_tokens,
+                   round(avg(CASE WHEN cache IS NULL THEN latency_s END), 2) AS avg_latency_s,
+                   sum(cache IS NOT NULL)                          AS cache_hits
+            FROM llm_calls
+            WHERE ts >= ?
+            GROUP BY function
+            ORDER BY calls DESC
+        """, con, params=[since or 0])
+    finally:
+        con.close()
+
+
+def measure_templates(contexts: dict[str, dict], model: Optional[str] = None) -> pd.DataFrame:
+    """
+    Token counts per template for the given ``{template name: render context}``
+    (static prefix vs. variable part), e.g. to compare template revisions.
+    """
+    from modules.helper import render_prompt
+
+    rows = []
+    for name, ctx in contexts.items():
+        prompt = render_prompt(name, ctx, folder="system")
+        rows.append({
+            "template": name,
+            "prefix_tokens": count_tokens(prompt.static, model),
+            "variable_tokens": count_tokens(prompt.variable, model),
+            "prefix_chars": len(prompt.static),
+        })
+    return pd.DataFrame(rows)
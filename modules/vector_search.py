@@ -0,0 +1,421 @@
+"""
+Lokale Vektorsuche über die Site-/Feature-Embeddings
+----------------------------------------------------
+* Index pro Entität unter ``cache/vector_index/`` (memory-mapped float32, L2-normiert);
+  jedes Schreiben legt neue Dateien an, das Manifest ``<entity>.json`` verweist
+  darauf und wird atomar ersetzt
+* ``mode="exact"``: geblockte NumPy-Suche über alle Vektoren
+* ``mode="ivf"``  : IVF-Flat (k-means-Zentroiden, Vektoren nach Liste sortiert,
+  es werden nur die ``nprobe`` nächsten Listen gescannt)
+* Filter nach Kategorie und Bounding-Box (Lon/Lat) vor dem Ranking; Kategorien
+  liegen ganzzahlig kodiert als Memmap vor (Maske per ``np.isin``)
+* ``refresh_indexes()`` nach jedem Import: nur geänderte Zeilen werden nachgeladen
+  und den bestehenden Zentroiden zugeordnet; ein voller Neuaufbau erfolgt nur nach
+  einem Voll-Import oder wenn sich zu viele Zeilen geändert haben.
+
+Einfache Nutzung:  ▸  from modules.vector_search import search
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.logger import get_logger
+from modules.neo4j.import_state import DUCKDB_PATH, ENTITY_KEYS
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+INDEX_DIR = Path("cache/vector_index")
+INDEX_DIR.mkdir(parents=True, exist_ok=True)
+BLOCK_ROWS = 65_536
+KMEANS_SAMPLE = 50_000
+KMEANS_ITERS = 12
+DEFAULT_NPROBE = int(os.getenv("VECTOR_NPROBE", "8"))
+REBUILD_RATIO = 0.3           # full rebuild if more than 30 % of the rows changed
+
+BBox = tuple[float, float, float, float]   # (min_lon, min_lat, max_lon, max_lat)
+
+# ---------------------------------------------------------------------------
+# Index files
+# ---------------------------------------------------------------------------
+_SUFFIXES = {"vecs": "vecs.f32", "cats": "cats.i32", "meta": "meta.parquet", "ivf": "ivf.npz"}
+
+def _manifest_path(entity: str) -> Path:
+    return INDEX_DIR / f"{entity}.json"
+
+def _paths(entity: str, manifest: Optional[dict] = None) -> dict[str, Path]:
+    """Data files of *entity* named in its manifest (one generation per write); old manifests → fixed names."""
+    files = (manifest or {}).get("files") or {key: f"{entity}.{suffix}" for key, suffix in _SUFFIXES.items()}
+    return {key: INDEX_DIR / name for key, name in files.items()}
+
+def _read_manifest(entity: str) -> Optional[dict]:
+    path = _manifest_path(entity)
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+
+def _write_manifest(entity: str, manifest: dict) -> None:
+    """Replace the manifest atomically – it is the only file readers look up by a fixed name."""
+    path = _manifest_path(entity)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _drop_old_generations(entity: str, keep: Sequence[Optional[dict]]) -> None:
+    """Delete data files not named by the manifests in *keep* (current and previous generation)."""
+    used = {path.name for manifest in keep if manifest for path in _paths(entity, manifest).values()}
+    for path in INDEX_DIR.glob(f"{entity}.*"):
+        if path.name != _manifest_path(entity).name and path.name not in used:
+            try:
+                path.unlink()
+            except OSError:                 # still mapped (Windows) → removed after the next write
+                pass
+
+@dataclass
+class VectorIndex:
+    entity: str
+    vecs: np.memmap            # (n, dim), rows sorted by IVF list
+    ids: np.ndarray
+    category: np.ndarray
+    category_codes: np.ndarray # (n,) int32 memmap, position in ``categories``; -1 = no category
+    categories: list[str]      # lower-cased category vocabulary
+    lon: np.ndarray
+    lat: np.ndarray
+    centroids: np.ndarray      # (nlist, dim)
+    offsets: np.ndarray        # (nlist + 1,) row ranges per list
+    manifest: dict
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+_LOADED: dict[str, tuple[float, VectorIndex]] = {}
+
+def load_index(entity: str) -> Optional[VectorIndex]:
+    """Open (and memoise until the files change) the on-disk index of *entity*."""
+    path = _manifest_path(entity)
+    if not path.exists():
+        return None
+    mtime = path.stat().st_mtime
+    cached = _LOADED.get(entity)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    p = _paths(entity, manifest)
+    n, dim = manifest["n"], manifest["dim"]
+    vecs = np.memmap(p["vecs"], dtype=np.float32, mode="r", shape=(n, dim)) if n else np.zeros((0, dim), np.float32)
+    meta = pq.read_table(p["meta"])
+    ivf = np.load(p["ivf"])
+    category = meta.column("Category").to_numpy(zero_copy_only=False)
+    if "categories" in manifest:
+        categories = manifest["categories"]
+        codes = np.memmap(p["cats"], dtype=np.int32, mode="r", shape=(n,)) if n else np.zeros(0, np.int32)
+    else:                                   # index written before category codes existed
+        codes, categories = _encode_categories(category)
+    index = VectorIndex(
+        entity=entity,
+        vecs=vecs,
+        ids=meta.column("id").to_numpy(zero_copy_only=False),
+        category=category,
+        category_codes=codes,
+        categories=categories,
+        lon=meta.column("Lon").to_numpy(zero_copy_only=False),
+        lat=meta.column("Lat").to_numpy(zero_copy_only=False),
+        centroids=ivf["centroids"],
+        offsets=ivf["offsets"],
+        manifest=manifest,
+    )
+    _LOADED[entity] = (mtime, index)
+    return index
+
+def _write_index(
+    entity: str,
+    vecs: np.ndarray,
+    meta: pd.DataFrame,
+    centroids: np.ndarray,
+    assign: np.ndarray,
+    import_version: int,
+) -> None:
+    """
+    Sort rows by IVF list and write all data files under new generation names, then
+    swap the manifest atomically: readers see either the old or the new index, never a
+    mix (``load_index`` memmaps with the manifest's ``(n, dim)``). The previous
+    generation stays on disk for readers that just read the old manifest.
+    """
+    order = np.argsort(assign, kind="stable")
+    vecs, meta, assign = vecs[order], meta.iloc[order].reset_index(drop=True), assign[order]
+    offsets = np.searchsorted(assign, np.arange(len(centroids) + 1)).astype(np.int64)
+
+    previous = _read_manifest(entity)
+    generation = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    files = {key: f"{entity}.{generation}.{suffix}" for key, suffix in _SUFFIXES.items()}
+    p = _paths(entity, {"files": files})
+    np.ascontiguousarray(vecs, dtype=np.float32).tofile(p["vecs"])
+    codes, categories = _encode_categories(meta["Category"].to_numpy())
+    codes.tofile(p["cats"])
+    meta["list_id"] = assign.astype(np.int32)
+    pq.write_table(pa.Table.from_pandas(meta, preserve_index=False), p["meta"])
+    np.savez(p["ivf"], centroids=centroids.astype(np.float32), offsets=offsets)
+    manifest = {
+        "entity": entity,
+        "n": int(len(vecs)),
+        "dim": int(vecs.shape[1]) if vecs.ndim == 2 else 0,
+        "nlist": int(len(centroids)),
+        "categories": categories,
+        "import_version": int(import_version),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": files,
+    }
+    _write_manifest(entity, manifest)
+    _drop_old_generations(entity, [manifest, previous])
+    _LOADED.pop(entity, None)
+    log.info("Vector index %s written: %s", entity, manifest)
+
+def _encode_categories(category: np.ndarray) -> tuple[np.ndarray, list[str]]:
+    """Lower-cased categories as int32 codes into a sorted vocabulary (missing → -1)."""
+    lowered = pd.Series(category, dtype="object").map(lambda c: None if pd.isna(c) else str(c).lower())
+    codes, uniques = pd.factorize(lowered, sort=True)
+    return codes.astype(np.int32), [str(u) for u in uniques]
+
+# ---------------------------------------------------------------------------
+# Vector helpers
+# ---------------------------------------------------------------------------
+def _normalise(vecs: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vecs / norms).astype(np.float32, copy=False)
+
+def _nearest_centroid(vecs: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(len(vecs), dtype=np.int32)
+    for start in range(0, len(vecs), BLOCK_ROWS):
+        out[start:start + BLOCK_ROWS] = np.argmax(vecs[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+    return out
+
+def _train_centroids(vecs: np.ndarray, nlist: int, seed: int = 42) -> np.ndarray:
+    """Spherical k-means (cosine) on a sample – good enough for coarse IVF lists."""
+    rng = np.random.default_rng(seed)
+    sample = vecs[rng.choice(len(vecs), size=min(len(vecs), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERS):
+        assign = _nearest_centroid(sample, centroids)
+        for c in range(nlist):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalise(centroids)
+    return centroids
+
+def _default_nlist(n: int) -> int:
+    return int(max(1, min(4096, round(np.sqrt(n)))))
+
+def _read_rows(
+    con: duckdb.DuckDBPyConnection, entity: str, keys: Optional[Sequence[str]] = None
+) -> tuple[np.ndarray, pd.DataFrame]:
+    key = ENTITY_KEYS[entity]
+    sql = (
+        f"SELECT CAST({key} AS VARCHAR) AS id, Category, Lon, Lat, embedding::FLOAT[] AS embedding "
+        f"FROM {entity} WHERE embedding IS NOT NULL"
+    )
+    if keys is not None:
+        con.register("_vec_keys", pd.DataFrame({"key": pd.Series(list(keys), dtype="object")}))
+        sql += f" AND CAST({key} AS VARCHAR) IN (SELECT key FROM _vec_keys)"
+    table = con.execute(sql).arrow()
+    emb = table.column("embedding").combine_chunks()
+    n = table.num_rows
+    dim = len(emb[0]) if n else 0
+    vecs = emb.flatten().to_numpy(zero_copy_only=False).reshape(n, dim) if n else np.zeros((0, 0), np.float32)
+    meta = table.drop(["embedding"]).to_pandas()
+    return _normalise(np.asarray(vecs, dtype=np.float32)), meta
+
+# ---------------------------------------------------------------------------
+# Build / refresh
+# ---------------------------------------------------------------------------
+def build_index(
+    entity: str,
+    db_path: Union[str, Path] = DUCKDB_PATH,
+    import_version: int = 0,
+    nlist: Optional[int] = None,
+) -> None:
+    """Full (re)build of the index for *entity* from DuckDB."""
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        vecs, meta = _read_rows(con, entity)
+    finally:
+        con.close()
+    if not len(vecs):
+        log.warning("Vector index %s: no embeddings found – nothing to index.", entity)
+        return
+    centroids = _train_centroids(vecs, nlist or _default_nlist(len(vecs)))
+    _write_index(entity, vecs, meta, centroids, _nearest_centroid(vecs, centroids), import_version)
+
+def _changes_since(con: duckdb.DuckDBPyConnection, entity: str, since: int) -> tuple[int, bool, list[str]]:
+    """(latest complete version, full import in between?, keys changed since *since*)."""
+    latest, has_full = con.execute("""
+        SELECT coalesce(max(version), 0), coalesce(bool_or(mode = 'full' AND version > ?), false)
+        FROM ImportVersions WHERE status = 'complete'
+    """, [since]).fetchone()
+    keys = [r[0] for r in con.execute("""
+        SELECT DISTINCT key FROM RowChanges WHERE entity = ? AND version > ? AND version <= ?
+    """, [entity, since, latest]).fetchall()]
+    return int(latest), bool(has_full), keys
+
+def refresh_index(entity: str, db_path: Union[str, Path] = DUCKDB_PATH) -> str:
+    """
+    Bring the index of *entity* up to the last completed import version.
+    Returns ``"fresh"``, ``"incremental"`` or ``"rebuilt"``.
+    """
+    index = load_index(entity)
+    since = index.manifest["import_version"] if index else -1
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        latest, has_full, keys = _changes_since(con, entity, max(since, 0))
+        if index is not None and latest == since:
+            return "fresh"
+        if index is None or has_full or len(keys) > REBUILD_RATIO * max(index.size, 1):
+            con.close()
+            build_index(entity, db_path, import_version=latest)
+            return "rebuilt"
+        if not keys:
+            manifest = dict(index.manifest, import_version=latest)
+            _write_manifest(entity, manifest)
+            return "fresh"
+        new_vecs, new_meta = _read_rows(con, entity, keys)
+    finally:
+        con.close()
+
+    if len(new_vecs) and new_vecs.shape[1] != index.manifest["dim"]:
+        build_index(entity, db_path, import_version=latest)
+        return "rebuilt"
+
+    keep = ~np.isin(index.ids, np.asarray(keys, dtype=object))
+    old_meta = pd.DataFrame({
+        "id": index.ids[keep], "Category": index.category[keep],
+        "Lon": index.lon[keep], "Lat": index.lat[keep],
+    })
+    vecs = np.concatenate([np.asarray(index.vecs[keep]), new_vecs]) if len(new_vecs) else np.asarray(index.vecs[keep])
+    meta = pd.concat([old_meta, new_meta], ignore_index=True)
+    old_lists = np.repeat(np.arange(len(index.centroids)), np.diff(index.offsets))[keep]
+    assign = np.concatenate([old_lists, _nearest_centroid(new_vecs, index.centroids)]) if len(new_vecs) else old_lists
+    _write_index(entity, vecs, meta, index.centroids, assign, latest)
+    log.info("Vector index %s: %d keys refreshed incrementally", entity, len(keys))
+    return "incremental"
+
+def refresh_indexes(db_path: Union[str, Path] = DUCKDB_PATH) -> dict[str, str]:
+    return {entity: refresh_index(entity, db_path) for entity in ENTITY_KEYS}
+
+# ---------------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------------
+def _filter_mask(index: VectorIndex, category: Optional[Sequence[str]], bbox: Optional[BBox]) -> Optional[np.ndarray]:
+    mask = None
+    if category:
+        wanted = {c.lower() for c in ([category] if isinstance(category, str) else category)}
+        codes = [i for i, c in enumerate(index.categories) if c in wanted]
+        mask = np.isin(index.category_codes, np.asarray(codes, dtype=np.int32))
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        in_box = (index.lon >= min_lon) & (index.lon <= max_lon) & (index.lat >= min_lat) & (index.lat <= max_lat)
+        mask = in_box if mask is None else mask & in_box
+    return mask
+
+def _scan(
+    vecs: np.ndarray, q: np.ndarray, k: int, rows: Sequence[tuple[int, int]], mask: Optional[np.ndarray]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Blocked dot-product scan over the row ranges *rows*; returns (row_idx, scores) of the top *k*."""
+    best_idx = np.empty(0, dtype=np.int64)
+    best_score = np.empty(0, dtype=np.float32)
+    for start, stop in rows:
+        for b in range(start, stop, BLOCK_ROWS):
+            e = min(b + BLOCK_ROWS, stop)
+            scores = vecs[b:e] @ q
+            if mask is not None:
+                scores = np.where(mask[b:e], scores, -np.inf)
+            idx = np.arange(b, e)
+            best_idx = np.concatenate([best_idx, idx])
+            best_score = np.concatenate([best_score, scores])
+            if len(best_score) > k:
+                top = np.argpartition(-best_score, k)[:k]
+                best_idx, best_score = best_idx[top], best_score[top]
+    keep = np.isfinite(best_score)
+    best_idx, best_score = best_idx[keep], best_score[keep]
+    order = np.argsort(-best_score)[:k]
+    return best_idx[order], best_score[order]
+
+def search(
+    query: Union[str, Sequence[float], np.ndarray],
+    entity: str = "Features",
+    k: int = 10,
+    *,
+    category: Optional[Union[str, Sequence[str]]] = None,
+    bbox: Optional[BBox] = None,
+    mode: str = "ivf",
+    nprobe: int = DEFAULT_NPROBE,
+) -> pd.DataFrame:
+    """
+    Top-*k* cosine neighbours of *query* (text or vector) among *entity*.
+    Returns a DataFrame with ``id, score, Category, Lon, Lat``.
+
+    Text queries are embedded through the embedding cache; pass a vector (or use
+    ``similar_to``) to stay fully offline.
+    """
+    index = load_index(entity)
+    if index is None:
+        raise FileNotFoundError(f"No vector index for {entity} – run refresh_indexes() after the import.")
+
+    if isinstance(query, str):
+        from modules.neo4j.generate_embeddings import cached_embeddings
+        query = cached_embeddings([query])[0]
+    q = _normalise(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+    if q.shape[0] != index.manifest["dim"]:
+        raise ValueError(f"Query has {q.shape[0]} dims, index {entity} has {index.manifest['dim']}")
+
+    mask = _filter_mask(index, category, bbox)
+    if mode == "exact" or len(index.centroids) <= nprobe:
+        rows = [(0, index.size)]
+    elif mode == "ivf":
+        lists = np.argsort(-(index.centroids @ q))[:nprobe]
+        rows = [(int(index.offsets[l]), int(index.offsets[l + 1])) for l in lists]
+    else:
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    t0 = time.perf_counter()
+    idx, scores = _scan(index.vecs, q, k, rows, mask)
+    log.debug("vector search %s/%s: %d hits in %.2f ms", entity, mode, len(idx), (time.perf_counter() - t0) * 1000)
+    return pd.DataFrame({
+        "id": index.ids[idx],
+        "score": scores.astype(float),
+        "Category": index.category[idx],
+        "Lon": index.lon[idx],
+        "Lat": index.lat[idx],
+    })
+
+def similar_to(
+    node_id: str,
+    entity: str = "Sites",
+    k: int = 10,
+    **kwargs,
+) -> pd.DataFrame:
+    """Neighbours of an already indexed Site/Feature (no embedding call, the node itself is excluded)."""
+    index = load_index(entity)
+    if index is None:
+        raise FileNotFoundError(f"No vector index for {entity} – run refresh_indexes() after the import.")
+    hit = np.flatnonzero(index.ids == str(node_id))
+    if not len(hit):
+        raise KeyError(f"{entity} {node_id} is not in the vector index")
+    result = search(np.asarray(index.vecs[hit[0]]), entity, k + 1, **kwargs)
+    return result[result["id"] != str(node_id)].head(k).reset_index(drop=True)
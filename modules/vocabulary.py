@@ -0,0 +1,391 @@
+"""
+Lokaler Vokabular-Resolver
+--------------------------
+Bildet Begriffe aus der Frage („ridge tumuli“, „Sesshaftigkeitsindikatoren“) auf
+die tatsächlich gespeicherten Werte (Category, Category2, Location1/2, Surface,
+Condition) ab – ohne LLM-Aufruf:
+
+* Index wird beim Import aus den DISTINCT-Werten in DuckDB gebaut
+  (``cache/vocabulary/``: Werte + Häufigkeit, normalisierte Lemmata, Embeddings)
+* Auflösung in Stufen: Konzeptgruppe (``concepts.yml``) → Alias (``vocabulary.yml``)
+  → Lemma (klein, ohne Umlaute, Singular) → Fuzzy (difflib) → Embedding
+* ``local_structure`` ersetzt ``extract_semantic_structure``, wenn alle Begriffe
+  sicher aufgelöst werden; sonst entscheidet weiterhin das LLM. Der Projektname
+  („Wadi Abu Dom“, ``ignore`` in ``vocabulary.yml``) wird dabei nie als Ort gelesen
+* ``validate_params`` prüft LLM-Gruppenlabels gegen das echte Vokabular, bevor
+  eine Analyse startet (leere Gruppe → ``VocabularyError``)
+
+Einfache Nutzung:  ▸  from modules.vocabulary import resolve, validate_params
+"""
+
+from __future__ import annotations
+
+import difflib
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+import yaml
+
+from modules.logger import get_logger
+from modules.neo4j.import_state import DUCKDB_PATH, current_import_version
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+VOCAB_DIR = Path("cache/vocabulary")
+CONFIG_DIR = Path(__file__).parent.parent / "config"
+VOCAB_COLUMNS = {
+    "Sites":    ["Category", "Surface", "Location1", "Location2"],
+    "Features": ["Category", "Category2", "Condition", "Location1", "Location2"],
+}
+CONCEPT_GROUPS = [
+    "mobility_indicators", "sedentary_indicators", "water_sources", "rock_art_indicators",
+    "grave_categories_site", "grave_categories_feature", "stone_features",
+    "site_surface_types", "location_terms",
+]
+MIN_CONFIDENCE = float(os.getenv("VOCAB_MIN_CONFIDENCE", "0.85"))
+FUZZY_CUTOFF = 0.75
+LOCAL_STRUCTURE = os.getenv("VOCAB_LOCAL_STRUCTURE", "1").lower() in {"1", "true", "yes"}
+MAX_NGRAM = 4
+ENTITY_TYPE = {"Sites": "Site", "Features": "Feature"}
+# Analyses whose structure is fully described by one or two category groups
+LOCAL_GROUPS = {"colocation": (2, 2), "spatial_distance": (2, 2), "autocorrelation": (1, 2),
+                "hotspot": (1, 1), "ripley_k": (1, 1)}
+
+
+class VocabularyError(ValueError):
+    """Raised when an analysis parameter names no value that exists in the data."""
+
+
+@dataclass(frozen=True)
+class Match:
+    value: str              # value as stored in DuckDB
+    entity: str             # Sites | Features
+    column: str
+    score: float
+    method: str             # concept | alias | lemma | fuzzy | embedding
+
+
+@dataclass
+class Resolution:
+    term: str
+    matches: list[Match] = field(default_factory=list)
+
+    @property
+    def confidence(self) -> float:
+        return max((m.score for m in self.matches), default=0.0)
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= MIN_CONFIDENCE
+
+    @property
+    def values(self) -> list[str]:
+        return list(dict.fromkeys(m.value for m in self.matches if m.score >= MIN_CONFIDENCE))
+
+# ---------------------------------------------------------------------------
+# Normalisation
+# ---------------------------------------------------------------------------
+def _singular(word: str) -> str:
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("uli"):
+        return word[:-1] + "us"                      # tumuli → tumulus
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+def lemma(text: str) -> str:
+    """Lower-case, umlauts/accents folded, punctuation → space, every word singular."""
+    text = unicodedata.normalize("NFKD", str(text).lower().replace("ß", "ss"))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_singular(w) for w in re.sub(r"[^a-z0-9]+", " ", text).split())
+
+# ---------------------------------------------------------------------------
+# Index (build at import, load memoised)
+# ---------------------------------------------------------------------------
+def _paths() -> dict[str, Path]:
+    return {
+        "terms": VOCAB_DIR / "terms.parquet",
+        "vecs": VOCAB_DIR / "embeddings.npy",
+        "manifest": VOCAB_DIR / "manifest.json",
+    }
+
+def build_vocabulary(db_path: Union[str, Path] = DUCKDB_PATH, *, embeddings: bool = True) -> int:
+    """Collect DISTINCT values (with counts) of the vocabulary columns and embed them."""
+    frames = []
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        for entity, columns in VOCAB_COLUMNS.items():
+            present = {r[0] for r in con.execute(f"DESCRIBE {entity}").fetchall()}
+            for column in (c for c in columns if c in present):
+                frames.append(con.execute(f"""
+                    SELECT CAST("{column}" AS VARCHAR) AS value, ? AS entity, ? AS "column", count(*) AS count
+                    FROM {entity}
+                    WHERE "{column}" IS NOT NULL AND trim(CAST("{column}" AS VARCHAR)) <> ''
+                    GROUP BY 1
+                """, [entity, column]).df())
+    finally:
+        con.close()
+    terms = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["value", "entity", "column", "count"])
+    terms["lemma"] = terms["value"].map(lemma)
+
+    VOCAB_DIR.mkdir(parents=True, exist_ok=True)
+    p = _paths()
+    terms.to_parquet(p["terms"], index=False)
+    has_vecs = False
+    if embeddings and len(terms):
+        try:
+            from modules.neo4j.generate_embeddings import cached_embeddings
+
+            vecs = np.asarray(cached_embeddings(terms["value"].tolist()), dtype=np.float32)
+            vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+            np.save(p["vecs"], vecs)
+            has_vecs = True
+        except Exception as exc:
+            log.warning("Vocabulary embeddings skipped (%s) – fuzzy matching only", exc)
+    if not has_vecs:
+        p["vecs"].unlink(missing_ok=True)
+    p["manifest"].write_text(json.dumps({
+        "import_version": current_import_version(db_path), "n": len(terms), "embeddings": has_vecs,
+    }), encoding="utf-8")
+    _LOADED.clear()
+    log.info("Vocabulary index: %d distinct values (%s embeddings)", len(terms), "with" if has_vecs else "without")
+    return len(terms)
+
+
+@dataclass
+class _Index:
+    terms: pd.DataFrame
+    by_lemma: dict[str, list[int]]
+    aliases: dict[str, str]                 # lemma → lemma of a data value
+    concepts: dict[str, list[str]]          # lemma of a concept name → member lemmas
+    vecs: Optional[np.ndarray]
+    ignore: list[str] = field(default_factory=list)     # lemmas of names never scanned (project name)
+
+_LOADED: dict[str, tuple[float, _Index]] = {}
+
+def _load() -> Optional[_Index]:
+    p = _paths()
+    if not p["manifest"].exists():
+        return None
+    mtime = p["manifest"].stat().st_mtime
+    cached = _LOADED.get("index")
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    terms = pd.read_parquet(p["terms"])
+    by_lemma: dict[str, list[int]] = {}
+    for i, lem in enumerate(terms["lemma"]):
+        by_lemma.setdefault(lem, []).append(i)
+
+    concepts_yml = yaml.safe_load((CONFIG_DIR / "concepts.yml").read_text(encoding="utf-8")) or {}
+    extra = yaml.safe_load((CONFIG_DIR / "vocabulary.yml").read_text(encoding="utf-8")) or {}
+    concepts = {
+        lemma(name): [lemma(v) for v in concepts_yml.get(name) or []]
+        for name in CONCEPT_GROUPS
+    }
+    for term, group in (extra.get("concepts") or {}).items():
+        concepts[lemma(term)] = concepts.get(lemma(group), [])
+    aliases = {lemma(k): lemma(v) for k, v in (extra.get("aliases") or {}).items()}
+    ignore = sorted((lemma(name) for name in extra.get("ignore") or []), key=len, reverse=True)
+
+    vecs = np.load(p["vecs"], mmap_mode="r") if p["vecs"].exists() else None
+    index = _Index(terms, by_lemma, aliases, concepts, vecs, ignore)
+    _LOADED["index"] = (mtime, index)
+    return index
+
+# ---------------------------------------------------------------------------
+# Resolution
+# ---------------------------------------------------------------------------
+def _matches(index: _Index, rows: list[int], score: float, method: str) -> list[Match]:
+    t = index.terms
+    return [Match(t.at[i, "value"], t.at[i, "entity"], t.at[i, "column"], score, method) for i in rows]
+
+def _lookup(index: _Index, lem: str, *, fuzzy: bool) -> list[Match]:
+    if lem in index.concepts:
+        rows = [i for member in index.concepts[lem] for i in index.by_lemma.get(member, [])]
+        if rows:
+            return _matches(index, rows, 1.0, "concept")
+    if lem in index.aliases and index.aliases[lem] in index.by_lemma:
+        return _matches(index, index.by_lemma[index.aliases[lem]], 0.99, "alias")
+    if lem in index.by_lemma:
+        return _matches(index, index.by_lemma[lem], 1.0, "lemma")
+    if not fuzzy:
+        return []
+    found: list[Match] = []
+    for cand in difflib.get_close_matches(lem, list(index.by_lemma) + list(index.aliases), n=3, cutoff=FUZZY_CUTOFF):
+        score = round(difflib.SequenceMatcher(None, lem, cand).ratio(), 3)
+        target = index.aliases.get(cand, cand)
+        found += _matches(index, index.by_lemma.get(target, []), score, "fuzzy")
+    return found
+
+def _embedding_matches(index: _Index, term: str, k: int = 3) -> list[Match]:
+    if index.vecs is None or not len(index.vecs):
+        return []
+    from modules.neo4j.generate_embeddings import cached_embeddings
+
+    q = np.asarray(cached_embeddings([term])[0], dtype=np.float32)
+    q /= max(float(np.linalg.norm(q)), 1e-12)
+    scores = np.asarray(index.vecs @ q)
+    top = np.argsort(-scores)[:k]
+    return [
+        Match(index.terms.at[i, "value"], index.terms.at[i, "entity"], index.terms.at[i, "column"],
+              round(float(scores[i]), 3), "embedding")
+        for i in top
+    ]
+
+def resolve(
+    term: str,
+    *,
+    column: Optional[str] = None,
+    entity: Optional[str] = None,
+    use_embeddings: bool = True,
+) -> Resolution:
+    """
+    Map *term* onto stored values, optionally restricted to one *column* / *entity*.
+    Embeddings are only consulted when the cheaper tiers are not confident.
+    """
+    index = _load()
+    result = Resolution(term)
+    if index is None:
+        return result
+
+    def keep(ms: list[Match]) -> list[Match]:
+        return [m for m in ms if (column is None or m.column == column) and (entity is None or m.entity == entity)]
+
+    result.matches = keep(_lookup(index, lemma(term), fuzzy=True))
+    if not result.confident and use_embeddings:
+        try:
+            result.matches = sorted(result.matches + keep(_embedding_matches(index, term)), key=lambda m: -m.score)
+        except Exception as exc:
+            log.debug("Vocabulary embedding lookup failed for %r: %s", term, exc)
+    result.matches.sort(key=lambda m: -m.score)
+    return result
+
+
+def find_mentions(question: str, columns: Optional[set[str]] = None) -> list[Resolution]:
+    """Longest-first, non-overlapping n-gram scan of the question (no fuzzy/embedding tier)."""
+    index = _load()
+    if index is None:
+        return []
+    text = f" {lemma(question)} "
+    for name in index.ignore:
+        text = text.replace(f" {name} ", " ")
+    words = text.split()
+    taken = [False] * len(words)
+    found: list[tuple[int, Resolution]] = []
+    for n in range(min(MAX_NGRAM, len(words)), 0, -1):
+        for start in range(len(words) - n + 1):
+            if any(taken[start:start + n]):
+                continue
+            phrase = " ".join(words[start:start + n])
+            matches = [m for m in _lookup(index, phrase, fuzzy=False) if columns is None or m.column in columns]
+            if matches:
+                found.append((start, Resolution(phrase, matches)))
+                taken[start:start + n] = [True] * n
+    return [r for _, r in sorted(found, key=lambda x: x[0])]
+
+# ---------------------------------------------------------------------------
+# Structure & parameter checks
+# ---------------------------------------------------------------------------
+def _dominant_entity(matches: list[Match]) -> str:
+    counts: dict[str, int] = {}
+    for m in matches:
+        counts[m.entity] = counts.get(m.entity, 0) + 1
+    return max(counts, key=counts.get)
+
+def local_structure(question: str, analysis_type: Optional[str]) -> Optional[dict]:
+    """
+    Semantic structure built from the vocabulary alone, or None when the LLM is needed
+    (unknown analysis shape, too few/many groups, ambiguous location filters).
+    """
+    if not LOCAL_STRUCTURE or analysis_type not in LOCAL_GROUPS:
+        return None
+    mentions = find_mentions(question, {"Category", "Category2", "Location1", "Location2"})
+    groups = [r for r in mentions if any(m.column in ("Category", "Category2") for m in r.matches)]
+    places = [r for r in mentions if r not in groups]
+    low, high = LOCAL_GROUPS[analysis_type]
+    if not (low <= len(groups) <= high) or (places and len(groups) != 1):
+        return None
+
+    nodes = []
+    for role, group in zip("AB", groups):
+        matches = [m for m in group.matches if m.column in ("Category", "Category2")]
+        entity = _dominant_entity(matches)
+        node = {
+            "type": ENTITY_TYPE[entity],
+            "categories": list(dict.fromkeys(m.value for m in matches if m.entity == entity)),
+            "filters": {},
+        }
+        if len(groups) == 2:
+            node["role"] = role
+        for place in places:
+            loc = [m for m in place.matches if m.entity == entity]
+            if not loc:
+                return None
+            prefix = "site_" if entity == "Sites" else "feature_"
+            node["filters"][prefix + loc[0].column] = loc[0].value
+        nodes.append(node)
+    log.info("Vocabulary: local structure for %s (%s)", analysis_type, ", ".join(g.term for g in groups))
+    return {"analysis_types": [analysis_type], "nodes": nodes, "metrics": [], "execution_flow": [], "source": "vocabulary"}
+
+
+def _group_target(analysis_type: str, params: dict, key: str) -> tuple[Optional[str], str]:
+    """(entity, column) the labels of *key* (group_a / group_b) are compared with."""
+    if analysis_type in ("colocation", "spatial_distance"):
+        kind = params.get(f"{key}_type") or "feature"
+        return ("Sites" if str(kind).lower().startswith("site") else "Features"), "Category"
+    column = params.get("group_column") or "feature_Category"
+    prefix, _, name = str(column).partition("_")
+    return ("Sites" if prefix == "site" else "Features"), name or "Category"
+
+def validate_params(analysis_type: str, params: dict) -> dict:
+    """
+    Replace group labels by the stored values they resolve to (concept names expand
+    to all members); raise ``VocabularyError`` if a requested group ends up empty.
+    """
+    if _load() is None or not isinstance(params, dict):
+        return params
+    checked = dict(params)
+    for key in ("group_a", "group_b"):
+        labels = checked.get(key)
+        if not labels:
+            continue
+        labels = [labels] if isinstance(labels, str) else list(labels)
+        entity, column = _group_target(analysis_type, checked, key)
+        values, unknown = [], []
+        for label in labels:
+            res = resolve(str(label), column=column, entity=entity)
+            (values.extend(res.values) if res.confident else unknown.append(label))
+        if unknown:
+            log.warning("Vocabulary: %s labels not in %s.%s: %s", key, entity, column, unknown)
+        if not values:
+            raise VocabularyError(f"{key}: none of {labels} exists in {entity}.{column}")
+        checked[key] = list(dict.fromkeys(values))
+
+    for side in ("a", "b"):
+        column, value = checked.get(f"filter_{side}_column"), checked.get(f"filter_{side}_value")
+        if not column or value is None or not isinstance(value, str):
+            continue
+        prefix, _, name = str(column).partition("_")
+        res = resolve(value, column=name, entity="Sites" if prefix == "site" else "Features")
+        if res.confident:
+            checked[f"filter_{side}_value"] = res.matches[0].value
+        elif res.matches or name in {c for cols in VOCAB_COLUMNS.values() for c in cols}:
+            raise VocabularyError(f"filter_{side}_value: {value!r} does not exist in {column}")
+    return checked
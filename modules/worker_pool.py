@@ -0,0 +1,273 @@
+"""
+Warmer Worker-Pool für die generierten Analyse-Skripte
+------------------------------------------------------
+* Statt pro Analyse einen kalten ``python``-Prozess zu starten, halten
+  ``ANALYSIS_WORKERS`` vorgestartete Prozesse geopandas, shapely, esda, libpysal,
+  pointpats, scipy … bereits importiert
+* Pro Job: eigener ``__main__``-Namespace, eigene Umgebungsvariablen
+  (``extra_env``) und Arbeitsverzeichnis (``cwd``), stdout/stderr auf Dateideskriptor-Ebene mitgeschnitten –
+  Rückgabe wie bisher ``(stdout, stderr)``
+* Timeout je Job (Worker wird dann beendet und ersetzt), optionales
+  Speicherlimit (``RLIMIT_AS``) und Recycling nach ``ANALYSIS_WORKER_MAX_JOBS``
+  Jobs bzw. oberhalb ``ANALYSIS_WORKER_MAX_RSS_MB``
+* Zuletzt gelesene Analyse-Eingaben bleiben im Worker gecacht
+  (``analysis_io.read_analysis_table``)
+* Nur für Fragen direkt im Streamlit-Prozess (``ANALYSIS_JOBS=0``, dann Standard an);
+  Hintergrund-Jobs starten selbst vorgewärmt und lassen den Pool aus (``modules.jobs``),
+  dort gilt das Speicherlimit für den ganzen Job-Prozess (``set_memory_limit``)
+
+Einfache Nutzung:  ▸  from modules.worker_pool import run_in_pool
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from pathlib import Path
+from multiprocessing.connection import Connection
+from typing import Optional
+
+from modules.logger import get_logger
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+_JOBS = os.getenv("ANALYSIS_JOBS", "1").lower() in {"1", "true", "yes"}
+POOL_ENABLED = os.getenv("ANALYSIS_WORKER_POOL", "0" if _JOBS else "1").lower() in {"1", "true", "yes"}
+POOL_SIZE = int(os.getenv("ANALYSIS_WORKERS", "2"))
+MAX_JOBS = int(os.getenv("ANALYSIS_WORKER_MAX_JOBS", "50"))            # recycle after N jobs
+MAX_RSS_MB = int(os.getenv("ANALYSIS_WORKER_MAX_RSS_MB", "2048"))      # recycle above this RSS
+MEMORY_LIMIT_MB = int(os.getenv("ANALYSIS_WORKER_MEMORY_MB", "0"))     # hard RLIMIT_AS, 0 = none
+JOB_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "900"))
+START_TIMEOUT = 120.0
+INPUT_CACHE = 2                                                          # analysis inputs kept per worker
+PRELOAD = [
+    "numpy", "pandas", "pyarrow", "scipy.spatial", "scipy.stats", "shapely",
+    "geopandas", "libpysal", "esda", "pointpats", "matplotlib",
+    "modules.analysis_io",
+]
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# ---------------------------------------------------------------------------
+# Worker process
+# ---------------------------------------------------------------------------
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _run_job(code: str, extra_env: dict, cwd: Optional[str] = None) -> tuple[str, str]:
+    """Execute *code* like ``python script.py`` would (in *cwd*); stdout/stderr captured via fd 1/2."""
+    saved_env, saved_cwd, saved_argv = dict(os.environ), os.getcwd(), sys.argv
+    saved_fds = os.dup(1), os.dup(2)
+    with tempfile.TemporaryDirectory() as td:
+        script = Path(td) / "gpt_script.py"
+        script.write_text(code, encoding="utf-8")
+        out_path, err_path = Path(td) / "stdout", Path(td) / "stderr"
+        with open(out_path, "wb") as out, open(err_path, "wb") as err:
+            sys.stdout.flush(); sys.stderr.flush()
+            os.dup2(out.fileno(), 1); os.dup2(err.fileno(), 2)
+            try:
+                os.environ.update({k: str(v) for k, v in extra_env.items()})
+                if cwd:
+                    os.chdir(cwd)
+                sys.argv = [str(script)]
+                namespace = {"__name__": "__main__", "__file__": str(script), "__builtins__": __builtins__}
+                try:
+                    exec(compile(code, str(script), "exec"), namespace)
+                except SystemExit as exc:
+                    if exc.code not in (None, 0) and not isinstance(exc.code, int):
+                        print(exc.code, file=sys.stderr)
+                except BaseException:
+                    traceback.print_exc()
+                finally:
+                    if "matplotlib.pyplot" in sys.modules:   # figures would pile up across jobs
+                        sys.modules["matplotlib.pyplot"].close("all")
+            finally:
+                sys.stdout.flush(); sys.stderr.flush()
+                os.dup2(saved_fds[0], 1); os.dup2(saved_fds[1], 2)
+                os.close(saved_fds[0]); os.close(saved_fds[1])
+                os.environ.clear(); os.environ.update(saved_env)
+                os.chdir(saved_cwd)
+                sys.argv = saved_argv
+        return (out_path.read_text(encoding="utf-8", errors="replace"),
+                err_path.read_text(encoding="utf-8", errors="replace"))
+
+def set_memory_limit(memory_limit_mb: int = MEMORY_LIMIT_MB) -> None:
+    """Hard ``RLIMIT_AS`` for this process and its children (pool workers, job processes); 0 = none."""
+    if memory_limit_mb:
+        import resource
+
+        limit = memory_limit_mb * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _worker_main(conn, memory_limit_mb: int, max_rss_mb: int) -> None:
+    set_memory_limit(memory_limit_mb)
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    started = time.perf_counter()
+    for name in PRELOAD:
+        try:
+            __import__(name)
+        except Exception:                                    # noqa: BLE001 - optional libraries
+            pass
+    from modules import analysis_io
+
+    analysis_io.INPUT_CACHE_SIZE = INPUT_CACHE
+    conn.send(("ready", os.getpid(), round(time.perf_counter() - started, 2)))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        code, extra_env, cwd = message
+        stdout, stderr = _run_job(code, extra_env, cwd)
+        conn.send(("done", stdout, stderr, _rss_mb() > max_rss_mb))
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+class _Worker:
+    """One ``python -m modules.worker_pool`` process, talking over a socket pair."""
+
+    def __init__(self) -> None:
+        parent, child = socket.socketpair()
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(
+            p for p in [str(PROJECT_ROOT), os.environ.get("PYTHONPATH", "")] if p
+        )}
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "modules.worker_pool", str(child.fileno()),
+             str(MEMORY_LIMIT_MB), str(MAX_RSS_MB)],
+            pass_fds=[child.fileno()], env=env, stdin=subprocess.DEVNULL,
+        )
+        child.close()
+        self.conn = Connection(parent.detach())
+        self.jobs = 0
+        self.ready = False
+
+    def _recv(self, what: str):
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.process.wait(timeout=2)
+            raise RuntimeError(f"analysis worker {what} (exit code {self.process.returncode})") from None
+
+    def wait_ready(self) -> None:
+        if self.ready:
+            return
+        if not self.conn.poll(START_TIMEOUT):
+            self.kill()
+            raise RuntimeError("analysis worker did not start")
+        _, pid, seconds = self._recv("did not start")
+        self.ready = True
+        log.info("Analysis worker %s ready (imports %.2fs)", pid, seconds)
+
+    def run(self, code: str, extra_env: dict, cwd: Optional[str], timeout: float) -> tuple[str, str, bool]:
+        self.wait_ready()
+        self.conn.send((code, extra_env, cwd))
+        if not self.conn.poll(timeout):
+            self.kill()
+            raise subprocess.TimeoutExpired("analysis worker", timeout)
+        _, stdout, stderr, over_memory = self._recv("died")
+        self.jobs += 1
+        return stdout, stderr, over_memory or self.jobs >= MAX_JOBS
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.process.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.conn.close()
+
+
+class WorkerPool:
+    """Fixed number of warm workers; a broken, timed-out or exhausted worker is replaced."""
+
+    def __init__(self, size: int = POOL_SIZE) -> None:
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        self._lock = threading.Lock()
+        self._all: list[_Worker] = []
+        for _ in range(max(1, size)):
+            self._spawn()
+
+    def _spawn(self) -> None:
+        worker = _Worker()
+        with self._lock:
+            self._all.append(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker: _Worker, *, replace: bool = True) -> None:
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+        threading.Thread(target=worker.stop, daemon=True).start()     # don't block the caller
+        if replace:
+            self._spawn()
+
+    def run(
+        self, code: str, extra_env: Optional[dict] = None, timeout: float = JOB_TIMEOUT, cwd: Optional[Path] = None
+    ) -> tuple[str, str]:
+        worker = self._idle.get()
+        try:
+            stdout, stderr, recycle = worker.run(code, extra_env or {}, str(Path(cwd).resolve()) if cwd else None, timeout)
+        except Exception:
+            self._retire(worker)
+            raise
+        if recycle:
+            log.info("Recycling analysis worker %s after %d jobs", worker.process.pid, worker.jobs)
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+        return stdout, stderr
+
+    def close(self) -> None:
+        with self._lock:
+            workers, self._all = list(self._all), []
+        for worker in workers:
+            worker.stop()
+
+
+_POOL: Optional[WorkerPool] = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool() -> WorkerPool:
+    """Process-wide pool, started on first use (workers import in the background)."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = WorkerPool()
+            atexit.register(_POOL.close)
+        return _POOL
+
+def run_in_pool(
+    code: str, extra_env: Optional[dict] = None, timeout: float = JOB_TIMEOUT, cwd: Optional[Path] = None
+) -> tuple[str, str]:
+    """Run a cleaned analysis script in a warm worker (working directory *cwd*); returns ``(stdout, stderr)``."""
+    return get_pool().run(code, extra_env, timeout, cwd)
+
+
+if __name__ == "__main__":            # worker process (started by _Worker, never by hand)
+    _worker_main(Connection(int(sys.argv[1])), int(sys.argv[2]), int(sys.argv[3]))
@@ -0,0 +1,308 @@
+"""
+Arbeitsbereiche pro Anfrage
+---------------------------
+Jede Frage bekommt eine eigene ID und ein eigenes Verzeichnis statt der festen
+Pfade unter ``results/`` – parallele Sitzungen und Analysen überschreiben sich
+nicht mehr gegenseitig:
+
+* ``results/workspaces/<id>/results/`` – Ergebnis-JSONs und Karten-GeoJSONs
+  (gleiche Struktur wie bisher ``results/``; generierte Skripte laufen dort)
+* ``llm/`` – Protokolle der LLM-Aufrufe (``log_result``), ``run.log`` – alle
+  Log-Zeilen dieser Anfrage
+* ``manifest.json`` – Frage, Status, Eingabedateien, Ausgaben, GeoJSONs und
+  Fehler je Analyse
+* Aufräumen nach Alter (``WORKSPACE_MAX_AGE_H``) und Gesamtgröße
+  (``WORKSPACE_MAX_MB``); laufende Arbeitsbereiche bleiben unangetastet.
+  Höchstens alle ``CLEANUP_INTERVAL`` Sekunden über alle Prozesse (Job-Prozesse
+  öffnen nur einen Arbeitsbereich), gemerkt über ``.last_cleanup``
+* Globale Obergrenze gleichzeitig laufender Analysen über alle Sitzungen und
+  Job-Prozesse (``MAX_CONCURRENT_ANALYSES``): ein Platz = eine gesperrte Datei
+  ``.slots/<n>.lock`` (``flock``, bei Prozessende automatisch frei)
+
+Einfache Nutzung:  ▸  from modules.workspace import open_workspace
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from modules.logger import BASE_FORMAT, get_logger
+
+try:
+    import fcntl
+except ImportError:                                 # no flock (Windows) → slots per process only
+    fcntl = None
+
+log = get_logger(__name__)
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+WORKSPACE_DIR = Path(os.getenv("WORKSPACE_PATH", "results/workspaces"))
+INPUT_DIR = Path("results/inputs")                  # extractions, shared between workspaces by content key
+WORKSPACE_MAX_AGE_H = float(os.getenv("WORKSPACE_MAX_AGE_H", "24"))
+WORKSPACE_MAX_MB = float(os.getenv("WORKSPACE_MAX_MB", "2000"))
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "8"))    # 0 = no limit
+CLEANUP_INTERVAL = 600              # seconds between cleanups, across processes (mtime of .last_cleanup)
+SLOT_POLL = 0.1                     # seconds between attempts to get an analysis slot
+
+_current: contextvars.ContextVar[Optional["Workspace"]] = contextvars.ContextVar("workspace", default=None)
+_active: set[str] = set()
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_ANALYSES) if MAX_CONCURRENT_ANALYSES > 0 else None   # no fcntl
+
+# ---------------------------------------------------------------------------
+# Workspace
+# ---------------------------------------------------------------------------
+class Workspace:
+    """Directory and manifest of one request; safe to update from several pipeline threads."""
+
+    def __init__(self, path: Path, manifest: dict):
+        self.path = path
+        self.id = manifest["id"]
+        self.manifest = manifest
+        self._lock = threading.RLock()             # re-entered by a signal handler closing the workspace
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    @property
+    def results_dir(self) -> Path:
+        return self.path / "results"
+
+    @property
+    def llm_dir(self) -> Path:
+        return self.path / "llm"
+
+    @property
+    def log_path(self) -> Path:
+        return self.path / "run.log"
+
+    def _save(self) -> None:
+        tmp = self.path / f".manifest.{threading.get_ident()}.tmp"
+        tmp.write_text(json.dumps(self.manifest, indent=2, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, self.path / "manifest.json")
+
+    def record_input(self, key: str, path: Path, *, where_clause: str, return_clause: str, reused: bool) -> None:
+        with self._lock:
+            self.manifest["inputs"][key] = {
+                "path": str(path), "where": where_clause, "return": return_clause, "reused": reused,
+            }
+            self._save()
+
+    def outputs(self, analysis_type: str) -> list[str]:
+        """Files written for *analysis_type* (summary JSON, layers, tables), relative to the workspace."""
+        folders = [self.results_dir / analysis_type, self.results_dir / "visualisierung" / analysis_type]
+        return sorted(str(f.relative_to(self.path)) for d in folders if d.is_dir() for f in d.iterdir() if f.is_file())
+
+    def record_analysis(self, entry: dict[str, Any]) -> None:
+        with self._lock:
+            self.manifest["analyses"].append(entry)
+            self._save()
+
+    def write_log(self, line: str) -> None:
+        with self._lock:
+            if not self._log.closed:
+                self._log.write(line + "\n")
+                self._log.flush()
+
+    @contextmanager
+    def active(self) -> Iterator["Workspace"]:
+        """Make this the current workspace of the calling context (LLM logs, ``run.log``)."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def close(self, status: str = "done") -> None:
+        with self._lock:
+            self.manifest.update(status=status, finished_at=time.time(), size=_size(self.path))
+            self._save()
+            self._log.close()
+        with _lock:
+            _active.discard(self.id)
+
+
+class _WorkspaceLogHandler(logging.Handler):
+    """Copies every record emitted inside a workspace context into its ``run.log``."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        workspace = _current.get()
+        if workspace is not None:
+            try:
+                workspace.write_log(self.format(record))
+            except Exception:                               # noqa: BLE001 - logging must not fail
+                self.handleError(record)
+
+
+_handler = _WorkspaceLogHandler()
+_handler.setFormatter(logging.Formatter(BASE_FORMAT))
+for _name in ("", "debug"):                               # "debug" does not propagate to root
+    logging.getLogger(_name).addHandler(_handler)
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+def _running(path: Path) -> bool:
+    """Manifest still says ``running`` (possibly a job process other than this one)."""
+    try:
+        return json.loads((path / "manifest.json").read_text(encoding="utf-8")).get("status") == "running"
+    except (OSError, ValueError):
+        return False
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+def _cleanup_due() -> bool:
+    """True at most once per ``CLEANUP_INTERVAL`` for all processes sharing ``WORKSPACE_DIR``."""
+    stamp = WORKSPACE_DIR / ".last_cleanup"
+    try:
+        if time.time() - stamp.stat().st_mtime < CLEANUP_INTERVAL:
+            return False
+    except FileNotFoundError:
+        WORKSPACE_DIR.mkdir(parents=True, exist_ok=True)
+    stamp.touch()                       # claim it before cleaning so concurrent openers skip
+    return True
+
+def _lock_slot() -> Optional[Any]:
+    """
+    Lock a free ``.slots/<n>.lock`` without blocking; returns the open file holding the lock.
+    ``flock`` locks belong to the open file, so threads of one process exclude each other
+    as well as other processes, and a crashed process frees its slot.
+    """
+    slot_dir = WORKSPACE_DIR / ".slots"
+    slot_dir.mkdir(parents=True, exist_ok=True)
+    for n in range(MAX_CONCURRENT_ANALYSES):
+        fh = open(slot_dir / f"{n}.lock", "a")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fh
+        except OSError:
+            fh.close()
+    return None
+
+def _acquire_slot() -> Optional[Any]:
+    if fcntl is None:
+        return _slots if _slots.acquire(blocking=False) else None
+    return _lock_slot()
+
+def _release_slot(slot: Any) -> None:
+    if slot is _slots:
+        _slots.release()
+    else:
+        slot.close()                                # closing the file drops the flock
+
+def current_workspace() -> Optional[Workspace]:
+    return _current.get()
+
+def llm_log_dir() -> str:
+    """Target of ``log_result``: the current workspace, else ``results/`` as before."""
+    workspace = _current.get()
+    return str(workspace.llm_dir) if workspace else "results"
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def open_workspace(question: str, *, session: Optional[str] = None) -> Workspace:
+    """New workspace ``<timestamp>-<random>`` for *question* (cleans up old ones when due)."""
+    if _cleanup_due():
+        try:
+            cleanup_workspaces()
+        except OSError as exc:
+            log.warning("Workspace cleanup failed: %s", exc)
+
+    workspace_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = WORKSPACE_DIR / workspace_id
+    (path / "results").mkdir(parents=True)
+    manifest = {
+        "id": workspace_id,
+        "question": question,
+        "session": session,
+        "status": "running",
+        "created_at": time.time(),
+        "finished_at": None,
+        "logs": {"run": "run.log", "llm": "llm/"},
+        "inputs": {},
+        "analyses": [],
+    }
+    workspace = Workspace(path, manifest)
+    workspace._save()
+    with _lock:
+        _active.add(workspace_id)
+    log.info("Workspace %s opened", workspace_id)
+    return workspace
+
+
+def cleanup_workspaces(
+    max_age_h: float = WORKSPACE_MAX_AGE_H, max_mb: float = WORKSPACE_MAX_MB
+) -> int:
+    """
+    Remove finished workspaces older than *max_age_h*, then the oldest ones until all
+    workspaces fit *max_mb*; shared extraction files unused for *max_age_h* go as well.
+    Running workspaces are kept unless untouched for *max_age_h* (their process died).
+    Returns the number of workspaces removed.
+    """
+    with _lock:
+        active = set(_active)
+    cutoff = time.time() - max_age_h * 3600
+    folders = sorted((p for p in WORKSPACE_DIR.glob("*")
+                      if p.is_dir() and p.name not in active and not p.name.startswith(".")),     # .slots
+                     key=lambda p: p.stat().st_mtime)
+    removed = [p for p in folders if p.stat().st_mtime < cutoff]
+    folders = [p for p in folders if p in removed or not _running(p)]
+    kept = [(p, _size(p)) for p in folders if p not in removed]
+    total = sum(size for _, size in kept)
+    budget = int(max_mb * 1024 * 1024)
+    for path, size in kept:
+        if total <= budget:
+            break
+        removed.append(path)
+        total -= size
+    for path in removed:
+        _remove(path)
+
+    stale_inputs = [f for f in INPUT_DIR.glob("*") if f.is_file() and f.stat().st_mtime < cutoff]
+    for path in stale_inputs:
+        _remove(path)
+    if removed or stale_inputs:
+        log.info("Workspace cleanup: %d workspaces, %d input files removed", len(removed), len(stale_inputs))
+    return len(removed)
+
+
+@asynccontextmanager
+async def analysis_slot() -> AsyncIterator[None]:
+    """
+    One of ``MAX_CONCURRENT_ANALYSES`` slots shared by all sessions, event loops and
+    job processes using the same ``WORKSPACE_DIR`` (per process only without ``fcntl``).
+    """
+    if MAX_CONCURRENT_ANALYSES <= 0:
+        yield
+        return
+    waiting = False
+    while (slot := _acquire_slot()) is None:
+        if not waiting:
+            log.info("All %d analysis slots busy → waiting", MAX_CONCURRENT_ANALYSES)
+            waiting = True
+        await asyncio.sleep(SLOT_POLL)
+    try:
+        yield
+    finally:
+        _release_slot(slot)
@@ -0,0 +1,28 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+CATEGORIES = ["well", "hut", "tumulus"]
+
+
+@pytest.fixture
+def features() -> gpd.GeoDataFrame:
+    """60 synthetic features on 12 sites in a 10 km square (EPSG:32636, fixed seed)."""
+    rng = np.random.default_rng(7)
+    n = 60
+    x = rng.uniform(400_000, 410_000, n)
+    y = rng.uniform(2_000_000, 2_010_000, n)
+    site = rng.integers(0, 12, n)
+    df = pd.DataFrame({
+        "FeatureID": [f"F{i:03d}" for i in range(n)],
+        "SiteID": [f"S{s:02d}" for s in site],
+        "feature_X": x,
+        "feature_Y": y,
+        "feature_Category": rng.choice(CATEGORIES, n),
+        "feature_Height": rng.gamma(2.0, 1.5, n),
+        "site_Category": np.where(site % 2, "cemetery", "settlement"),
+        "site_NoOfFeatures": rng.integers(1, 40, n),
+        "site_Shape_Area": rng.uniform(50, 5000, n),
+    })
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(x, y), crs="EPSG:32636")
@@ -0,0 +1,105 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+
+from modules.analysis import ANALYSES, AnalysisError, run_analysis
+
+PARAMS = {
+    "autocorrelation":  {"value_column": "feature_Height", "distance_threshold": 3000},
+    "colocation":       {"group_a": ["well"], "group_b": ["hut"], "distance_threshold": 2000},
+    "correlation":      {"x_column": "site_NoOfFeatures", "y_column": "site_Shape_Area"},
+    "hotspot":          {"value_column": "feature_Height", "distance_threshold": 3000},
+    "ripley_k":         {"simulations": 19, "intervals": 5},
+    "spatial_distance": {"group_a": ["well"], "group_b": ["tumulus"], "distance_threshold": 1000},
+}
+SUMMARY_KEYS = {
+    "autocorrelation":  {"I", "z", "p_sim", "n", "value_column", "n_significant_local"},
+    "colocation":       {"n_a", "n_b", "within_a", "within_b", "join_count", "p_value"},
+    "correlation":      {"pearson_r", "spearman_r", "p_value", "n"},
+    "hotspot":          {"value_column", "n_total", "n_hotspots", "n_coldspots"},
+    "ripley_k":         {"n", "r_max", "r_values", "k_values"},
+    "spatial_distance": {"mean_distance", "median_distance", "n_pairs", "share_within_threshold"},
+}
+LAYERS = {
+    "autocorrelation":  {"autocorrelation_result"},
+    "colocation":       {"colocation_group_a", "colocation_group_b"},
+    "correlation":      set(),
+    "hotspot":          {"hotspot_map"},
+    "ripley_k":         {"ripley_k_result"},
+    "spatial_distance": {"spatial_distance_result"},
+}
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    np.random.seed(0)                       # esda's global Moran permutations
+
+
+def test_params_cover_every_analysis():
+    assert set(PARAMS) == set(ANALYSES)
+
+
+@pytest.mark.parametrize("analysis_type", sorted(PARAMS))
+def test_analysis_result(analysis_type, features):
+    out = run_analysis(analysis_type, features, PARAMS[analysis_type])
+
+    assert out.analysis_type == analysis_type
+    assert SUMMARY_KEYS[analysis_type] <= set(out.summary)
+    assert set(out.layers) == LAYERS[analysis_type]
+    for layer in out.layers.values():
+        assert isinstance(layer, gpd.GeoDataFrame) and not layer.empty
+        assert layer.crs == features.crs
+    assert out.to_text()
+
+
+def test_analysis_is_deterministic(features):
+    first = run_analysis("colocation", features, PARAMS["colocation"]).summary
+    assert run_analysis("colocation", features, PARAMS["colocation"]).summary == first
+
+
+def test_spatial_distance_matches_brute_force(features):
+    out = run_analysis("spatial_distance", features, PARAMS["spatial_distance"])
+    a = features[features["feature_Category"] == "well"]
+    b = features[features["feature_Category"] == "tumulus"]
+    expected = [b.distance(p).min() for p in a.geometry]
+    assert out.summary["mean_distance"] == pytest.approx(np.mean(expected))
+    assert out.summary["n_pairs"] == len(a)
+
+
+@pytest.mark.parametrize("analysis_type", sorted(PARAMS))
+def test_empty_input(analysis_type, features):
+    with pytest.raises(AnalysisError):
+        run_analysis(analysis_type, features.iloc[:0], PARAMS[analysis_type])
+
+
+@pytest.mark.parametrize("analysis_type, column", [
+    ("autocorrelation", "feature_Height"),
+    ("colocation", "feature_Category"),
+    ("correlation", "site_Shape_Area"),
+    ("hotspot", "feature_Height"),
+    ("spatial_distance", "feature_Category"),
+])
+def test_missing_column(analysis_type, column, features):
+    data = features.drop(columns=[column])
+    with pytest.raises(AnalysisError, match="missing columns"):
+        run_analysis(analysis_type, data, PARAMS[analysis_type])
+
+
+@pytest.mark.parametrize("analysis_type", ["colocation", "spatial_distance"])
+def test_single_group(analysis_type, features):
+    only_a = features.assign(feature_Category="well")
+    with pytest.raises(AnalysisError, match="empty"):
+        run_analysis(analysis_type, only_a, PARAMS[analysis_type])
+
+
+def test_single_group_autocorrelation(features):
+    only_a = features.assign(feature_Category="well")
+    params = {"group_a": ["well"], "group_b": ["hut"], "distance_threshold": 3000}
+    with pytest.raises(AnalysisError, match="zero variance"):
+        run_analysis("autocorrelation", only_a, params)
+
+
+def test_ripley_k_single_location(features):
+    stacked = features.assign(geometry=gpd.points_from_xy([400_000.0] * len(features), [2_000_000.0] * len(features)))
+    with pytest.raises(AnalysisError, match="same location"):
+        run_analysis("ripley_k", stacked, PARAMS["ripley_k"])
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+
+import modules.analysis.cache as cache
+import modules.llm as llm
+import modules.orchestrator as orchestrator
+import modules.workspace as workspace
+from modules.analysis_io import write_analysis_input
+
+WHERE, RETURN = "f.Category = 'well'", "f.X AS feature_X, f.Y AS feature_Y"
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    """Workspaces and shared inputs under *tmp_path*; ``extract`` replaced by a controllable fake."""
+    inputs = tmp_path / "inputs"
+    monkeypatch.setattr(workspace, "WORKSPACE_DIR", tmp_path / "workspaces")
+    monkeypatch.setattr(workspace, "INPUT_DIR", inputs)
+    monkeypatch.setattr(orchestrator, "INPUT_DIR", inputs)
+    monkeypatch.setattr(orchestrator, "current_import_version", lambda: 1)
+    env = SimpleNamespace(fail=False, calls=[], inputs=inputs)
+
+    def extract(where_clause, return_clause, backend=None):
+        env.calls.append(where_clause)
+        if env.fail:
+            raise RuntimeError("Neo4j unavailable")
+        return pa.table({"feature_X": [400_000.0], "feature_Y": [2_000_000.0]}), "duckdb"
+
+    monkeypatch.setattr(llm, "extract", extract)
+    return env
+
+
+def _get(where: str = WHERE):
+    """Resolve one extraction through a fresh ``_SharedExtractions`` (= a new request)."""
+    async def run():
+        ws = workspace.open_workspace("test")
+        try:
+            extractions = orchestrator._SharedExtractions(orchestrator._Runner(1), ws)
+            path = await extractions.get(where, RETURN, None)
+            return path, ws.manifest["inputs"][path.stem]
+        finally:
+            ws.close()
+    return asyncio.run(run())
+
+
+def test_failed_extraction_writes_nothing_and_is_not_reused(env):
+    env.fail = True
+    with pytest.raises(RuntimeError, match="unavailable"):
+        _get()
+    assert not list(env.inputs.glob("*.arrow"))
+
+    env.fail = False
+    path, entry = _get()
+    assert entry["reused"] is False and len(env.calls) == 2
+    assert pa.ipc.open_file(pa.memory_map(str(path))).read_all().num_rows == 1
+
+
+def test_successful_extraction_is_reused(env):
+    first, entry = _get()
+    assert entry["reused"] is False
+    second, entry = _get()
+    assert second == first and entry["reused"] is True
+    assert len(env.calls) == 1
+
+
+def test_columnless_file_from_old_failure_is_extracted_again(env):
+    path, _ = _get()
+    write_analysis_input(pa.table({}), path)             # what a failed run used to leave behind
+    _, entry = _get()
+    assert entry["reused"] is False and len(env.calls) == 2
+
+
+def test_input_digest_matches_sha256(tmp_path):
+    path = tmp_path / "input.arrow"
+    data = bytes(range(256)) * 10_000                    # > one 1 MiB read
+    path.write_bytes(data)
+    assert cache.input_digest(path) == hashlib.sha256(data).hexdigest()
+
+
+def test_analysis_cache_reads_import_version_once(features, tmp_path, monkeypatch):
+    """An import locking DuckDB after the first read must not break lookup/store."""
+    monkeypatch.setattr(cache, "ANALYSIS_CACHE_DIR", tmp_path / "results")
+    versions = iter([1])
+    monkeypatch.setattr(cache, "current_import_version", lambda: next(versions))
+    path = write_analysis_input(pa.Table.from_pandas(features.drop(columns="geometry"), preserve_index=False),
+                                tmp_path / "input.arrow")
+    params = {"x_column": "site_NoOfFeatures", "y_column": "site_Shape_Area"}
+
+    output, cached = cache.cached_run("correlation", path, params)
+    assert not cached and output.summary["n"] == len(features)
+
+    monkeypatch.setattr(cache, "current_import_version", lambda: 1)
+    assert cache.cached_run("correlation", path, params)[1] is True
@@ -0,0 +1,66 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from modules.analysis import ANALYSES, input_columns, run_analysis
+from modules.analysis_io import write_analysis_input
+from modules.extraction import split_return_items
+from modules.llm import ALLOWED_FEATURE_KEYS, ALLOWED_SITE_KEYS, prune_return_clause, required_columns
+
+# What the extraction LLM typically returns: everything, including heavy properties
+FULL_RETURN = ", ".join(
+    [f"f.{k} AS feature_{k}" if k != "FeatureID" else "f.FeatureID AS FeatureID" for k in sorted(ALLOWED_FEATURE_KEYS)]
+    + [f"s.{k} AS site_{k}" if k != "SiteID" else "s.SiteID AS SiteID" for k in sorted(ALLOWED_SITE_KEYS)]
+)
+MINIMAL_RETURN = "f.FeatureID AS FeatureID, s.SiteID AS SiteID"
+
+CASES = [
+    ("autocorrelation", {"value_column": "feature_Height"}),
+    ("autocorrelation", {"group_a": ["well"], "group_b": ["hut"]}),
+    ("autocorrelation", {}),
+    ("colocation", {"group_a": ["well"], "group_b": ["hut"]}),
+    ("colocation", {"group_a": ["cemetery"], "group_a_type": "site", "group_b": ["hut"],
+                    "filter_b_column": "site_Category", "filter_b_value": "settlement"}),
+    ("correlation", {}),
+    ("correlation", {"x_column": "feature_Height", "y_column": "site_Shape_Area"}),
+    ("hotspot", {"value_column": "feature_Height"}),
+    ("hotspot", {}),
+    ("ripley_k", {"simulations": 9, "intervals": 4}),
+    ("spatial_distance", {"group_a": ["well"], "group_b": ["tumulus"]}),
+    ("spatial_distance", {"group_a": ["cemetery"], "group_a_type": "site", "group_b": ["hut"]}),
+]
+
+
+def _aliases(return_clause: str) -> set[str]:
+    return {item.rsplit(" AS ", 1)[-1].strip() for item in split_return_items(return_clause)}
+
+
+def test_cases_cover_every_analysis():
+    assert {analysis_type for analysis_type, _ in CASES} == set(ANALYSES)
+
+
+def test_unknown_analysis_is_not_reduced():
+    assert required_columns("similarity", {}) is None
+    assert _aliases(prune_return_clause(FULL_RETURN, None)) == _aliases(FULL_RETURN) - {
+        "feature_embedding", "feature_geometry", "site_embedding", "site_geometry",
+    }
+
+
+@pytest.mark.parametrize("return_clause", [FULL_RETURN, MINIMAL_RETURN], ids=["full", "minimal"])
+@pytest.mark.parametrize("analysis_type, params", CASES)
+def test_pruning_keeps_analysis_columns(analysis_type, params, return_clause):
+    required = required_columns(analysis_type, params)
+    assert required == input_columns(analysis_type, params)
+    assert required <= _aliases(prune_return_clause(return_clause, required))
+
+
+@pytest.mark.parametrize("analysis_type, params", CASES)
+def test_analysis_runs_on_pruned_extraction(analysis_type, params, features, tmp_path):
+    """The analysis must not fail with a missing column on exactly what the pruned RETURN keeps."""
+    np.random.seed(0)
+    kept = sorted(_aliases(prune_return_clause(FULL_RETURN, required_columns(analysis_type, params))))
+    extraction = features.drop(columns="geometry").reindex(columns=kept)
+    path = write_analysis_input(pa.Table.from_pandas(extraction, preserve_index=False), tmp_path / "input.arrow")
+
+    out = run_analysis(analysis_type, path, params)
+    assert out.analysis_type == analysis_type
@@ -0,0 +1,48 @@
+import json
+
+import pandas as pd
+import pytest
+
+import modules.vocabulary as vocabulary
+
+VALUES = [
+    ("hut", "Features", "Category"),
+    ("well", "Features", "Category"),
+    ("khor", "Features", "Location1"),
+    ("ridge", "Features", "Location1"),
+]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    """Small on-disk index (no embeddings) read with the aliases and ignore list of config/vocabulary.yml."""
+    monkeypatch.setattr(vocabulary, "VOCAB_DIR", tmp_path)
+    monkeypatch.setattr(vocabulary, "_LOADED", {})
+    terms = pd.DataFrame(VALUES, columns=["value", "entity", "column"]).assign(count=1)
+    terms["lemma"] = terms["value"].map(vocabulary.lemma)
+    paths = vocabulary._paths()
+    terms.to_parquet(paths["terms"], index=False)
+    paths["manifest"].write_text(json.dumps({"n": len(terms), "embeddings": False}), encoding="utf-8")
+    return vocabulary._load()
+
+
+def _values(mentions) -> list[str]:
+    return [m.value for r in mentions for m in r.matches]
+
+
+def test_project_name_is_not_a_place(index):
+    assert _values(vocabulary.find_mentions("Bilden die Hütten im Wadi Abu Dom Hotspots?")) == ["hut"]
+
+
+def test_wadi_is_no_alias_for_khor(index):
+    assert "wadi" not in index.aliases
+    assert _values(vocabulary.find_mentions("Brunnen im Wadi")) == ["well"]
+    assert _values(vocabulary.find_mentions("Brunnen am khor")) == ["well", "khor"]
+
+
+def test_two_groups_in_the_wadi_stay_local(index, monkeypatch):
+    monkeypatch.setattr(vocabulary, "LOCAL_STRUCTURE", True)
+    structure = vocabulary.local_structure("Liegen Hütten im Wadi Abu Dom nahe bei Brunnen?", "colocation")
+    assert structure is not None
+    assert [n["categories"] for n in structure["nodes"]] == [["hut"], ["well"]]
+    assert all(not n["filters"] for n in structure["nodes"])
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+import modules.workspace as workspace
+
+# Another process (e.g. a second job) asking for a slot; prints whether it got one
+OTHER_PROCESS = "import modules.workspace as w; print(w._acquire_slot() is not None)"
+
+
+@pytest.fixture
+def one_slot(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace, "WORKSPACE_DIR", tmp_path)
+    monkeypatch.setattr(workspace, "MAX_CONCURRENT_ANALYSES", 1)
+    return tmp_path
+
+
+def _other_process_gets_slot(workspace_dir) -> bool:
+    env = {**os.environ, "WORKSPACE_PATH": str(workspace_dir), "MAX_CONCURRENT_ANALYSES": "1"}
+    out = subprocess.run([sys.executable, "-c", OTHER_PROCESS], env=env, capture_output=True, text=True, check=True)
+    return out.stdout.strip() == "True"
+
+
+@pytest.mark.skipif(workspace.fcntl is None, reason="slots are per process without fcntl")
+def test_analysis_slot_is_shared_between_processes(one_slot):
+    async def hold():
+        async with workspace.analysis_slot():
+            assert workspace._acquire_slot() is None           # same process, other thread/loop
+            return _other_process_gets_slot(one_slot)
+
+    assert asyncio.run(hold()) is False
+    assert _other_process_gets_slot(one_slot) is True
+
+
+def test_cleanup_keeps_slot_files(one_slot):
+    (one_slot / ".slots").mkdir()
+    (one_slot / ".slots" / "0.lock").touch()
+    workspace.cleanup_workspaces(max_age_h=0, max_mb=0)
+    assert (one_slot / ".slots" / "0.lock").exists()